@@ -0,0 +1,69 @@
+"""
+RepFlow — Benchmark de compressão das respostas
+===============================================
+Comprime uma listagem de pedidos (o mesmo JSON que a API envia) com o
+compressor do CompressaoMiddleware em vários níveis e mostra, por requisição:
+
+  • bytes no fio — resposta completa e em streaming (flush a cada bloco)
+  • CPU (ms)     — tempo de processo gasto comprimindo a resposta completa
+
+brotli só aparece se o pacote `brotli` estiver instalado.
+
+Uso: python benchmark_compressao.py [--pedidos 1000] [--repeticoes 20] [--bloco 16384]
+"""
+
+import argparse
+import statistics
+import time
+
+from benchmark_json import gerar_pedidos, preparar_depois
+from compressao import codificacoes_disponiveis, compressor
+
+NIVEIS = {"gzip": [1, 6, 9], "br": [1, 4, 6, 11]}
+
+
+def comprimir(corpo: bytes, codificacao: str, nivel: int) -> bytes:
+    comprimir, _, finalizar = compressor(codificacao, nivel)
+    return comprimir(corpo) + finalizar()
+
+
+def comprimir_streaming(corpo: bytes, codificacao: str, nivel: int, bloco: int) -> bytes:
+    comprimir, flush, finalizar = compressor(codificacao, nivel)
+    partes = [comprimir(corpo[i:i + bloco]) + flush() for i in range(0, len(corpo), bloco)]
+    return b"".join(partes) + finalizar()
+
+
+def medir_cpu(corpo: bytes, codificacao: str, nivel: int, repeticoes: int) -> float:
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.process_time()
+        comprimir(corpo, codificacao, nivel)
+        tempos.append((time.process_time() - inicio) * 1000)
+    return statistics.median(tempos)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pedidos", type=int, default=1000, help="documentos na listagem")
+    parser.add_argument("--repeticoes", type=int, default=20, help="medições por nível")
+    parser.add_argument("--bloco", type=int, default=16384, help="tamanho do bloco no modo streaming")
+    args = parser.parse_args()
+
+    from main import RespostaJSON
+
+    corpo = RespostaJSON(preparar_depois(gerar_pedidos(args.pedidos))).body
+
+    print(f"\n🗜️  Listagem de {args.pedidos} pedidos — {len(corpo) / 1024:.0f} KB sem compressão\n")
+    print(f"{'codificação':<12} {'nível':>5} {'bytes':>10} {'razão':>7} {'streaming':>10} {'CPU (ms)':>9}")
+    print(f"{'identity':<12} {'-':>5} {len(corpo):>10} {1:>6.1f}x {len(corpo):>10} {0:>9.2f}")
+    for codificacao in reversed(codificacoes_disponiveis()):
+        for nivel in NIVEIS[codificacao]:
+            tamanho = len(comprimir(corpo, codificacao, nivel))
+            streaming = len(comprimir_streaming(corpo, codificacao, nivel, args.bloco))
+            cpu = medir_cpu(corpo, codificacao, nivel, args.repeticoes)
+            print(f"{codificacao:<12} {nivel:>5} {tamanho:>10} {len(corpo) / tamanho:>6.1f}x {streaming:>10} {cpu:>9.2f}")
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+RepFlow — Benchmark de serialização JSON
+========================================
+Mede quanto custa transformar uma página de pedidos (documentos como vêm
+do MongoDB) no corpo da resposta HTTP, comparando:
+
+  • antes  — serialize() copiando cada documento + jsonable_encoder +
+             json.dumps (caminho padrão do FastAPI com JSONResponse)
+  • depois — RespostaJSON do main.py (orjson), sobre os documentos já com
+             `id` em string, como saem do pipeline com ESTAGIOS_SAIDA
+
+Uso: python benchmark_json.py [--pedidos 1000] [--repeticoes 50]
+"""
+
+import argparse
+import json
+import statistics
+import time
+from datetime import datetime, timedelta, timezone
+
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+
+def gerar_pedidos(n: int) -> list:
+    agora = datetime.now(timezone.utc)
+    pedidos = []
+    for i in range(n):
+        criado = agora - timedelta(minutes=i)
+        pedidos.append({
+            "_id": ObjectId(),
+            "referencia": f"PED-{i:05d}",
+            "cliente_id": str(ObjectId()),
+            "cliente_nome": f"Cliente Exemplo {i % 50} Ltda",
+            "numero_fe": f"FE-{i % 200:04d}",
+            "status": ("PENDENTE", "EM_PRODUCAO", "NF_EMITIDA")[i % 3],
+            "itens": [
+                {"material_id": str(ObjectId()), "descricao": f"Caixa {j}", "quantidade": 1000 * (j + 1),
+                 "preco_mil": 412.5 + j, "peso": 0.35 * (j + 1)}
+                for j in range(3)
+            ],
+            "valor_total": 1250.75 + i,
+            "peso_total": 350.0 + i,
+            "comissao_valor": 37.52,
+            "data_entrega": (criado + timedelta(days=15)).date().isoformat(),
+            "criado_em": criado,
+            "atualizado_em": criado,
+            "criado_por": "vendas@repflow.com.br",
+            "deletado": False,
+        })
+    return pedidos
+
+
+def antes(pedidos: list) -> bytes:
+    docs = []
+    for p in pedidos:
+        doc = dict(p)
+        doc["id"] = str(doc.pop("_id"))
+        docs.append({k: str(v) if isinstance(v, ObjectId) else v for k, v in doc.items()})
+    return JSONResponse(jsonable_encoder(docs)).body
+
+
+def preparar_depois(pedidos: list) -> list:
+    """Equivalente ao que o MongoDB entrega com ESTAGIOS_SAIDA — feito fora da medição."""
+    docs = []
+    for p in pedidos:
+        doc = {k: v for k, v in p.items() if k != "_id"}
+        doc["id"] = str(p["_id"])
+        docs.append(doc)
+    return docs
+
+
+def medir(funcao, dados, repeticoes: int) -> dict:
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        corpo = funcao(dados)
+        tempos.append((time.perf_counter() - inicio) * 1000)
+    return {"p50_ms": statistics.median(tempos), "min_ms": min(tempos), "bytes": len(corpo)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pedidos", type=int, default=1000, help="documentos na página")
+    parser.add_argument("--repeticoes", type=int, default=50, help="medições por modo")
+    args = parser.parse_args()
+
+    from main import RespostaJSON
+
+    pedidos = gerar_pedidos(args.pedidos)
+    docs = preparar_depois(pedidos)
+
+    # Os dois caminhos precisam produzir o mesmo JSON
+    assert json.loads(antes(pedidos)) == json.loads(RespostaJSON(docs).body)
+
+    print(f"\n🧾 Serializando {args.pedidos} pedidos — {args.repeticoes} repetições\n")
+    print(f"{'modo':<8} {'p50 (ms)':>10} {'mín (ms)':>10} {'bytes':>10}")
+    resultados = {
+        "antes": medir(antes, pedidos, args.repeticoes),
+        "depois": medir(lambda d: RespostaJSON(d).body, docs, args.repeticoes),
+    }
+    for modo, r in resultados.items():
+        print(f"{modo:<8} {r['p50_ms']:>10.2f} {r['min_ms']:>10.2f} {r['bytes']:>10}")
+    ganho = resultados["antes"]["p50_ms"] / resultados["depois"]["p50_ms"]
+    print(f"\n⚡ {ganho:.1f}x mais rápido\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+RepFlow — Benchmark de concorrência de login
+============================================
+Mede a latência de um endpoint não relacionado (health check) enquanto uma
+rajada de logins verifica senhas com bcrypt, comparando:
+
+  • bloqueante — bcrypt.checkpw chamado direto no handler (comportamento antigo)
+  • executor   — verificar_senha() do main.py, em pool de threads
+
+Uso: python benchmark_login.py [--logins 40] [--rounds 12]
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+import bcrypt
+
+
+def percentil(valores, p):
+    ordenados = sorted(valores)
+    idx = min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))
+    return ordenados[idx]
+
+
+async def sonda(latencias, parar, health_check):
+    """Chama o health check a cada 5 ms e mede quanto cada chamada demorou de fato."""
+    while not parar.is_set():
+        inicio = time.perf_counter()
+        await asyncio.sleep(0.005)
+        await health_check()
+        latencias.append((time.perf_counter() - inicio - 0.005) * 1000)
+
+
+async def rodar(modo, logins, senha, senha_hash, verificar_senha, health_check):
+    async def login_bloqueante():
+        bcrypt.checkpw(senha.encode("utf-8"), senha_hash.encode("utf-8"))
+
+    async def login_executor():
+        await verificar_senha(senha, senha_hash)
+
+    login = login_bloqueante if modo == "bloqueante" else login_executor
+    latencias, parar = [], asyncio.Event()
+    tarefa_sonda = asyncio.create_task(sonda(latencias, parar, health_check))
+    await asyncio.sleep(0.05)
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(login() for _ in range(logins)))
+    duracao = time.perf_counter() - inicio
+
+    parar.set()
+    await tarefa_sonda
+    return {
+        "modo": modo,
+        "logins_por_s": logins / duracao,
+        "p50_ms": statistics.median(latencias),
+        "p99_ms": percentil(latencias, 99),
+        "max_ms": max(latencias),
+        "amostras": len(latencias),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logins", type=int, default=40, help="logins simultâneos na rajada")
+    parser.add_argument("--rounds", type=int, default=12, help="custo do bcrypt (BCRYPT_ROUNDS)")
+    args = parser.parse_args()
+
+    os.environ["BCRYPT_ROUNDS"] = str(args.rounds)
+    from main import BCRYPT_WORKERS, health_check, verificar_senha
+
+    senha = "SenhaDeTeste@2026"
+    senha_hash = bcrypt.hashpw(senha.encode("utf-8"), bcrypt.gensalt(rounds=args.rounds)).decode("utf-8")
+
+    print(f"\n🔐 {args.logins} logins simultâneos — bcrypt custo {args.rounds}, {BCRYPT_WORKERS} threads\n")
+    print(f"{'modo':<12} {'logins/s':>9} {'p50 (ms)':>10} {'p99 (ms)':>10} {'máx (ms)':>10} {'amostras':>9}")
+    for modo in ("bloqueante", "executor"):
+        r = asyncio.run(rodar(modo, args.logins, senha, senha_hash, verificar_senha, health_check))
+        print(f"{r['modo']:<12} {r['logins_por_s']:>9.1f} {r['p50_ms']:>10.2f} {r['p99_ms']:>10.2f} {r['max_ms']:>10.2f} {r['amostras']:>9}")
+    print("\nLatência = atraso do health check além dos 5 ms de espera programada.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+# ============================================================
+# cache.py — Cache em memória (TTL + LRU) para catálogos
+#
+# Read-through: obter(chave, carregar) devolve o valor em cache ou chama
+# carregar() uma única vez, mesmo com várias requisições simultâneas pela
+# mesma chave. As chaves são tuplas cujo primeiro elemento é a coleção,
+# para que invalidar("clientes") limpe listas e documentos de uma vez.
+#
+# Com vários workers, cada um tem o seu cache: invalidar_por_change_stream()
+# escuta o banco e invalida o cache local quando outro processo grava.
+#
+# COMO USAR:
+#   cache = CacheTTL(ttl=60, max_itens=256)
+#   valor = await cache.obter(("clientes", cliente_id), lambda: buscar(...))
+#   cache.invalidar("clientes")
+# ============================================================
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+CODIGOS_SEM_CHANGE_STREAM = {40573, 20, 115}
+
+
+class CacheTTL:
+    def __init__(self, ttl: float = 60.0, max_itens: int = 256):
+        self.ttl = ttl
+        self.max_itens = max_itens
+        self._itens: "OrderedDict[Tuple, Tuple[float, Any]]" = OrderedDict()
+        self._carregando: Dict[Tuple, asyncio.Future] = {}
+        self._geracao: Dict[str, int] = {}
+        self.acertos = 0
+        self.falhas = 0
+        self.invalidacoes = 0
+
+    async def obter(self, chave: Tuple, carregar: Callable[[], Awaitable[Any]]) -> Any:
+        item = self._itens.get(chave)
+        if item is not None and item[0] > time.monotonic():
+            self._itens.move_to_end(chave)
+            self.acertos += 1
+            return item[1]
+
+        self.falhas += 1
+        pendente = self._carregando.get(chave)
+        if pendente is not None:
+            # Outra requisição já está carregando a mesma chave: espera o resultado dela
+            try:
+                return await asyncio.shield(pendente)
+            except asyncio.CancelledError:
+                if not pendente.cancelled():
+                    raise
+                # quem carregava foi cancelado — carrega aqui mesmo
+
+        futuro = asyncio.get_running_loop().create_future()
+        self._carregando[chave] = futuro
+        geracao = self._geracao.get(chave[0], 0)
+        try:
+            valor = await carregar()
+        except asyncio.CancelledError:
+            futuro.cancel()
+            raise
+        except Exception as e:
+            futuro.set_exception(e)
+            futuro.exception()  # evita "exception was never retrieved" sem ninguém esperando
+            raise
+        finally:
+            self._carregando.pop(chave, None)
+
+        # Se houve invalidação durante a carga, o valor pode estar velho: entrega sem guardar
+        if self._geracao.get(chave[0], 0) == geracao:
+            self._itens[chave] = (time.monotonic() + self.ttl, valor)
+            self._itens.move_to_end(chave)
+            while len(self._itens) > self.max_itens:
+                self._itens.popitem(last=False)
+        futuro.set_result(valor)
+        return valor
+
+    def invalidar(self, colecao: str):
+        self._geracao[colecao] = self._geracao.get(colecao, 0) + 1
+        for chave in [c for c in self._itens if c[0] == colecao]:
+            del self._itens[chave]
+        self.invalidacoes += 1
+
+    def estatisticas(self) -> dict:
+        total = self.acertos + self.falhas
+        return {
+            "itens": len(self._itens),
+            "max_itens": self.max_itens,
+            "ttl_segundos": self.ttl,
+            "acertos": self.acertos,
+            "falhas": self.falhas,
+            "invalidacoes": self.invalidacoes,
+            "taxa_acerto": round(self.acertos / total, 3) if total else 0.0,
+        }
+
+
+async def invalidar_por_change_stream(db, cache: CacheTTL, colecoes: List[str]):
+    """Tarefa de fundo: invalida o cache local a cada gravação em `colecoes`, venha de onde vier."""
+    pipeline = [{"$match": {"ns.coll": {"$in": colecoes}}}]
+    resume_token = None
+    while True:
+        try:
+            async with db.watch(pipeline, resume_after=resume_token) as stream:
+                async for mudanca in stream:
+                    resume_token = mudanca["_id"]
+                    cache.invalidar(mudanca["ns"]["coll"])
+        except asyncio.CancelledError:
+            raise
+        except OperationFailure as e:
+            if e.code in CODIGOS_SEM_CHANGE_STREAM:
+                logger.warning("⚠️ Change streams indisponíveis — cache invalidado só pelo próprio processo")
+                return
+            resume_token = None
+            logger.warning(f"Invalidação do cache interrompida: {e}")
+        except PyMongoError as e:
+            logger.warning(f"Invalidação do cache interrompida: {e}")
+        # Mudanças perdidas enquanto o stream esteve fora
+        for colecao in colecoes:
+            cache.invalidar(colecao)
+        await asyncio.sleep(5)
@@ -0,0 +1,152 @@
+# ============================================================
+# compressao.py — Compressão das respostas HTTP (gzip / brotli)
+#
+# Middleware ASGI: escolhe a codificação pelo Accept-Encoding do cliente
+# (brotli quando o pacote `brotli` está instalado, senão gzip) e comprime:
+#   • respostas completas (JSONResponse, etc.) a partir de `minimo` bytes;
+#   • StreamingResponse bloco a bloco, com flush a cada bloco — o cliente
+#     recebe os dados à medida que são gerados, sem esperar o fim.
+# SSE e formatos já compactados (.xlsx, zip, imagens) passam direto.
+#
+# COMO USAR:
+#   app.add_middleware(CompressaoMiddleware, minimo=1024, nivel_gzip=6, nivel_brotli=4)
+# ============================================================
+
+import zlib
+from typing import Callable, Optional, Tuple
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:  # opcional — sem ele, só gzip
+    brotli = None
+
+# Não vale a pena (ou não pode) comprimir: SSE precisa de cada evento na hora,
+# e os demais já saem compactados
+TIPOS_IGNORADOS = (
+    "text/event-stream",
+    "application/zip",
+    "application/gzip",
+    "application/vnd.openxmlformats",
+    "image/",
+    "video/",
+    "audio/",
+)
+
+
+def codificacoes_disponiveis() -> Tuple[str, ...]:
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def escolher_codificacao(accept_encoding: str) -> Optional[str]:
+    """Melhor codificação aceita pelo cliente (maior q; empate favorece brotli)."""
+    aceitas = {}
+    for parte in accept_encoding.split(","):
+        nome, _, params = parte.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        aceitas[nome.strip().lower()] = q
+    melhor, melhor_q = None, 0.0
+    for codificacao in codificacoes_disponiveis():
+        q = aceitas.get(codificacao, aceitas.get("*", 0.0))
+        if q > melhor_q:
+            melhor, melhor_q = codificacao, q
+    return melhor
+
+
+def compressor(codificacao: str, nivel: int) -> Tuple[Callable[[bytes], bytes], Callable[[], bytes], Callable[[], bytes]]:
+    """(comprimir, flush, finalizar) para a codificação — usado pelo middleware e pelo benchmark."""
+    if codificacao == "br":
+        c = brotli.Compressor(quality=nivel)
+        return c.process, c.flush, c.finish
+    c = zlib.compressobj(nivel, zlib.DEFLATED, 31)  # wbits 31 = cabeçalho gzip
+    return c.compress, lambda: c.flush(zlib.Z_SYNC_FLUSH), c.flush
+
+
+class CompressaoMiddleware:
+    def __init__(self, app: ASGIApp, minimo: int = 1024, nivel_gzip: int = 6, nivel_brotli: int = 4):
+        self.app = app
+        self.minimo = minimo
+        self.niveis = {"gzip": nivel_gzip, "br": nivel_brotli}
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        codificacao = escolher_codificacao(Headers(scope=scope).get("accept-encoding", ""))
+        if codificacao is None:
+            await self.app(scope, receive, send)
+            return
+        await self.app(scope, receive, _Compressao(send, codificacao, self.niveis[codificacao], self.minimo))
+
+
+class _Compressao:
+    """Intercepta o `send` de uma resposta e comprime o corpo quando compensa."""
+
+    def __init__(self, send: Send, codificacao: str, nivel: int, minimo: int):
+        self.send = send
+        self.codificacao = codificacao
+        self.nivel = nivel
+        self.minimo = minimo
+        self.inicio: Optional[Message] = None
+        self.ativo = False  # False: repassa sem tocar | True: comprimindo
+        self.decidido = False
+        self.comprimir = self.flush = self.finalizar = None
+
+    def _elegivel(self, headers: Headers) -> bool:
+        if "content-encoding" in headers:
+            return False
+        tipo = headers.get("content-type", "")
+        return not tipo.startswith(TIPOS_IGNORADOS)
+
+    def _ativar(self, headers: MutableHeaders):
+        self.ativo = True
+        self.comprimir, self.flush, self.finalizar = compressor(self.codificacao, self.nivel)
+        headers["Content-Encoding"] = self.codificacao
+        del headers["Content-Length"]
+        # O corpo enviado não é mais byte a byte o que gerou o ETag
+        etag = headers.get("etag")
+        if etag and not etag.startswith("W/"):
+            headers["ETag"] = f"W/{etag}"
+
+    async def __call__(self, message: Message):
+        if message["type"] == "http.response.start":
+            self.inicio = message
+            return
+        if message["type"] != "http.response.body":
+            await self.send(message)
+            return
+
+        if not self.decidido:
+            self.decidido = True
+            headers = MutableHeaders(raw=self.inicio["headers"])
+            if self._elegivel(headers):
+                headers.add_vary_header("Accept-Encoding")
+                corpo = message.get("body", b"")
+                streaming = message.get("more_body", False)
+                if streaming or len(corpo) >= self.minimo:
+                    self._ativar(headers)
+                    if not streaming:
+                        comprimido = self.comprimir(corpo) + self.finalizar()
+                        headers["Content-Length"] = str(len(comprimido))
+                        await self.send(self.inicio)
+                        await self.send({"type": "http.response.body", "body": comprimido})
+                        return
+            await self.send(self.inicio)
+
+        if not self.ativo:
+            await self.send(message)
+            return
+
+        corpo = self.comprimir(message.get("body", b""))
+        if message.get("more_body", False):
+            await self.send({"type": "http.response.body", "body": corpo + self.flush(), "more_body": True})
+        else:
+            await self.send({"type": "http.response.body", "body": corpo + self.finalizar()})
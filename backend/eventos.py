@@ -0,0 +1,209 @@
+# ============================================================
+# eventos.py — Feed de eventos em tempo real (Server-Sent Events)
+#
+# Um único change stream no banco (pedidos, notas_fiscais, vencimentos)
+# alimenta todos os clientes conectados: cada mudança vira uma mensagem SSE
+# cujo `id` é o resume token do MongoDB. Ao reconectar, o navegador manda
+# Last-Event-ID e recebe o que perdeu a partir do histórico em memória
+# (ou um evento `resync` se o id já saiu do histórico).
+#
+# Sem replica set (mongod standalone local) o change stream não existe:
+# o canal passa a ler a coleção `eventos`, que a API grava a cada mutação
+# via publicar().
+#
+# COMO USAR:
+#   canal = CanalEventos(["pedidos", "notas_fiscais"])
+#   asyncio.create_task(canal.executar(db))                      # startup
+#   await canal.publicar(db, "pedidos", "update", pedido_id)      # mutações
+#   return StreamingResponse(canal.sse(last_event_id), media_type="text/event-stream")
+# ============================================================
+
+import asyncio
+import json
+import logging
+from collections import deque
+from datetime import datetime, timezone
+from typing import AsyncIterator, List, Optional, Set
+
+from bson import ObjectId
+from pymongo.errors import OperationFailure, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+# "The $changeStream stage is only supported on replica sets" / operação não suportada
+CODIGOS_SEM_CHANGE_STREAM = {40573, 20, 115}
+# O resume token saiu do oplog — não dá para retomar de onde parou
+CODIGO_HISTORICO_PERDIDO = 286
+
+EVENTOS_TTL = 24 * 3600
+RESYNC = "event: resync\ndata: {}\n\n"
+OPERACOES = {"insert": "insert", "update": "update", "replace": "update", "delete": "delete"}
+
+
+def _serializar(doc: Optional[dict]) -> Optional[dict]:
+    if doc is None:
+        return None
+    doc = dict(doc)
+    if "_id" in doc:
+        doc["id"] = str(doc.pop("_id"))
+    return doc
+
+
+def mensagem_sse(evento: dict) -> str:
+    dados = json.dumps(evento, default=str, ensure_ascii=False)
+    return f"id: {evento['id']}\ndata: {dados}\n\n"
+
+
+class CanalEventos:
+    """Distribui as mudanças do banco para todos os clientes SSE conectados."""
+
+    def __init__(
+        self,
+        colecoes: List[str],
+        *,
+        historico: int = 500,
+        fila_cliente: int = 200,
+        intervalo_polling: float = 1.0,
+        keepalive: float = 15.0,
+    ):
+        self.colecoes = colecoes
+        self.historico: deque = deque(maxlen=historico)  # (id, mensagem)
+        self.fila_cliente = fila_cliente
+        self.intervalo_polling = intervalo_polling
+        self.keepalive = keepalive
+        self.assinantes: Set[asyncio.Queue] = set()
+        self.modo: Optional[str] = None  # "change_stream" | "polling"
+        self._resume_token: Optional[dict] = None
+
+    # ---------- distribuição ----------
+
+    def _difundir(self, evento: dict):
+        mensagem = mensagem_sse(evento)
+        self.historico.append((evento["id"], mensagem))
+        for fila in list(self.assinantes):
+            try:
+                fila.put_nowait(mensagem)
+            except asyncio.QueueFull:
+                # Cliente lento: encerra a conexão; ele reconecta com Last-Event-ID
+                self.assinantes.discard(fila)
+                while not fila.empty():
+                    fila.get_nowait()
+                fila.put_nowait(None)
+
+    def _resync(self):
+        """Histórico inválido: todos os clientes precisam recarregar as listas."""
+        self.historico.clear()
+        for fila in list(self.assinantes):
+            try:
+                fila.put_nowait(RESYNC)
+            except asyncio.QueueFull:
+                pass
+
+    async def sse(self, ultimo_id: Optional[str] = None) -> AsyncIterator[str]:
+        fila: asyncio.Queue = asyncio.Queue(maxsize=self.fila_cliente)
+        # Inscrição e cópia do histórico sem await no meio: nenhum evento some nem se repete
+        self.assinantes.add(fila)
+        pendentes: List[str] = []
+        if ultimo_id:
+            ids = [i for i, _ in self.historico]
+            if ultimo_id in ids:
+                pendentes = [m for _, m in list(self.historico)[ids.index(ultimo_id) + 1:]]
+            else:
+                pendentes = [RESYNC]
+        try:
+            yield "retry: 3000\n\n"
+            for mensagem in pendentes:
+                yield mensagem
+            while True:
+                try:
+                    mensagem = await asyncio.wait_for(fila.get(), self.keepalive)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                if mensagem is None:
+                    return
+                yield mensagem
+        finally:
+            self.assinantes.discard(fila)
+
+    # ---------- fontes ----------
+
+    async def executar(self, db):
+        """Tarefa de fundo: mantém o change stream aberto (ou o polling, no fallback)."""
+        while True:
+            try:
+                await self._change_stream(db)
+            except asyncio.CancelledError:
+                raise
+            except OperationFailure as e:
+                if e.code in CODIGOS_SEM_CHANGE_STREAM:
+                    logger.info("ℹ️  Change streams indisponíveis — eventos via coleção `eventos`")
+                    self.modo = "polling"
+                    await self._polling(db)
+                    return
+                if e.code == CODIGO_HISTORICO_PERDIDO:
+                    self._resume_token = None
+                    self._resync()
+                logger.warning(f"Change stream interrompido: {e}")
+            except PyMongoError as e:
+                logger.warning(f"Change stream interrompido: {e}")
+            await asyncio.sleep(5)
+
+    async def _change_stream(self, db):
+        pipeline = [{"$match": {
+            "ns.coll": {"$in": self.colecoes},
+            "operationType": {"$in": list(OPERACOES)},
+        }}]
+        async with db.watch(pipeline, full_document="updateLookup", resume_after=self._resume_token) as stream:
+            self.modo = "change_stream"
+            async for mudanca in stream:
+                self._resume_token = mudanca["_id"]
+                self._difundir({
+                    "id": mudanca["_id"]["_data"],
+                    "colecao": mudanca["ns"]["coll"],
+                    "operacao": OPERACOES[mudanca["operationType"]],
+                    "documento_id": str(mudanca["documentKey"]["_id"]),
+                    "documento": _serializar(mudanca.get("fullDocument")),
+                })
+
+    async def _polling(self, db):
+        await db.eventos.create_index("criado_em", expireAfterSeconds=EVENTOS_TTL)
+        ultimo = await db.eventos.find_one({}, {"_id": 1}, sort=[("_id", -1)])
+        ultimo_id = ultimo["_id"] if ultimo else ObjectId()
+        while True:
+            try:
+                async for ev in db.eventos.find({"_id": {"$gt": ultimo_id}}).sort("_id", 1):
+                    ultimo_id = ev["_id"]
+                    self._difundir({
+                        "id": str(ev["_id"]),
+                        "colecao": ev["colecao"],
+                        "operacao": ev["operacao"],
+                        "documento_id": ev.get("documento_id"),
+                        "documento": ev.get("documento"),
+                    })
+            except PyMongoError as e:
+                logger.warning(f"Polling de eventos falhou: {e}")
+            await asyncio.sleep(self.intervalo_polling)
+
+    async def publicar(
+        self,
+        db,
+        colecao: str,
+        operacao: str,
+        documento_id: Optional[str] = None,
+        documento: Optional[dict] = None,
+    ):
+        """
+        Registra uma mutação para o fallback de polling. Com change stream ativo
+        não faz nada — o próprio banco emite o evento.
+        documento_id None indica mudança em lote (o cliente recarrega a coleção).
+        """
+        if self.modo != "polling" or colecao not in self.colecoes:
+            return
+        await db.eventos.insert_one({
+            "colecao": colecao,
+            "operacao": operacao,
+            "documento_id": documento_id,
+            "documento": _serializar(documento),
+            "criado_em": datetime.now(timezone.utc),
+        })
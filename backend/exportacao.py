@@ -0,0 +1,147 @@
+# ============================================================
+# exportacao.py — Motor de exportação Excel em streaming
+#
+# Usa o modo write-only do openpyxl com estilos nomeados compartilhados:
+# as linhas vêm direto de um cursor do Motor e são gravadas conforme chegam,
+# e o .xlsx final fica num arquivo temporário (memória até 8 MB, depois disco).
+#
+# COMO USAR:
+#   colunas = [Coluna("NF", 12, lambda d: d.get("numero_nf")), ...]
+#   arquivo = await gerar_planilha("Aba", colunas, db.colecao.find())
+#   return resposta_excel(arquivo, "arquivo.xlsx")
+# ============================================================
+
+import asyncio
+from dataclasses import dataclass
+from tempfile import SpooledTemporaryFile
+from typing import Any, AsyncIterable, Callable, List, Optional
+
+from fastapi.responses import StreamingResponse
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Border, Font, NamedStyle, PatternFill, Side
+from openpyxl.utils import get_column_letter
+
+FORMATO_MOEDA = 'R$ #,##0.00'
+MEMORIA_MAX_ARQUIVO = 8 * 1024 * 1024
+TAMANHO_BLOCO = 64 * 1024
+MIME_XLSX = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+
+@dataclass
+class Coluna:
+    titulo: str
+    largura: int
+    valor: Callable[[dict], Any]
+    moeda: bool = False
+
+
+def _estilos() -> List[NamedStyle]:
+    """Estilos nomeados — registrados uma vez por planilha e referenciados por nome em cada célula."""
+    borda = Side(style="thin", color="CCCCCC")
+    border = Border(left=borda, right=borda, top=borda, bottom=borda)
+    preenchimentos = {
+        "": None,
+        "_pago": PatternFill("solid", fgColor="D1FAE5"),
+        "_atraso": PatternFill("solid", fgColor="FEE2E2"),
+    }
+
+    estilos = []
+    cabecalho = NamedStyle(name="cabecalho")
+    cabecalho.fill = PatternFill("solid", fgColor="0A3D73")
+    cabecalho.font = Font(bold=True, color="FFFFFF", size=9)
+    cabecalho.alignment = Alignment(horizontal="center", vertical="center")
+    cabecalho.border = border
+    estilos.append(cabecalho)
+
+    for sufixo, fill in preenchimentos.items():
+        for moeda in (False, True):
+            estilo = NamedStyle(name=f"celula{sufixo}{'_moeda' if moeda else ''}")
+            estilo.font = Font(size=9)
+            estilo.alignment = Alignment(vertical="center")
+            estilo.border = border
+            if fill:
+                estilo.fill = fill
+            if moeda:
+                estilo.number_format = FORMATO_MOEDA
+            estilos.append(estilo)
+
+    for moeda in (False, True):
+        estilo = NamedStyle(name=f"total{'_moeda' if moeda else ''}")
+        estilo.font = Font(bold=True, size=9)
+        if moeda:
+            estilo.number_format = FORMATO_MOEDA
+        estilos.append(estilo)
+    return estilos
+
+
+def _celula(ws, valor, estilo: Optional[str]) -> WriteOnlyCell:
+    cell = WriteOnlyCell(ws, value=valor)
+    if estilo:
+        cell.style = estilo
+    return cell
+
+
+async def gerar_planilha(
+    titulo: str,
+    colunas: List[Coluna],
+    docs: AsyncIterable[dict],
+    *,
+    destaque: Optional[Callable[[dict], str]] = None,
+    rodape: Optional[Callable[[], List[list]]] = None,
+) -> SpooledTemporaryFile:
+    """
+    Gera o .xlsx consumindo `docs` em streaming.
+
+    destaque(doc) devolve "pago", "atraso" ou "" para colorir a linha.
+    rodape() é chamado depois do último documento e devolve linhas de totais,
+    onde valores numéricos saem em negrito com formato de moeda.
+    """
+    wb = Workbook(write_only=True)
+    for estilo in _estilos():
+        wb.add_named_style(estilo)
+    ws = wb.create_sheet(titulo)
+    for i, coluna in enumerate(colunas, 1):
+        ws.column_dimensions[get_column_letter(i)].width = coluna.largura
+    ws.row_dimensions[1].height = 20
+
+    ws.append([_celula(ws, c.titulo, "cabecalho") for c in colunas])
+
+    async for doc in docs:
+        cor = destaque(doc) if destaque else ""
+        sufixo = f"_{cor}" if cor else ""
+        ws.append([
+            _celula(ws, c.valor(doc), f"celula{sufixo}{'_moeda' if c.moeda else ''}")
+            for c in colunas
+        ])
+
+    if rodape:
+        ws.append([])
+        for linha in rodape():
+            ws.append([
+                _celula(ws, v, None) if v in ("", None)
+                else _celula(ws, v, "total_moeda" if isinstance(v, (int, float)) else "total")
+                for v in linha
+            ])
+
+    arquivo = SpooledTemporaryFile(max_size=MEMORIA_MAX_ARQUIVO)
+    # compactar o .xlsx é CPU puro — fora do event loop
+    await asyncio.to_thread(wb.save, arquivo)
+    arquivo.seek(0)
+    return arquivo
+
+
+def resposta_excel(arquivo: SpooledTemporaryFile, nome_arquivo: str) -> StreamingResponse:
+    """Envia o arquivo em blocos e o fecha ao final."""
+    def blocos():
+        try:
+            while bloco := arquivo.read(TAMANHO_BLOCO):
+                yield bloco
+        finally:
+            arquivo.close()
+
+    return StreamingResponse(
+        blocos(),
+        media_type=MIME_XLSX,
+        headers={"Content-Disposition": f"attachment; filename={nome_arquivo}"},
+    )
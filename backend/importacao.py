@@ -0,0 +1,279 @@
+"""
+RepFlow — Importação de planilhas (clientes e materiais)
+========================================================
+Pipeline único usado pelos scripts de importação e pelo endpoint
+POST /api/admin/importar/{tipo}:
+
+  • lê o .xlsx em modo read_only (linha a linha, memória constante), numa
+    thread — o event loop da API segue atendendo durante a leitura
+  • carrega os CNPJs / numero_fe já cadastrados num set com uma única consulta
+  • grava em lotes com insert_many(ordered=False)
+  • informa progresso e vazão (linhas/s)
+
+Uso: python importacao.py clientes dados_clientes.xlsx
+     python importacao.py materiais cadastro_produtos.xlsx [--lote 1000]
+"""
+
+import argparse
+import asyncio
+import os
+import re
+import time
+import unicodedata
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Callable, Iterator, Optional
+
+import openpyxl
+from pymongo.errors import BulkWriteError
+
+from migracoes import avancar_versoes
+
+LOTE_PADRAO = 500
+
+
+def _texto(valor) -> str:
+    return str(valor).strip() if valor else ""
+
+
+def normalizar_nome(nome: Optional[str]) -> str:
+    """Nome sem acentos/pontuação, em maiúsculas e com espaços simples — usado para casar clientes."""
+    sem_acento = unicodedata.normalize("NFKD", nome or "").encode("ascii", "ignore").decode("ascii")
+    return " ".join(re.sub(r"[^A-Z0-9]+", " ", sem_acento.upper()).split())
+
+
+def converter_cliente(row: tuple) -> Optional[dict]:
+    """NOME FANTASIA | EMPRESA | CNPJ | COMPRADOR | CIDADE | ESTADO"""
+    nome_fantasia, razao_social, cnpj, comprador, cidade, estado = (tuple(row) + (None,) * 6)[:6]
+    if not razao_social and not cnpj:
+        return None
+    nome = _texto(nome_fantasia) or _texto(razao_social)
+    return {
+        "id": str(uuid.uuid4()),
+        "nome": nome,
+        "nome_normalizado": normalizar_nome(nome),
+        "nome_fantasia": _texto(nome_fantasia),
+        "razao_social": _texto(razao_social),
+        "cnpj": _texto(cnpj),
+        "comprador": _texto(comprador),
+        "cidade": _texto(cidade),
+        "estado": _texto(estado),
+        "uf": _texto(estado),
+        "email": "",
+        "telefone": "",
+        "endereco": "",
+    }
+
+
+def converter_material(row: tuple) -> Optional[dict]:
+    """— | — | — | Produto (FE) | Referência | PESO | Vl. (milheiro)"""
+    codigo, nome, peso, preco_mil = (tuple(row) + (None,) * 7)[3:7]
+    if not codigo and not nome:
+        return None
+    codigo, nome = _texto(codigo), _texto(nome)
+
+    sufixo = codigo.split("-")[-1].strip().upper() if "-" in codigo else ""
+    segmento, comissao = ("Chapa", 2.0) if sufixo == "CH" else ("Caixa", 3.0)
+    peso = float(peso) if peso else 0.0
+    preco_mil = float(preco_mil) if preco_mil else 0.0
+    return {
+        "id": str(uuid.uuid4()),
+        "numero_fe": codigo,
+        "codigo": codigo,
+        "nome": nome,
+        "descricao": nome,
+        "segmento": segmento,
+        "peso": peso,
+        "peso_unit": peso,
+        "preco_mil": preco_mil,
+        "preco_unit": preco_mil,
+        "comissao": comissao,
+        "unidade": "CX" if segmento == "Caixa" else "CH",
+    }
+
+
+@dataclass
+class Importador:
+    colecao: str
+    chave: str
+    linha_inicial: int
+    converter: Callable[[tuple], Optional[dict]]
+
+
+IMPORTADORES = {
+    "clientes": Importador("clientes", "cnpj", 2, converter_cliente),
+    "materiais": Importador("materiais", "numero_fe", 2, converter_material),
+}
+
+
+@dataclass
+class ResultadoImportacao:
+    importados: int = 0
+    duplicados: int = 0
+    ignorados: int = 0
+    linhas: int = 0
+    segundos: float = 0.0
+
+    @property
+    def linhas_por_segundo(self) -> float:
+        return self.linhas / self.segundos if self.segundos else 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "importados": self.importados,
+            "duplicados": self.duplicados,
+            "ignorados": self.ignorados,
+            "linhas": self.linhas,
+            "segundos": round(self.segundos, 2),
+            "linhas_por_segundo": round(self.linhas_por_segundo, 1),
+        }
+
+
+class ErroImportacao(Exception):
+    """Linha fora do formato esperado. `resultado` conta o que já foi gravado antes dela."""
+
+    def __init__(self, mensagem: str, resultado: ResultadoImportacao):
+        super().__init__(mensagem)
+        self.resultado = resultado
+
+
+def _ler_lotes(
+    arquivo, imp: Importador, existentes: set, resultado: ResultadoImportacao, lote: int, criado_por: str
+) -> Iterator[list]:
+    """Lê e converte as linhas da planilha, em lotes de até `lote` documentos novos (síncrono — roda em thread)."""
+    wb = openpyxl.load_workbook(arquivo, read_only=True, data_only=True)
+    try:
+        buffer = []
+        agora = datetime.now(timezone.utc)
+        for row in wb.active.iter_rows(min_row=imp.linha_inicial, values_only=True):
+            resultado.linhas += 1
+            try:
+                doc = imp.converter(row)
+            except (ValueError, KeyError, TypeError) as e:
+                # ex.: texto na coluna de peso — os lotes anteriores já foram gravados
+                raise ErroImportacao(f"linha {imp.linha_inicial + resultado.linhas - 1}: {e}", resultado) from e
+            if doc is None:
+                resultado.ignorados += 1
+                continue
+            chave = doc[imp.chave]
+            if chave and chave in existentes:
+                resultado.duplicados += 1
+                continue
+            if chave:
+                existentes.add(chave)
+            doc["criado_em"] = doc["atualizado_em"] = agora
+            doc["criado_por"] = criado_por
+            doc["deletado"] = False
+            buffer.append(doc)
+            if len(buffer) >= lote:
+                yield buffer
+                buffer = []
+        if buffer:
+            yield buffer
+    finally:
+        wb.close()
+
+
+async def importar_planilha(
+    db,
+    tipo: str,
+    arquivo,
+    *,
+    criado_por: str = "importacao_inicial",
+    lote: int = LOTE_PADRAO,
+    progresso: Optional[Callable[[ResultadoImportacao], None]] = None,
+) -> ResultadoImportacao:
+    """Importa `arquivo` (caminho ou file-like .xlsx) para a coleção do `tipo` informado."""
+    imp = IMPORTADORES[tipo]
+    resultado = ResultadoImportacao()
+    inicio = time.perf_counter()
+
+    existentes = {
+        d[imp.chave]
+        async for d in db[imp.colecao].find({imp.chave: {"$nin": ["", None]}}, {imp.chave: 1, "_id": 0})
+    }
+
+    async def gravar(docs):
+        try:
+            await db[imp.colecao].insert_many(docs, ordered=False)
+            resultado.importados += len(docs)
+        except BulkWriteError as e:
+            # outro processo pode ter gravado a mesma chave entre a leitura e o insert:
+            # o índice único (migracoes.INDICES) recusa com 11000 e conta como duplicado
+            resultado.importados += e.details.get("nInserted", 0)
+            erros = e.details.get("writeErrors", [])
+            resultado.duplicados += sum(1 for erro in erros if erro.get("code") == 11000)
+            if any(erro.get("code") != 11000 for erro in erros):
+                raise
+        resultado.segundos = time.perf_counter() - inicio
+        if progresso:
+            progresso(resultado)
+
+    # A leitura do .xlsx (CPU) vai para uma thread, um lote por vez; só os insert_many ficam no loop
+    lotes = _ler_lotes(arquivo, imp, existentes, resultado, lote, criado_por)
+    try:
+        while (docs := await asyncio.to_thread(next, lotes, None)) is not None:
+            await gravar(docs)
+    finally:
+        lotes.close()
+
+    resultado.segundos = time.perf_counter() - inicio
+    return resultado
+
+
+def executar_cli(tipo: Optional[str] = None, arquivo: Optional[str] = None):
+    """Ponto de entrada dos scripts de importação."""
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    if tipo is None:
+        parser.add_argument("tipo", choices=sorted(IMPORTADORES))
+    parser.add_argument("arquivo", nargs="?" if arquivo else None, default=arquivo)
+    parser.add_argument("--lote", type=int, default=LOTE_PADRAO, help="documentos por insert_many")
+    args = parser.parse_args()
+    tipo = tipo or args.tipo
+
+    load_dotenv()
+    client = AsyncIOMotorClient(os.getenv("MONGODB_URL", os.getenv("MONGO_URL", "mongodb://localhost:27017")))
+    db = client[os.getenv("DB_NAME", "erp_database")]
+
+    def mostrar(r: ResultadoImportacao):
+        print(f"  ✅ {r.importados} importados — {r.linhas} linhas lidas ({r.linhas_por_segundo:.0f} linhas/s)")
+
+    async def importar() -> ResultadoImportacao:
+        resultado = None
+        try:
+            resultado = await importar_planilha(db, tipo, args.arquivo, lote=args.lote, progresso=mostrar)
+            return resultado
+        except ErroImportacao as e:
+            resultado = e.resultado
+            raise
+        finally:
+            if resultado and resultado.importados:
+                # ETag / cache de catálogos da API: a gravação não passou pelo registrar_escrita
+                await avancar_versoes(db, [IMPORTADORES[tipo].colecao])
+
+    print(f"📂 Importando {tipo} de {args.arquivo}...\n")
+    try:
+        r = asyncio.run(importar())
+    except ErroImportacao as e:
+        print(f"\n❌ Importação interrompida na {e} — {e.resultado.importados} já importados")
+        raise SystemExit(1)
+    finally:
+        client.close()
+
+    print(f"""
+══════════════════════════════════
+  ✅ Importados:  {r.importados}
+  ⚠️  Duplicados:  {r.duplicados}
+  ⬜ Ignorados:   {r.ignorados}
+  ⏱️  {r.segundos:.1f}s — {r.linhas_por_segundo:.0f} linhas/s
+══════════════════════════════════
+Importação concluída!
+""")
+
+
+if __name__ == "__main__":
+    executar_cli()
@@ -60,7 +60,7 @@ async def registrar_auditoria(
         "dados_antes": dados_antes,
         "dados_depois": dados_depois,
         "detalhes": detalhes,
-        "criado_em": datetime.now(timezone.utc).isoformat(),
+        "criado_em": datetime.now(timezone.utc),
     }
 
     await db.auditoria.insert_one(registro)
@@ -103,7 +103,7 @@ async def soft_delete(
         {"_id": oid},
         {"$set": {
             "deletado": True,
-            "deletado_em": datetime.now(timezone.utc).isoformat(),
+            "deletado_em": datetime.now(timezone.utc),
             "deletado_por": usuario_email,
             "motivo_delecao": motivo or "Não informado",
         }}
@@ -251,7 +251,7 @@ async def anonimizar_titular(cnpj: str):
             "comprador": "REMOVIDO",
             "endereco": "REMOVIDO",
             "anonimizado": True,
-            "anonimizado_em": datetime.now(timezone.utc).isoformat(),
+            "anonimizado_em": datetime.now(timezone.utc),
         }}
     )
 
@@ -327,7 +327,7 @@ async def atualizar_material(material_id: str, material: MaterialSchema, usuario
     antes_serial = {k: str(v) if isinstance(v, ObjectId) else v for k, v in (antes or {}).items()}
 
     doc = material.dict()
-    doc["atualizado_em"] = datetime.now(timezone.utc).isoformat()
+    doc["atualizado_em"] = datetime.now(timezone.utc)
     doc["atualizado_por"] = usuario["email"]
     result = await db.materiais.update_one(
         {"_id": to_object_id(material_id)},
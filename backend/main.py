@@ -1,24 +1,39 @@
-from fastapi import FastAPI, HTTPException, Depends, status
+from fastapi import FastAPI, HTTPException, Depends, File, Header, Query, Request, Response, UploadFile, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from fastapi.responses import StreamingResponse
 from motor.motor_asyncio import AsyncIOMotorClient
-from pydantic import BaseModel, EmailStr
-from typing import List, Optional
-from bson import ObjectId
-from datetime import datetime, timedelta, timezone
+from pymongo import InsertOne, UpdateOne, ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+from pydantic import BaseModel, BeforeValidator, EmailStr, Field, ValidationError
+from typing import Annotated, Awaitable, Callable, List, Literal, Optional, Union
+from bson import ObjectId, json_util
+from datetime import date, datetime, timedelta, timezone
 import os
+import re
+import calendar
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
 import uuid
 import logging
-import io
+import json
+import base64
+import hashlib
 from dotenv import load_dotenv
 from jose import JWTError, jwt
 import bcrypt
+import orjson
 import sentry_sdk
 from sentry_sdk.integrations.fastapi import FastApiIntegration
 from sentry_sdk.integrations.starlette import StarletteIntegration
-import openpyxl
-from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
+from zipfile import BadZipFile
+from openpyxl.utils.exceptions import InvalidFileException
+from cache import CacheTTL, invalidar_por_change_stream
+from compressao import CompressaoMiddleware
+from eventos import CanalEventos
+from exportacao import Coluna, gerar_planilha, resposta_excel
+from importacao import IMPORTADORES, ErroImportacao, importar_planilha, normalizar_nome
+from migracoes import COLECOES_SOFT_DELETE, COLECOES_SYNC, aplicar_indices, avancar_versoes
 
 # ============================================================
 # 1. Configurações
@@ -37,7 +52,22 @@ sentry_sdk.init(
 )
 logger.info("✅ Sentry inicializado")
 
-app = FastAPI(title="ERP Vendas 2026 - Sistema Integrado")
+
+
+# Respostas JSON via orjson: ObjectId e datetime são codificados direto no render,
+# sem o percurso do jsonable_encoder por cada dict aninhado
+def _json_padrao(obj):
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    raise TypeError(f"Tipo não serializável em JSON: {type(obj).__name__}")
+
+
+class RespostaJSON(JSONResponse):
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, default=_json_padrao, option=orjson.OPT_NON_STR_KEYS)
+
+
+app = FastAPI(title="ERP Vendas 2026 - Sistema Integrado", default_response_class=RespostaJSON)
 
 # ============================================================
 # 2. CORS
@@ -50,14 +80,31 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag"],
+)
+
+# Compressão gzip/brotli das respostas (listas de centenas de KB de JSON repetitivo)
+app.add_middleware(
+    CompressaoMiddleware,
+    minimo=int(os.getenv("COMPRESSAO_MINIMO", "1024")),
+    nivel_gzip=int(os.getenv("COMPRESSAO_NIVEL_GZIP", "6")),
+    nivel_brotli=int(os.getenv("COMPRESSAO_NIVEL_BROTLI", "4")),
 )
 
+# Chave única já cadastrada (CNPJ, número FE, e-mail...) → 409 em vez de 500
+@app.exception_handler(DuplicateKeyError)
+async def chave_duplicada(request: Request, exc: DuplicateKeyError):
+    campos = ", ".join(f"{k} = {v}" for k, v in ((exc.details or {}).get("keyValue") or {}).items())
+    return RespostaJSON({"detail": f"Já existe um registro com {campos or 'a mesma chave'}"}, status_code=409)
+
+
 # ============================================================
 # 3. Conexão com MongoDB Atlas
 # ============================================================
 MONGODB_URL = os.getenv("MONGODB_URL", os.getenv("MONGO_URL", "mongodb://localhost:27017"))
 DB_NAME = os.getenv("DB_NAME", "erp_database")
-client = AsyncIOMotorClient(MONGODB_URL)
+# tz_aware: datas lidas do banco voltam com fuso (UTC) e saem na API como ISO 8601 com offset
+client = AsyncIOMotorClient(MONGODB_URL, tz_aware=True, tzinfo=timezone.utc)
 db = client[DB_NAME]
 
 # ============================================================
@@ -66,36 +113,71 @@ db = client[DB_NAME]
 SECRET_KEY = os.getenv("SECRET_KEY", "TROQUE-NO-ENV")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 480  # 8 horas
+# Token do ?token= do SSE: vai na URL (logs de proxy, histórico), então vale pouco e só para o stream
+STREAM_TOKEN_EXPIRE_SECONDS = int(os.getenv("STREAM_TOKEN_EXPIRE_SECONDS", "60"))
 
 bearer_scheme = HTTPBearer()
+bearer_opcional = HTTPBearer(auto_error=False)
+
+# bcrypt leva ~250 ms por chamada no custo 12: roda num pool de threads limitado
+# (o bcrypt libera o GIL) para não travar o event loop durante rajadas de login
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+BCRYPT_WORKERS = int(os.getenv("BCRYPT_WORKERS", str(min(4, os.cpu_count() or 1))))
+executor_senhas = ThreadPoolExecutor(max_workers=BCRYPT_WORKERS, thread_name_prefix="bcrypt")
 
 
-def verificar_senha(senha_plain: str, senha_hash: str) -> bool:
-    return bcrypt.checkpw(senha_plain.encode("utf-8"), senha_hash.encode("utf-8"))
+async def verificar_senha(senha_plain: str, senha_hash: str) -> bool:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        executor_senhas, bcrypt.checkpw, senha_plain.encode("utf-8"), senha_hash.encode("utf-8")
+    )
 
 
-def gerar_hash_senha(senha: str) -> str:
-    return bcrypt.hashpw(senha.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
+async def gerar_hash_senha(senha: str) -> str:
+    loop = asyncio.get_running_loop()
+    salt = bcrypt.gensalt(rounds=BCRYPT_ROUNDS)
+    senha_hash = await loop.run_in_executor(executor_senhas, bcrypt.hashpw, senha.encode("utf-8"), salt)
+    return senha_hash.decode("utf-8")
 
 
-def criar_token(data: dict) -> str:
+def criar_token(data: dict, validade: Optional[timedelta] = None) -> str:
     payload = data.copy()
-    payload["exp"] = datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    payload["exp"] = datetime.now(timezone.utc) + (validade or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
     return jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
 
 
-def verificar_token(credentials: HTTPAuthorizationCredentials = Depends(bearer_scheme)):
+def decodificar_token(token: str, escopo: Optional[str] = None) -> dict:
+    """Token de sessão não tem escopo; um token de escopo (ex.: "stream") só vale onde é pedido."""
     try:
-        payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         email: str = payload.get("sub")
         role: str = payload.get("role", "vendedor")
-        if email is None:
+        if email is None or payload.get("escopo") != escopo:
             raise HTTPException(status_code=401, detail="Token inválido")
         return {"email": email, "role": role}
     except JWTError:
         raise HTTPException(status_code=401, detail="Token inválido ou expirado")
 
 
+def verificar_token(credentials: HTTPAuthorizationCredentials = Depends(bearer_scheme)):
+    return decodificar_token(credentials.credentials)
+
+
+def verificar_token_stream(
+    token: Optional[str] = None,
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(bearer_opcional),
+):
+    """
+    EventSource não envia headers: aceita em ?token= o token curto de POST /api/stream/token
+    (nunca o JWT de sessão). Clientes que mandam headers seguem usando o Bearer.
+    """
+    if credentials:
+        return decodificar_token(credentials.credentials)
+    if token:
+        return decodificar_token(token, escopo="stream")
+    raise HTTPException(status_code=401, detail="Token ausente")
+
+
 def apenas_admin(usuario=Depends(verificar_token)):
     if usuario.get("role") != "admin":
         raise HTTPException(status_code=403, detail="Acesso restrito a administradores")
@@ -106,8 +188,145 @@ def apenas_admin(usuario=Depends(verificar_token)):
 # 5. LGPD — Soft Delete + Auditoria
 # ============================================================
 
-# Filtro padrão para excluir registros deletados de todas as listagens
-FILTRO_ATIVO = {"$or": [{"deletado": {"$exists": False}}, {"deletado": False}]}
+# Filtro padrão para excluir registros deletados de todas as listagens.
+# Igualdade simples: todo insert grava `deletado: False` (documentos antigos:
+# `python migracoes.py deletado`, uma vez), o que permite usar os índices
+# parciais {deletado: false} criados no startup.
+FILTRO_ATIVO = {"deletado": False}
+
+AUDITORIA_LOTE = int(os.getenv("AUDITORIA_LOTE", "200"))
+AUDITORIA_INTERVALO = float(os.getenv("AUDITORIA_INTERVALO", "1.0"))
+AUDITORIA_FILA_MAX = int(os.getenv("AUDITORIA_FILA_MAX", "10000"))
+# Lotes que o banco recusou após as tentativas ficam aqui até a próxima gravação bem-sucedida
+AUDITORIA_PENDENTES = os.getenv("AUDITORIA_PENDENTES", "auditoria_pendente.jsonl")
+
+
+class EscritorAuditoria:
+    """
+    Grava o log de auditoria em lote, fora do caminho da requisição.
+    Os registros vão para uma fila em memória e são gravados com insert_many ao atingir
+    AUDITORIA_LOTE registros ou a cada AUDITORIA_INTERVALO segundos.
+    Com a fila cheia a requisição espera vaga (backpressure) — nenhum registro é descartado.
+    Um lote que falha em todas as tentativas vai para o arquivo `pendentes` (JSONL) e é
+    reenviado ao banco assim que uma gravação volta a funcionar, ou no próximo start.
+    """
+
+    def __init__(self, lote: int, intervalo: float, maximo: int, pendentes: str):
+        self.lote = lote
+        self.intervalo = intervalo
+        self.maximo = maximo
+        self.pendentes = pendentes
+        self.fila: Optional[asyncio.Queue] = None
+        self.tarefa: Optional[asyncio.Task] = None
+
+    def iniciar(self):
+        self.fila = asyncio.Queue(maxsize=self.maximo)
+        self.tarefa = asyncio.create_task(self._executar())
+
+    async def registrar(self, registro: dict):
+        if self.tarefa is None or self.tarefa.done():
+            # Fora do servidor (scripts) ou após o shutdown: grava direto
+            await db.auditoria.insert_one(registro)
+            return
+        await self.fila.put(registro)
+
+    async def encerrar(self):
+        """Grava o que ainda está na fila e finaliza o escritor (shutdown gracioso)."""
+        if self.tarefa is None or self.tarefa.done():
+            return
+        await self.fila.put(None)
+        await self.tarefa
+
+    async def _executar(self):
+        loop = asyncio.get_running_loop()
+        await self._reenviar_pendentes()
+        while True:
+            registro = await self.fila.get()
+            if registro is None:
+                return
+            lote = [registro]
+            prazo = loop.time() + self.intervalo
+            encerrar = False
+            while len(lote) < self.lote:
+                restante = prazo - loop.time()
+                if restante <= 0:
+                    break
+                try:
+                    registro = await asyncio.wait_for(self.fila.get(), restante)
+                except asyncio.TimeoutError:
+                    break
+                if registro is None:
+                    encerrar = True
+                    break
+                lote.append(registro)
+            await self._gravar(lote)
+            if encerrar:
+                return
+
+    async def _inserir(self, lote: List[dict]):
+        try:
+            await db.auditoria.insert_many(lote, ordered=False)
+        except BulkWriteError as e:
+            # Nova tentativa de um lote parcialmente gravado: os _id já existem
+            if not all(erro.get("code") == 11000 for erro in e.details.get("writeErrors", [])):
+                raise
+
+    async def _gravar(self, lote: List[dict]):
+        for tentativa in range(5):
+            try:
+                await self._inserir(lote)
+                break
+            except Exception:
+                logger.exception("Falha ao gravar lote de auditoria")
+            await asyncio.sleep(2 ** tentativa)
+        else:
+            await self._derramar(lote)
+            return
+        # O banco voltou: devolve o que ficou no arquivo durante a falha
+        await self._reenviar_pendentes()
+
+    async def _derramar(self, lote: List[dict]):
+        """Anexa ao arquivo de pendentes o lote que o banco recusou."""
+        linhas = "".join(json_util.dumps(registro) + "\n" for registro in lote)
+
+        def anexar():
+            with open(self.pendentes, "a", encoding="utf-8") as arquivo:
+                arquivo.write(linhas)
+
+        try:
+            await asyncio.to_thread(anexar)
+        except OSError:
+            logger.exception(f"❌ {len(lote)} registros de auditoria PERDIDOS: banco e {self.pendentes} indisponíveis")
+            return
+        logger.error(f"⚠️ {len(lote)} registros de auditoria salvos em {self.pendentes} até o banco voltar")
+
+    async def _reenviar_pendentes(self):
+        # Renomeia antes de ler: o que for derramado durante o reenvio vai para um arquivo novo
+        reenviando = self.pendentes + ".reenviando"
+        if not os.path.exists(reenviando):
+            if not os.path.exists(self.pendentes):
+                return
+            os.replace(self.pendentes, reenviando)
+
+        def ler():
+            with open(reenviando, encoding="utf-8") as arquivo:
+                return [json_util.loads(linha) for linha in arquivo if linha.strip()]
+
+        registros = await asyncio.to_thread(ler)
+        try:
+            for inicio in range(0, len(registros), self.lote):
+                await self._inserir(registros[inicio:inicio + self.lote])
+        except Exception:
+            # Fica em .reenviando e volta a ser tentado na próxima gravação bem-sucedida
+            logger.exception(f"Falha ao reenviar {len(registros)} registros de auditoria pendentes")
+            return
+        os.remove(reenviando)
+        logger.info(f"✅ {len(registros)} registros de auditoria pendentes regravados")
+
+
+escritor_auditoria = EscritorAuditoria(
+    AUDITORIA_LOTE, AUDITORIA_INTERVALO, AUDITORIA_FILA_MAX, AUDITORIA_PENDENTES
+)
 
 
 async def registrar_auditoria(
@@ -124,6 +343,7 @@ async def registrar_auditoria(
     """
     Registra qualquer ação no log de auditoria LGPD.
     Imutável — nunca deletamos registros de auditoria (LGPD Art. 37).
+    A gravação é feita em lote pelo escritor_auditoria.
     """
     for campo in ["senha_hash", "password", "token"]:
         if dados_antes:
@@ -140,12 +360,60 @@ async def registrar_auditoria(
         "dados_antes": dados_antes,
         "dados_depois": dados_depois,
         "detalhes": detalhes,
-        "criado_em": datetime.now(timezone.utc).isoformat(),
+        "criado_em": datetime.now(timezone.utc),
     }
-    await db.auditoria.insert_one(registro)
+    await escritor_auditoria.registrar(registro)
     logger.info(f"📋 Auditoria: {usuario_email} → {acao} em {colecao}/{documento_id}")
 
 
+def snapshot_auditoria(doc: Optional[dict], campos: Optional[List[str]] = None) -> dict:
+    """Cópia rasa do documento para o log de auditoria, opcionalmente só com `campos`."""
+    doc = doc or {}
+    if campos is not None:
+        return {k: doc.get(k) for k in campos}
+    return dict(doc)
+
+
+async def atualizar_retornando_anterior(colecao: str, filtro: dict, update: dict, **kwargs) -> Optional[dict]:
+    """Aplica `update` e devolve o documento como estava antes — uma única ida ao banco."""
+    antes = await db[colecao].find_one_and_update(filtro, update, return_document=ReturnDocument.BEFORE, **kwargs)
+    await registrar_escrita(colecao)
+    return antes
+
+
+async def atualizar_com_auditoria(
+    *,
+    colecao: str,
+    filtro: dict,
+    update: dict,
+    usuario: dict,
+    documento_id: str,
+    detalhes: Union[str, Callable[[dict], str]],
+    dados_depois: Optional[dict] = None,
+    campos_antes: Optional[List[str]] = None,
+) -> Optional[dict]:
+    """
+    Atualiza e registra a auditoria (antes/depois) sem a leitura prévia.
+    Devolve o documento anterior, ou None se nada casou com o filtro —
+    quem chama decide entre 404/403. `detalhes` pode receber o documento anterior.
+    """
+    antes = await atualizar_retornando_anterior(colecao, filtro, update)
+    if antes is None:
+        return None
+    await registrar_auditoria(
+        acao="UPDATE",
+        colecao=colecao,
+        documento_id=documento_id,
+        usuario_email=usuario["email"],
+        usuario_role=usuario["role"],
+        dados_antes=snapshot_auditoria(antes, campos_antes),
+        dados_depois=dados_depois,
+        detalhes=detalhes(antes) if callable(detalhes) else detalhes,
+    )
+    await publicar_evento(colecao, "update", str(antes["_id"]))
+    return antes
+
+
 async def soft_delete(
     *,
     colecao: str,
@@ -159,30 +427,35 @@ async def soft_delete(
     Dados ficam retidos pelo prazo legal (5 anos) conforme LGPD.
     """
     oid = ObjectId(documento_id)
-    doc_atual = await db[colecao].find_one({"_id": oid})
-    if not doc_atual:
-        raise HTTPException(status_code=404, detail="Documento não encontrado")
-    if doc_atual.get("deletado"):
-        raise HTTPException(status_code=400, detail="Registro já foi deletado anteriormente")
-
-    await db[colecao].update_one(
-        {"_id": oid},
+    agora = datetime.now(timezone.utc)
+    doc_atual = await atualizar_retornando_anterior(
+        colecao,
+        {"_id": oid, **FILTRO_ATIVO},
         {"$set": {
             "deletado": True,
-            "deletado_em": datetime.now(timezone.utc).isoformat(),
+            "deletado_em": agora,
+            "atualizado_em": agora,
             "deletado_por": usuario_email,
             "motivo_delecao": motivo or "Não informado",
         }}
     )
+    if doc_atual is None:
+        # Só no caminho de erro: distingue "não existe" de "já deletado"
+        if await db[colecao].find_one({"_id": oid}, {"_id": 1}):
+            raise HTTPException(status_code=400, detail="Registro já foi deletado anteriormente")
+        raise HTTPException(status_code=404, detail="Documento não encontrado")
+
+    if colecao == "pedidos":
+        await aplicar_rollup(remover=[contribuicao_pedido(doc_atual)])
+    await publicar_evento(colecao, "update", documento_id)
 
-    doc_serial = {k: str(v) if isinstance(v, ObjectId) else v for k, v in doc_atual.items()}
     await registrar_auditoria(
         acao="DELETE",
         colecao=colecao,
         documento_id=documento_id,
         usuario_email=usuario_email,
         usuario_role=usuario_role,
-        dados_antes=doc_serial,
+        dados_antes=snapshot_auditoria(doc_atual),
         detalhes=f"Soft delete — motivo: {motivo or 'Não informado'}",
     )
     return {"message": "Registro deletado com segurança. Retido por 5 anos conforme LGPD."}
@@ -191,23 +464,49 @@ async def soft_delete(
 # ============================================================
 # 6. Startup — cria admin padrão e índices
 # ============================================================
+INTERVALO_STATUS_VENCIMENTOS = int(os.getenv("INTERVALO_STATUS_VENCIMENTOS", str(24 * 3600)))
+
+# Tarefas em segundo plano do processo — canceladas no shutdown
+tarefas_background: List[asyncio.Task] = []
+
+# Feed SSE (/api/stream/eventos): um change stream compartilhado por processo
+canal_eventos = CanalEventos(["pedidos", "notas_fiscais", "vencimentos"])
+
+
+# Cache em memória dos catálogos — lidos em quase toda página, alterados raramente
+COLECOES_CACHE = ["materiais", "clientes"]
+cache_catalogos = CacheTTL(
+    ttl=float(os.getenv("CACHE_TTL_SEGUNDOS", "60")),
+    max_itens=int(os.getenv("CACHE_MAX_ITENS", "256")),
+)
+# Com vários workers: invalida também quando outro processo grava (requer replica set)
+CACHE_INVALIDACAO_CHANGE_STREAM = os.getenv("CACHE_INVALIDACAO_CHANGE_STREAM", "false").lower() == "true"
+
+
+def invalidar_cache(colecao: str):
+    if colecao in COLECOES_CACHE:
+        cache_catalogos.invalidar(colecao)
+
+
+async def registrar_escrita(*colecoes: str):
+    """Toda gravação passa por aqui: invalida o cache e avança a versão (ETag) das coleções."""
+    for colecao in colecoes:
+        invalidar_cache(colecao)
+    await avancar_versoes(db, colecoes)
+
+
+async def publicar_evento(colecao: str, operacao: str, documento_id: Optional[str] = None, documento: Optional[dict] = None):
+    """Alimenta o fallback de polling do feed SSE (no-op quando há change stream)."""
+    await canal_eventos.publicar(db, colecao, operacao, documento_id, documento)
+
+
 @app.on_event("startup")
 async def startup():
-    # Índices para performance
-    await db.usuarios.create_index("email", unique=True)
-    await db.clientes.create_index("cnpj")
-    await db.pedidos.create_index("numero_oc")
-    await db.pedidos.create_index("cliente_id")
-    await db.pedidos.create_index("status")
-    await db.orcamentos.create_index("numero_proposta")
-    await db.orcamentos.create_index("cliente_id")
-    await db.orcamentos.create_index("status")
-
-    # Índices LGPD — auditoria
-    await db.auditoria.create_index("colecao")
-    await db.auditoria.create_index("usuario_email")
-    await db.auditoria.create_index("criado_em")
-    await db.auditoria.create_index([("colecao", 1), ("documento_id", 1)])
+    await inicializar_sequencias()
+
+    # Índices — o registro (e o formato de consulta que cada um atende) fica em migracoes.INDICES
+    for pendente in await aplicar_indices(db):
+        logger.error(f"❌ Índice único não criado — há duplicatas gravadas: {pendente}")
 
     # Cria admin padrão se não existir
     admin_email = os.getenv("ADMIN_EMAIL", "rubensbmelo@hotmail.com")
@@ -219,18 +518,34 @@ async def startup():
             "id": str(uuid.uuid4()),
             "nome": admin_nome,
             "email": admin_email,
-            "senha_hash": gerar_hash_senha(senha_env),
+            "senha_hash": await gerar_hash_senha(senha_env),
             "role": "admin",
             "ativo": True,
-            "criado_em": datetime.now(timezone.utc).isoformat()
+            "criado_em": datetime.now(timezone.utc)
         })
         logger.info(f"✅ Usuário admin criado: {admin_email}")
 
+    escritor_auditoria.iniciar()
+    tarefas_background.append(asyncio.create_task(agendador_vencimentos()))
+    tarefas_background.append(asyncio.create_task(canal_eventos.executar(db)))
+    if CACHE_INVALIDACAO_CHANGE_STREAM:
+        tarefas_background.append(asyncio.create_task(
+            invalidar_por_change_stream(db, cache_catalogos, COLECOES_CACHE)
+        ))
+
 
 # ============================================================
 # 7. Schemas
 # ============================================================
 
+def _vazio_como_none(valor):
+    return None if valor == "" else valor
+
+
+# Data de negócio opcional nos schemas: "YYYY-MM-DD", com "" valendo como ausente
+DataOpcional = Annotated[Optional[date], BeforeValidator(_vazio_como_none)]
+
+
 class LoginSchema(BaseModel):
     email: str
     password: str
@@ -292,7 +607,7 @@ class PedidoSchema(BaseModel):
     peso_total: float = 0.0
     quantidade: Optional[int] = 0
     comissao_valor: Optional[float] = 0.0
-    data_entrega: Optional[str] = ""
+    data_entrega: DataOpcional = None
     numero_fabrica: Optional[str] = ""
     numero_oc: Optional[str] = ""
     condicao_pagamento: Optional[str] = ""
@@ -312,14 +627,266 @@ def to_object_id(id_str: str) -> ObjectId:
         raise HTTPException(status_code=400, detail=f"ID inválido: {id_str}")
 
 
+# ------------------------------------------------------------
+# Datas — BSON date no banco (migracoes.py datas converte o legado em texto)
+# ------------------------------------------------------------
+# Carimbos (criado_em, atualizado_em, ...) são datetime UTC. Datas de negócio,
+# sem hora, ficam à meia-noite UTC e saem na API como "YYYY-MM-DD" — o formato
+# do <input type="date"> que o frontend envia e exibe.
+CAMPOS_DATA = ["data_entrega", "data_emissao", "data_vencimento", "prazo_pagamento", "data_pagamento"]
+
+
+def para_data(valor) -> Optional[datetime]:
+    """date, datetime ou "YYYY-MM-DD" → meia-noite UTC do dia, como as datas de negócio são gravadas."""
+    if isinstance(valor, str):
+        valor = date.fromisoformat(valor[:10]) if valor else None
+    if valor is None:
+        return None
+    return datetime(valor.year, valor.month, valor.day, tzinfo=timezone.utc)
+
+
+def datas_para_bson(doc: dict) -> dict:
+    """Converte as datas de negócio vindas dos schemas (date) para datetime, no próprio doc."""
+    for campo in CAMPOS_DATA:
+        if isinstance(doc.get(campo), date):
+            doc[campo] = para_data(doc[campo])
+    return doc
+
+
+def mes_utc(ano: int, mes: int) -> datetime:
+    """Dia 1º do mês à meia-noite UTC — mes=13 é janeiro do ano seguinte (fim exclusivo de janelas)."""
+    return datetime(ano + (mes - 1) // 12, (mes - 1) % 12 + 1, 1, tzinfo=timezone.utc)
+
+
 def serialize(doc: dict) -> dict:
     if "_id" in doc:
         doc["id"] = str(doc.pop("_id"))
+    for campo in CAMPOS_DATA:
+        if isinstance(doc.get(campo), datetime):
+            doc[campo] = doc[campo].strftime("%Y-%m-%d")
     return doc
 
 
-def gerar_numero_oc() -> str:
-    return f"OC-{datetime.now().strftime('%Y%m%d%H%M%S')}"
+# _id → id (string) feito pelo próprio MongoDB nas listagens, sem passar documento por documento em Python
+ESTAGIOS_ID = [{"$set": {"id": {"$toString": "$_id"}}}, {"$project": {"_id": 0}}]
+
+# Datas de negócio de volta a "YYYY-MM-DD"; campos ausentes continuam ausentes
+ESTAGIO_DATAS = {"$set": {
+    campo: {"$cond": [
+        {"$eq": [{"$type": f"${campo}"}, "date"]},
+        {"$dateToString": {"date": f"${campo}", "format": "%Y-%m-%d"}},
+        f"${campo}",
+    ]}
+    for campo in CAMPOS_DATA
+}}
+ESTAGIOS_SAIDA = ESTAGIOS_ID + [ESTAGIO_DATAS]
+
+
+# ------------------------------------------------------------
+# Paginação por cursor (keyset) + projeção de campos
+# ------------------------------------------------------------
+LIMITE_PAGINA_MAX = 500
+
+
+# Nome de campo (ou subcampo com ponto): sem `$`, sem segmentos vazios
+CAMPO_PROJECAO = re.compile(r"[A-Za-z_][A-Za-z0-9_]*(\.[A-Za-z_][A-Za-z0-9_]*)*")
+
+
+def projecao_campos(fields: Optional[str], campo_ordem: str = "_id") -> Optional[dict]:
+    """Converte `fields=nome,cnpj` em projeção do MongoDB (sempre inclui o campo de ordenação)."""
+    if not fields:
+        return None
+    nomes = [c.strip() for c in fields.split(",")]
+    invalidos = [c for c in nomes if not CAMPO_PROJECAO.fullmatch(c)]
+    if invalidos:
+        raise HTTPException(status_code=400, detail=f"Campos inválidos em fields: {invalidos}")
+    campos = dict.fromkeys(nomes, 1)
+    campos[campo_ordem] = 1
+    # `itens` e `itens.descricao` juntos: o MongoDB recusa a projeção (path collision)
+    conflitos = sorted(c for c in campos if any(c.startswith(f"{outro}.") for outro in campos))
+    if conflitos:
+        raise HTTPException(status_code=400, detail=f"Campos sobrepostos em fields: {conflitos}")
+    return campos
+
+
+def codificar_cursor(valor, oid: ObjectId) -> str:
+    bruto = json.dumps([valor, str(oid)], default=str)
+    return base64.urlsafe_b64encode(bruto.encode("utf-8")).decode("ascii")
+
+
+def decodificar_cursor(cursor: str):
+    try:
+        valor, oid = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return valor, ObjectId(oid)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
+
+async def listar_paginado(
+    colecao: str,
+    filtro: dict,
+    *,
+    cursor: Optional[str] = None,
+    limite: Optional[int] = None,
+    fields: Optional[str] = None,
+    campo_ordem: str = "_id",
+    direcao: int = 1,
+):
+    """
+    Listagem com paginação keyset sobre (campo_ordem, _id).
+    Sem `cursor`/`limite` devolve a lista completa (compatível com o frontend atual);
+    com eles devolve {"items": [...], "next_cursor": ...} a custo constante por página.
+    """
+    projecao = projecao_campos(fields, campo_ordem)
+    ordem = {"_id": direcao} if campo_ordem == "_id" else {campo_ordem: direcao, "_id": direcao}
+
+    def pipeline(filtro: dict, limite: Optional[int] = None) -> list:
+        estagios = [{"$match": filtro}, {"$sort": ordem}]
+        if limite:
+            estagios.append({"$limit": limite})
+        if projecao:
+            estagios.append({"$project": projecao})
+        return estagios + ESTAGIOS_SAIDA
+
+    if cursor is None and limite is None:
+        return await db[colecao].aggregate(pipeline(filtro)).to_list(length=None)
+
+    limite = max(1, min(limite or LIMITE_PAGINA_MAX, LIMITE_PAGINA_MAX))
+    if cursor:
+        valor, oid = decodificar_cursor(cursor)
+        if campo_ordem in CAMPOS_DATA and isinstance(valor, str):
+            # a data vai no cursor como saiu na resposta ("YYYY-MM-DD")
+            try:
+                valor = para_data(valor)
+            except ValueError:
+                raise HTTPException(status_code=400, detail="Cursor inválido")
+        op = "$gt" if direcao == 1 else "$lt"
+        if campo_ordem == "_id":
+            apos = {"_id": {op: oid}}
+        elif valor is None:
+            # nulos/ausentes ordenam antes de qualquer valor
+            apos = {"$or": [{campo_ordem: None, "_id": {op: oid}}]}
+            if direcao == 1:
+                apos["$or"].insert(0, {campo_ordem: {"$ne": None}})
+        else:
+            apos = {"$or": [{campo_ordem: {op: valor}}, {campo_ordem: valor, "_id": {op: oid}}]}
+        filtro = {"$and": [filtro, apos]} if filtro else apos
+
+    docs = await db[colecao].aggregate(pipeline(filtro, limite + 1)).to_list(length=limite + 1)
+    next_cursor = None
+    if len(docs) > limite:
+        docs = docs[:limite]
+        ultimo = docs[-1]
+        next_cursor = codificar_cursor(ultimo.get(campo_ordem) if campo_ordem != "_id" else None, ObjectId(ultimo["id"]))
+    return {"items": docs, "next_cursor": next_cursor}
+
+
+# ------------------------------------------------------------
+# GET condicional — ETag pela versão das coleções
+# ------------------------------------------------------------
+async def versoes_colecoes(colecoes: List[str]) -> List[int]:
+    versoes = {d["_id"]: d["versao"] async for d in db.versoes.find({"_id": {"$in": colecoes}})}
+    return [versoes.get(c, 0) for c in colecoes]
+
+
+def etag_confere(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidatos = [t.strip() for t in if_none_match.split(",")]
+    return "*" in candidatos or any(t.removeprefix("W/") == etag for t in candidatos)
+
+
+async def resposta_condicional(
+    request: Request,
+    colecoes: List[str],
+    carregar: Callable[[], Awaitable],
+    extra: str = "",
+):
+    """
+    ETag forte = hash das versões das coleções (registrar_escrita) + query string.
+    If-None-Match igual → 304 sem ler nenhum documento. A versão é lida antes
+    dos dados: uma gravação no meio gera no máximo um ETag que não confere
+    na próxima requisição, nunca um 304 com dado velho.
+    """
+    versoes = await versoes_colecoes(colecoes)
+    base = json.dumps([colecoes, versoes, sorted(request.query_params.multi_items()), extra])
+    etag = f'"{hashlib.sha1(base.encode("utf-8")).hexdigest()[:24]}"'
+    cabecalhos = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_confere(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=cabecalhos)
+    return RespostaJSON(await carregar(), headers=cabecalhos)
+
+
+async def obter_catalogo(colecao: str, chave: tuple, carregar: Callable[[], Awaitable]):
+    """
+    Cache dos catálogos com a versão da coleção na chave. Uma gravação em outro
+    worker avança a versão em db.versoes (o mesmo valor do ETag), então a
+    próxima leitura aqui cai numa chave nova e recarrega — sem depender do
+    change stream. As entradas de versões antigas saem pelo LRU/TTL.
+    """
+    versao, = await versoes_colecoes([colecao])
+    return await cache_catalogos.obter((colecao, versao, *chave), carregar)
+
+
+# ------------------------------------------------------------
+# Sequências atômicas (coleção `contadores`)
+# ------------------------------------------------------------
+SEQUENCIA_BLOCO = int(os.getenv("SEQUENCIA_BLOCO", "1"))
+
+
+async def reservar_sequencia(nome: str, quantidade: int = 1) -> int:
+    """Reserva `quantidade` números da sequência com um único $inc e devolve o último reservado."""
+    doc = await db.contadores.find_one_and_update(
+        {"_id": nome},
+        {"$inc": {"valor": quantidade}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    return doc["valor"]
+
+
+class AlocadorSequencia:
+    """
+    Entrega números de uma sequência reservando blocos de `bloco` por ida ao banco.
+    Com bloco > 1, números não usados de um bloco se perdem num restart (lacunas, nunca repetição).
+    """
+
+    def __init__(self, nome: str, bloco: int = 1):
+        self.nome = nome
+        self.bloco = max(1, bloco)
+        self.atual = 1
+        self.fim = 0
+        self.lock = asyncio.Lock()
+
+    async def proximo(self) -> int:
+        if self.bloco == 1:
+            return await reservar_sequencia(self.nome)
+        async with self.lock:
+            if self.atual > self.fim:
+                self.fim = await reservar_sequencia(self.nome, self.bloco)
+                self.atual = self.fim - self.bloco + 1
+            valor = self.atual
+            self.atual += 1
+            return valor
+
+
+sequencia_clientes = AlocadorSequencia("clientes", SEQUENCIA_BLOCO)
+sequencia_pedidos = AlocadorSequencia("pedidos", SEQUENCIA_BLOCO)
+sequencia_orcamentos = AlocadorSequencia("orcamentos", SEQUENCIA_BLOCO)
+
+
+async def inicializar_sequencias():
+    """Garante que a sequência de clientes comece depois da maior referência CLI-NNNN já gravada."""
+    res = await db.clientes.aggregate([
+        {"$match": {"referencia": {"$regex": r"^CLI-\d+$"}}},
+        {"$group": {"_id": None, "maior": {"$max": {"$toInt": {"$substrCP": ["$referencia", 4, 12]}}}}},
+    ]).to_list(length=1)
+    maior = res[0]["maior"] if res else 0
+    await db.contadores.update_one({"_id": "clientes"}, {"$max": {"valor": maior}}, upsert=True)
+
+
+async def gerar_numero_oc() -> str:
+    return f"OC-{datetime.now().strftime('%Y%m%d')}-{await sequencia_pedidos.proximo():05d}"
 
 
 # ============================================================
@@ -329,7 +896,7 @@ def gerar_numero_oc() -> str:
 @app.post("/api/auth/login")
 async def login(data: LoginSchema):
     usuario = await db.usuarios.find_one({"email": data.email})
-    if not usuario or not verificar_senha(data.password, usuario["senha_hash"]):
+    if not usuario or not await verificar_senha(data.password, usuario["senha_hash"]):
         raise HTTPException(status_code=401, detail="E-mail ou senha incorretos")
     if not usuario.get("ativo", True):
         raise HTTPException(status_code=403, detail="Usuário inativo. Contate o administrador.")
@@ -369,20 +936,20 @@ async def get_me(usuario=Depends(verificar_token)):
 @app.put("/api/auth/trocar-senha")
 async def trocar_senha(data: UsuarioUpdateSenhaSchema, usuario=Depends(verificar_token)):
     doc = await db.usuarios.find_one({"email": usuario["email"]})
-    if not doc or not verificar_senha(data.senha_atual, doc["senha_hash"]):
+    if not doc or not await verificar_senha(data.senha_atual, doc["senha_hash"]):
         raise HTTPException(status_code=401, detail="Senha atual incorreta")
-    await db.usuarios.update_one(
-        {"email": usuario["email"]},
-        {"$set": {"senha_hash": gerar_hash_senha(data.nova_senha)}}
-    )
-    await registrar_auditoria(
-        acao="UPDATE",
+    # o hash conferido entra no filtro: uma troca concorrente não é sobrescrita
+    alterado = await atualizar_com_auditoria(
         colecao="usuarios",
+        filtro={"email": usuario["email"], "senha_hash": doc["senha_hash"]},
+        update={"$set": {"senha_hash": await gerar_hash_senha(data.nova_senha)}},
+        usuario=usuario,
         documento_id=str(doc.get("id", "")),
-        usuario_email=usuario["email"],
-        usuario_role=usuario["role"],
+        campos_antes=CAMPOS_AUDITORIA_USUARIO,
         detalhes="Senha alterada pelo próprio usuário",
     )
+    if alterado is None:
+        raise HTTPException(status_code=401, detail="Senha atual incorreta")
     return {"message": "Senha atualizada com sucesso!"}
 
 
@@ -390,10 +957,12 @@ async def trocar_senha(data: UsuarioUpdateSenhaSchema, usuario=Depends(verificar
 # 10. Gestão de Usuários (apenas admin)
 # ============================================================
 
+CAMPOS_AUDITORIA_USUARIO = ["nome", "email", "role", "ativo"]
+
+
 @app.get("/api/usuarios")
 async def listar_usuarios(admin=Depends(apenas_admin)):
-    usuarios = await db.usuarios.find({}, {"senha_hash": 0}).to_list(length=100)
-    return [serialize(u) for u in usuarios]
+    return await db.usuarios.aggregate([{"$project": {"senha_hash": 0}}, {"$limit": 100}, *ESTAGIOS_ID]).to_list(length=100)
 
 
 @app.post("/api/usuarios", status_code=201)
@@ -404,10 +973,10 @@ async def criar_usuario(data: UsuarioCreateSchema, admin=Depends(apenas_admin)):
         "id": str(uuid.uuid4()),
         "nome": data.nome,
         "email": data.email,
-        "senha_hash": gerar_hash_senha(data.password),
+        "senha_hash": await gerar_hash_senha(data.password),
         "role": data.role,
         "ativo": True,
-        "criado_em": datetime.now(timezone.utc).isoformat()
+        "criado_em": datetime.now(timezone.utc)
     }
     await db.usuarios.insert_one(novo)
     await registrar_auditoria(
@@ -424,29 +993,35 @@ async def criar_usuario(data: UsuarioCreateSchema, admin=Depends(apenas_admin)):
 
 @app.put("/api/usuarios/{usuario_id}/desativar")
 async def desativar_usuario(usuario_id: str, admin=Depends(apenas_admin)):
-    await db.usuarios.update_one({"id": usuario_id}, {"$set": {"ativo": False}})
-    await registrar_auditoria(
-        acao="UPDATE",
+    antes = await atualizar_com_auditoria(
         colecao="usuarios",
+        filtro={"id": usuario_id},
+        update={"$set": {"ativo": False}},
+        usuario=admin,
         documento_id=usuario_id,
-        usuario_email=admin["email"],
-        usuario_role=admin["role"],
+        campos_antes=CAMPOS_AUDITORIA_USUARIO,
+        dados_depois={"ativo": False},
         detalhes="Usuário desativado",
     )
+    if antes is None:
+        raise HTTPException(status_code=404, detail="Usuário não encontrado")
     return {"message": "Usuário desativado!"}
 
 
 @app.put("/api/usuarios/{usuario_id}/ativar")
 async def ativar_usuario(usuario_id: str, admin=Depends(apenas_admin)):
-    await db.usuarios.update_one({"id": usuario_id}, {"$set": {"ativo": True}})
-    await registrar_auditoria(
-        acao="UPDATE",
+    antes = await atualizar_com_auditoria(
         colecao="usuarios",
+        filtro={"id": usuario_id},
+        update={"$set": {"ativo": True}},
+        usuario=admin,
         documento_id=usuario_id,
-        usuario_email=admin["email"],
-        usuario_role=admin["role"],
+        campos_antes=CAMPOS_AUDITORIA_USUARIO,
+        dados_depois={"ativo": True},
         detalhes="Usuário reativado",
     )
+    if antes is None:
+        raise HTTPException(status_code=404, detail="Usuário não encontrado")
     return {"message": "Usuário ativado!"}
 
 
@@ -455,16 +1030,18 @@ async def editar_usuario(usuario_id: str, data: dict, admin=Depends(apenas_admin
     campos = {k: v for k, v in data.items() if k in ["nome", "email", "role"]}
     if not campos:
         raise HTTPException(status_code=400, detail="Nenhum campo válido para atualizar")
-    await db.usuarios.update_one({"id": usuario_id}, {"$set": campos})
-    await registrar_auditoria(
-        acao="UPDATE",
+    antes = await atualizar_com_auditoria(
         colecao="usuarios",
+        filtro={"id": usuario_id},
+        update={"$set": campos},
+        usuario=admin,
         documento_id=usuario_id,
-        usuario_email=admin["email"],
-        usuario_role=admin["role"],
+        campos_antes=CAMPOS_AUDITORIA_USUARIO,
         dados_depois=campos,
         detalhes="Dados do usuário alterados",
     )
+    if antes is None:
+        raise HTTPException(status_code=404, detail="Usuário não encontrado")
     return {"message": "Usuário atualizado!"}
 
 
@@ -473,34 +1050,32 @@ async def resetar_senha(usuario_id: str, data: dict, admin=Depends(apenas_admin)
     nova_senha = data.get("nova_senha")
     if not nova_senha or len(nova_senha) < 6:
         raise HTTPException(status_code=400, detail="Senha deve ter no mínimo 6 caracteres")
-    await db.usuarios.update_one(
-        {"id": usuario_id},
-        {"$set": {"senha_hash": gerar_hash_senha(nova_senha)}}
-    )
-    await registrar_auditoria(
-        acao="UPDATE",
+    antes = await atualizar_com_auditoria(
         colecao="usuarios",
+        filtro={"id": usuario_id},
+        update={"$set": {"senha_hash": await gerar_hash_senha(nova_senha)}},
+        usuario=admin,
         documento_id=usuario_id,
-        usuario_email=admin["email"],
-        usuario_role=admin["role"],
+        campos_antes=CAMPOS_AUDITORIA_USUARIO,
         detalhes=f"Senha resetada pelo admin {admin['email']}",
     )
+    if antes is None:
+        raise HTTPException(status_code=404, detail="Usuário não encontrado")
     return {"message": "Senha resetada com sucesso!"}
 
 
 @app.delete("/api/usuarios/{usuario_id}")
 async def deletar_usuario(usuario_id: str, admin=Depends(apenas_admin)):
-    doc = await db.usuarios.find_one({"id": usuario_id})
+    doc = await db.usuarios.find_one_and_delete({"id": usuario_id})
     if not doc:
         raise HTTPException(status_code=404, detail="Usuário não encontrado")
-    await db.usuarios.delete_one({"id": usuario_id})
     await registrar_auditoria(
         acao="DELETE",
         colecao="usuarios",
         documento_id=usuario_id,
         usuario_email=admin["email"],
         usuario_role=admin["role"],
-        dados_antes={"nome": doc.get("nome"), "email": doc.get("email"), "role": doc.get("role")},
+        dados_antes=snapshot_auditoria(doc, CAMPOS_AUDITORIA_USUARIO),
         detalhes="Usuário removido permanentemente",
     )
     return {"message": "Usuário removido!"}
@@ -511,17 +1086,28 @@ async def deletar_usuario(usuario_id: str, admin=Depends(apenas_admin)):
 # ============================================================
 
 @app.get("/api/materiais")
-async def listar_materiais(usuario=Depends(verificar_token)):
-    materiais = await db.materiais.find(FILTRO_ATIVO).to_list(length=500)
-    return [serialize(m) for m in materiais]
+async def listar_materiais(
+    request: Request,
+    cursor: Optional[str] = None,
+    limite: Optional[int] = Query(None, ge=1, le=LIMITE_PAGINA_MAX),
+    fields: Optional[str] = None,
+    usuario=Depends(verificar_token),
+):
+    return await resposta_condicional(request, ["materiais"], lambda: obter_catalogo(
+        "materiais",
+        (cursor, limite, fields),
+        lambda: listar_paginado("materiais", FILTRO_ATIVO, cursor=cursor, limite=limite, fields=fields),
+    ))
 
 
 @app.post("/api/materiais", status_code=201)
 async def criar_material(material: MaterialSchema, usuario=Depends(verificar_token)):
     doc = material.dict()
-    doc["criado_em"] = datetime.now(timezone.utc).isoformat()
+    doc["criado_em"] = doc["atualizado_em"] = datetime.now(timezone.utc)
     doc["criado_por"] = usuario["email"]
+    doc["deletado"] = False
     result = await db.materiais.insert_one(doc)
+    await registrar_escrita("materiais")
     await registrar_auditoria(
         acao="CREATE",
         colecao="materiais",
@@ -536,29 +1122,20 @@ async def criar_material(material: MaterialSchema, usuario=Depends(verificar_tok
 
 @app.put("/api/materiais/{material_id}")
 async def atualizar_material(material_id: str, material: MaterialSchema, usuario=Depends(verificar_token)):
-    antes = await db.materiais.find_one({"_id": to_object_id(material_id)})
-    antes_serial = {k: str(v) if isinstance(v, ObjectId) else v for k, v in (antes or {}).items()}
-
     doc = material.dict()
-    doc["atualizado_em"] = datetime.now(timezone.utc).isoformat()
+    doc["atualizado_em"] = datetime.now(timezone.utc)
     doc["atualizado_por"] = usuario["email"]
-    result = await db.materiais.update_one(
-        {"_id": to_object_id(material_id)},
-        {"$set": doc}
-    )
-    if result.matched_count == 0:
-        raise HTTPException(status_code=404, detail="Material não encontrado")
-
-    await registrar_auditoria(
-        acao="UPDATE",
+    antes = await atualizar_com_auditoria(
         colecao="materiais",
+        filtro={"_id": to_object_id(material_id)},
+        update={"$set": doc},
+        usuario=usuario,
         documento_id=material_id,
-        usuario_email=usuario["email"],
-        usuario_role=usuario["role"],
-        dados_antes=antes_serial,
         dados_depois=doc,
         detalhes=f"Material {doc.get('numero_fe', '')} atualizado",
     )
+    if antes is None:
+        raise HTTPException(status_code=404, detail="Material não encontrado")
     return {"message": "Material atualizado!"}
 
 
@@ -578,70 +1155,84 @@ async def deletar_material(material_id: str, motivo: str = "", admin=Depends(ape
 # ============================================================
 
 @app.get("/api/clientes")
-async def listar_clientes(usuario=Depends(verificar_token)):
-    clientes = await db.clientes.find(FILTRO_ATIVO).to_list(length=500)
-    return [serialize(c) for c in clientes]
+async def listar_clientes(
+    request: Request,
+    cursor: Optional[str] = None,
+    limite: Optional[int] = Query(None, ge=1, le=LIMITE_PAGINA_MAX),
+    fields: Optional[str] = None,
+    usuario=Depends(verificar_token),
+):
+    return await resposta_condicional(request, ["clientes"], lambda: obter_catalogo(
+        "clientes",
+        (cursor, limite, fields),
+        lambda: listar_paginado("clientes", FILTRO_ATIVO, cursor=cursor, limite=limite, fields=fields),
+    ))
 
 
 @app.get("/api/clientes/{cliente_id}")
 async def buscar_cliente(cliente_id: str, usuario=Depends(verificar_token)):
-    cliente = await db.clientes.find_one({"_id": to_object_id(cliente_id), **FILTRO_ATIVO})
-    if not cliente:
-        raise HTTPException(status_code=404, detail="Cliente não encontrado")
-    return serialize(cliente)
+    async def carregar():
+        cliente = await db.clientes.find_one({"_id": to_object_id(cliente_id), **FILTRO_ATIVO})
+        if not cliente:
+            raise HTTPException(status_code=404, detail="Cliente não encontrado")
+        return serialize(cliente)
 
+    return await obter_catalogo("clientes", (cliente_id,), carregar)
 
-@app.post("/api/clientes", status_code=201)
-async def criar_cliente(cliente: ClienteSchema, usuario=Depends(verificar_token)):
-    ultimo = await db.clientes.find_one({}, sort=[("criado_em", -1)])
-    num = 1
-    if ultimo and "referencia" in ultimo:
-        try:
-            num = int(ultimo["referencia"].split("-")[1]) + 1
-        except Exception:
-            pass
+
+async def novo_cliente(cliente: ClienteSchema, usuario: dict) -> dict:
     doc = cliente.dict()
-    doc["referencia"] = f"CLI-{num:04d}"
-    doc["criado_em"] = datetime.now(timezone.utc).isoformat()
+    doc["referencia"] = f"CLI-{await sequencia_clientes.proximo():04d}"
+    doc["nome_normalizado"] = normalizar_nome(doc["nome"])
+    doc["criado_em"] = doc["atualizado_em"] = datetime.now(timezone.utc)
     doc["criado_por"] = usuario["email"]
-    result = await db.clientes.insert_one(doc)
+    doc["deletado"] = False
+    return doc
+
+
+def cliente_atualizado(cliente: ClienteSchema, usuario: dict) -> dict:
+    doc = cliente.dict()
+    doc["nome_normalizado"] = normalizar_nome(doc["nome"])
+    doc["atualizado_em"] = datetime.now(timezone.utc)
+    doc["atualizado_por"] = usuario["email"]
+    return doc
+
+
+async def auditar_cliente_criado(doc: dict, usuario: dict):
     await registrar_auditoria(
         acao="CREATE",
         colecao="clientes",
-        documento_id=str(result.inserted_id),
+        documento_id=str(doc["_id"]),
         usuario_email=usuario["email"],
         usuario_role=usuario["role"],
         dados_depois={"nome": doc["nome"], "cnpj": doc["cnpj"], "cidade": doc["cidade"]},
         detalhes=f"Cliente {doc['nome']} cadastrado — CNPJ {doc['cnpj']}",
     )
+
+
+@app.post("/api/clientes", status_code=201)
+async def criar_cliente(cliente: ClienteSchema, usuario=Depends(verificar_token)):
+    doc = await novo_cliente(cliente, usuario)
+    result = await db.clientes.insert_one(doc)
+    await registrar_escrita("clientes")
+    await auditar_cliente_criado(doc, usuario)
     return {"id": str(result.inserted_id), "referencia": doc["referencia"], "message": "Cliente cadastrado!"}
 
 
 @app.put("/api/clientes/{cliente_id}")
 async def atualizar_cliente(cliente_id: str, cliente: ClienteSchema, usuario=Depends(verificar_token)):
-    antes = await db.clientes.find_one({"_id": to_object_id(cliente_id)})
-    antes_serial = {k: str(v) if isinstance(v, ObjectId) else v for k, v in (antes or {}).items()}
-
-    doc = cliente.dict()
-    doc["atualizado_em"] = datetime.now(timezone.utc).isoformat()
-    doc["atualizado_por"] = usuario["email"]
-    result = await db.clientes.update_one(
-        {"_id": to_object_id(cliente_id)},
-        {"$set": doc}
-    )
-    if result.matched_count == 0:
-        raise HTTPException(status_code=404, detail="Cliente não encontrado")
-
-    await registrar_auditoria(
-        acao="UPDATE",
+    doc = cliente_atualizado(cliente, usuario)
+    antes = await atualizar_com_auditoria(
         colecao="clientes",
+        filtro={"_id": to_object_id(cliente_id)},
+        update={"$set": doc},
+        usuario=usuario,
         documento_id=cliente_id,
-        usuario_email=usuario["email"],
-        usuario_role=usuario["role"],
-        dados_antes=antes_serial,
         dados_depois=doc,
         detalhes=f"Cliente {doc['nome']} atualizado",
     )
+    if antes is None:
+        raise HTTPException(status_code=404, detail="Cliente não encontrado")
     return {"message": "Cliente atualizado!"}
 
 
@@ -661,9 +1252,17 @@ async def deletar_cliente(cliente_id: str, motivo: str = "", admin=Depends(apena
 # ============================================================
 
 @app.get("/api/pedidos")
-async def listar_pedidos(usuario=Depends(verificar_token)):
-    pedidos = await db.pedidos.find(FILTRO_ATIVO).to_list(length=500)
-    return [serialize(p) for p in pedidos]
+async def listar_pedidos(
+    request: Request,
+    cursor: Optional[str] = None,
+    limite: Optional[int] = Query(None, ge=1, le=LIMITE_PAGINA_MAX),
+    fields: Optional[str] = None,
+    usuario=Depends(verificar_token),
+):
+    return await resposta_condicional(
+        request, ["pedidos"],
+        lambda: listar_paginado("pedidos", FILTRO_ATIVO, cursor=cursor, limite=limite, fields=fields),
+    )
 
 
 @app.get("/api/pedidos/{pedido_id}")
@@ -674,49 +1273,72 @@ async def buscar_pedido(pedido_id: str, usuario=Depends(verificar_token)):
     return serialize(pedido)
 
 
-@app.post("/api/pedidos", status_code=201)
-async def criar_pedido(pedido: PedidoSchema, usuario=Depends(verificar_token)):
-    doc = pedido.dict()
+async def novo_pedido(pedido: PedidoSchema, usuario: dict) -> dict:
+    doc = datas_para_bson(pedido.dict())
     if not doc.get("numero_oc"):
-        doc["numero_oc"] = gerar_numero_oc()
-    doc["criado_em"] = datetime.now(timezone.utc).isoformat()
+        doc["numero_oc"] = await gerar_numero_oc()
+    doc["criado_em"] = doc["atualizado_em"] = datetime.now(timezone.utc)
     doc["criado_por"] = usuario["email"]
-    result = await db.pedidos.insert_one(doc)
+    doc["deletado"] = False
+    return doc
+
+
+def pedido_atualizado(pedido: PedidoSchema, usuario: dict) -> dict:
+    doc = datas_para_bson(pedido.dict())
+    doc["atualizado_em"] = datetime.now(timezone.utc)
+    doc["atualizado_por"] = usuario["email"]
+    return doc
+
+
+async def auditar_pedido_criado(doc: dict, usuario: dict):
     await registrar_auditoria(
         acao="CREATE",
         colecao="pedidos",
-        documento_id=str(result.inserted_id),
+        documento_id=str(doc["_id"]),
         usuario_email=usuario["email"],
         usuario_role=usuario["role"],
         dados_depois={"numero_oc": doc["numero_oc"], "cliente_nome": doc["cliente_nome"], "valor_total": doc["valor_total"]},
         detalhes=f"Pedido {doc['numero_oc']} criado para {doc['cliente_nome']}",
     )
+
+
+@app.post("/api/pedidos", status_code=201)
+async def criar_pedido(pedido: PedidoSchema, usuario=Depends(verificar_token)):
+    doc = await novo_pedido(pedido, usuario)
+    result = await db.pedidos.insert_one(doc)
+    await registrar_escrita("pedidos")
+    await aplicar_rollup(adicionar=[contribuicao_pedido(doc)])
+    await publicar_evento("pedidos", "insert", str(result.inserted_id), doc)
+    await auditar_pedido_criado(doc, usuario)
     return {"id": str(result.inserted_id), "numero_oc": doc["numero_oc"], "message": "Pedido registrado!"}
 
 
 @app.put("/api/pedidos/{pedido_id}")
 async def atualizar_pedido(pedido_id: str, pedido: PedidoSchema, usuario=Depends(verificar_token)):
-    pedido_atual = await db.pedidos.find_one({"_id": to_object_id(pedido_id)})
-    if not pedido_atual:
-        raise HTTPException(status_code=404, detail="Pedido não encontrado")
-    if pedido_atual.get("status") == "NF_EMITIDA" and usuario.get("role") != "admin":
-        raise HTTPException(status_code=403, detail="Pedido com NF emitida não pode ser editado")
-
-    antes_serial = {k: str(v) if isinstance(v, ObjectId) else v for k, v in pedido_atual.items()}
-    doc = pedido.dict()
-    doc["atualizado_em"] = datetime.now(timezone.utc).isoformat()
-    doc["atualizado_por"] = usuario["email"]
-    await db.pedidos.update_one({"_id": to_object_id(pedido_id)}, {"$set": doc})
+    oid = to_object_id(pedido_id)
+    filtro = {"_id": oid}
+    if usuario.get("role") != "admin":
+        filtro["status"] = {"$ne": "NF_EMITIDA"}
 
-    await registrar_auditoria(
-        acao="UPDATE",
+    doc = pedido_atualizado(pedido, usuario)
+    pedido_atual = await atualizar_com_auditoria(
         colecao="pedidos",
+        filtro=filtro,
+        update={"$set": doc},
+        usuario=usuario,
         documento_id=pedido_id,
-        usuario_email=usuario["email"],
-        usuario_role=usuario["role"],
-        dados_antes={"status": antes_serial.get("status"), "valor_total": antes_serial.get("valor_total")},
+        campos_antes=["status", "valor_total"],
         dados_depois={"status": doc["status"], "valor_total": doc["valor_total"]},
-        detalhes=f"Pedido {pedido_atual.get('numero_oc', '')} atualizado",
+        detalhes=lambda antes: f"Pedido {antes.get('numero_oc', '')} atualizado",
+    )
+    if pedido_atual is None:
+        if await db.pedidos.find_one({"_id": oid}, {"_id": 1}):
+            raise HTTPException(status_code=403, detail="Pedido com NF emitida não pode ser editado")
+        raise HTTPException(status_code=404, detail="Pedido não encontrado")
+
+    await aplicar_rollup(
+        remover=[contribuicao_pedido(pedido_atual)],
+        adicionar=[contribuicao_pedido({**pedido_atual, **doc})],
     )
     return {"message": "Pedido atualizado com sucesso!"}
 
@@ -736,81 +1358,83 @@ async def deletar_pedido(pedido_id: str, motivo: str = "", admin=Depends(apenas_
 # 14. Dashboard
 # ============================================================
 
-@app.get("/api/dashboard/stats")
-async def get_dashboard_stats(usuario=Depends(verificar_token)):
-    now = datetime.now(timezone.utc)
-    inicio_mes = now.replace(day=1).strftime("%Y-%m-%d")
-    fim_mes = now.strftime("%Y-%m-%d")
-
-    todos_pedidos = await db.pedidos.find(FILTRO_ATIVO).to_list(length=1000)
-
-    inicio_mes_iso = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0).isoformat()
-    pedidos_mes = [p for p in todos_pedidos if p.get("criado_em", "") >= inicio_mes_iso]
+# A versão de rollup_mensal só avança na reconstrução — no dia a dia ele muda junto com pedidos/NFs
+COLECOES_DASHBOARD = ["pedidos", "notas_fiscais", "clientes", "materiais", "rollup_mensal"]
 
-    total_clientes = await db.clientes.count_documents(FILTRO_ATIVO)
-    total_materiais = await db.materiais.count_documents(FILTRO_ATIVO)
 
-    pedidos_por_status = {}
-    for p in todos_pedidos:
-        s = p.get("status", "PENDENTE")
-        pedidos_por_status[s] = pedidos_por_status.get(s, 0) + 1
-
-    pedidos_entrega_mes = [
-        p for p in todos_pedidos
-        if p.get("data_entrega", "")[:7] == now.strftime("%Y-%m")
-        and p.get("status") not in ("CANCELADO", "NF_EMITIDA")
-    ]
-
-    comissao_prevista = round(sum(
-        item.get("comissao_valor", 0)
-        for p in pedidos_entrega_mes for item in p.get("itens", [])
-    ), 2)
-
-    tonelagem_implantada = sum(
-        p.get("peso_total", 0) for p in pedidos_entrega_mes
-    ) / 1000
+@app.get("/api/dashboard/stats")
+async def get_dashboard_stats(request: Request, usuario=Depends(verificar_token)):
+    # Os números dependem do mês corrente: o dia também entra no ETag
+    hoje = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    return await resposta_condicional(request, COLECOES_DASHBOARD, calcular_dashboard, extra=hoje)
 
-    notas_mes = await db.notas_fiscais.find({
-        "data_emissao": {"$gte": inicio_mes, "$lte": fim_mes}
-    }).to_list(length=1000)
 
-    pedidos_ids_faturados_mes = {str(n.get("pedido_id", "")) for n in notas_mes if n.get("pedido_id")}
-
-    tonelagem_faturada = 0.0
-    faturado_mes_valor = 0.0
-    comissao_realizada = 0.0
-
-    for p in todos_pedidos:
-        pid_obj = str(p.get("_id", ""))
-        pid_str = str(p.get("id", ""))
-        if pid_obj in pedidos_ids_faturados_mes or pid_str in pedidos_ids_faturados_mes:
-            tonelagem_faturada += p.get("peso_total", 0)
-            faturado_mes_valor += p.get("valor_total", 0)
-            for item in p.get("itens", []):
-                comissao_realizada += item.get("comissao_valor", 0)
-
-    if comissao_realizada == 0:
-        comissao_realizada = sum(n.get("comissao_total", 0) for n in notas_mes)
-
-    tonelagem_faturada = tonelagem_faturada / 1000
-    comissao_realizada = round(comissao_realizada, 2)
-    comissoes_a_receber = round(comissao_prevista - comissao_realizada, 2)
-    pedidos_mes_valor = sum(p.get("valor_total", 0) for p in pedidos_mes)
+async def calcular_dashboard() -> dict:
+    now = datetime.now(timezone.utc)
+    inicio_mes = mes_utc(now.year, now.month)
+    fim_mes = mes_utc(now.year, now.month + 1)
+
+    # Indicadores de pedidos: cada janela do mês é um $match próprio, atendido
+    # pelos índices de criado_em/data_entrega (dentro de um $facet não seria)
+    def somar(colecao: str, filtro: dict, **acumuladores) -> Awaitable[list]:
+        return db[colecao].aggregate([
+            {"$match": filtro},
+            {"$group": {"_id": None, **acumuladores}},
+        ]).to_list(length=1)
+
+    # Faturado no mês: direto do rollup_mensal — poucas linhas por (cliente, FE)
+    # em vez de varrer as NFs do mês e os pedidos de cada uma
+    por_status, mes, entrega, faturado, total_clientes, total_materiais = await asyncio.gather(
+        db.pedidos.aggregate([
+            {"$match": FILTRO_ATIVO},
+            {"$group": {"_id": {"$ifNull": ["$status", "PENDENTE"]}, "n": {"$sum": 1}}},
+        ]).to_list(length=None),
+        somar("pedidos", {**FILTRO_ATIVO, "criado_em": {"$gte": inicio_mes}}, n={"$sum": 1}, valor={"$sum": "$valor_total"}),
+        somar(
+            "pedidos",
+            {
+                **FILTRO_ATIVO,
+                "data_entrega": {"$gte": inicio_mes, "$lt": fim_mes},
+                "status": {"$nin": ["CANCELADO", "NF_EMITIDA"]},
+            },
+            peso={"$sum": "$peso_total"},
+            comissao={"$sum": {"$sum": "$itens.comissao_valor"}},
+        ),
+        somar(
+            "rollup_mensal",
+            {"ano": now.year, "mes": now.month},
+            peso={"$sum": "$faturado_peso"},
+            valor={"$sum": "$faturado_valor"},
+            comissao={"$sum": "$comissao_realizada"},
+        ),
+        db.clientes.count_documents(FILTRO_ATIVO),
+        db.materiais.count_documents(FILTRO_ATIVO),
+    )
+    mes = mes[0] if mes else {}
+    entrega = entrega[0] if entrega else {}
+    faturado = faturado[0] if faturado else {}
+
+    comissao_prevista = round(entrega.get("comissao", 0), 2)
+    tonelagem_implantada = entrega.get("peso", 0) / 1000
+    tonelagem_faturada = faturado.get("peso", 0) / 1000
+    faturado_mes_valor = faturado.get("valor", 0)
+    comissao_realizada = round(faturado.get("comissao", 0), 2)
+    comissoes_a_receber = round(comissao_prevista - comissao_realizada, 2)
 
     return {
         "tonelagem_implantada": round(tonelagem_implantada, 3),
         "comissao_prevista": comissao_prevista,
         "tonelagem_faturada": round(tonelagem_faturada, 3),
         "comissao_realizada": comissao_realizada,
-        "pedidos_mes_valor": round(pedidos_mes_valor, 2),
+        "pedidos_mes_valor": round(mes.get("valor", 0), 2),
         "faturado_mes_valor": round(faturado_mes_valor, 2),
         "comissao_mes": comissao_realizada,
         "comissoes_a_receber": comissoes_a_receber,
         "total_clientes": total_clientes,
         "total_materiais": total_materiais,
-        "total_pedidos": len(todos_pedidos),
-        "pedidos_mes": len(pedidos_mes),
-        "pedidos_por_status": pedidos_por_status,
+        "total_pedidos": sum(s["n"] for s in por_status),
+        "pedidos_mes": mes.get("n", 0),
+        "pedidos_por_status": {s["_id"]: s["n"] for s in por_status},
     }
 
 
@@ -826,24 +1450,144 @@ class MetaSchema(BaseModel):
 
 
 @app.get("/api/metas")
-async def listar_metas(usuario=Depends(verificar_token)):
-    metas = await db.metas.find().to_list(length=1000)
-    return [serialize(m) for m in metas]
+async def listar_metas(
+    request: Request,
+    cursor: Optional[str] = None,
+    limite: Optional[int] = Query(None, ge=1, le=LIMITE_PAGINA_MAX),
+    fields: Optional[str] = None,
+    usuario=Depends(verificar_token),
+):
+    return await resposta_condicional(
+        request, ["metas"],
+        lambda: listar_paginado("metas", {}, cursor=cursor, limite=limite, fields=fields),
+    )
+
+
+@app.get("/api/metas/progresso")
+async def progresso_metas(
+    request: Request,
+    ano: Optional[int] = Query(None, ge=2000, le=2100),
+    mes: Optional[int] = Query(None, ge=1, le=12),
+    usuario=Depends(verificar_token),
+):
+    """Meta × tonelagem faturada no mês, por cliente, com os totais da página de Metas."""
+    hoje = datetime.now(timezone.utc)
+    ano = ano or hoje.year
+    mes = mes or hoje.month
+    return await resposta_condicional(
+        request, COLECOES_PROGRESSO_METAS, lambda: calcular_progresso_metas(ano, mes), extra=f"{ano}-{mes:02d}"
+    )
+
+
+COLECOES_PROGRESSO_METAS = ["metas", "clientes", "notas_fiscais", "pedidos"]
+
+
+async def calcular_progresso_metas(ano: int, mes: int) -> dict:
+    emitidas = filtro_emissao(mes_utc(ano, mes), mes_utc(ano, mes + 1))
+
+    peso_pedido = {"$first": {"$map": {
+        "input": {"$filter": {"input": "$_pedidos", "as": "p", "cond": {"$eq": ["$$p._id", "$$n.pedido"]}}},
+        "as": "p",
+        "in": "$$p.peso_total",
+    }}}
+    pipeline = [
+        {"$match": FILTRO_ATIVO},
+        {"$project": {"nome": 1, "cliente_id": {"$toString": "$_id"}}},
+        {"$lookup": {
+            "from": "metas",
+            "localField": "cliente_id",
+            "foreignField": "cliente_id",
+            "pipeline": [{"$match": {"ano": ano, "mes": str(mes)}}, {"$project": {"valor_ton": 1}}],
+            "as": "_metas",
+        }},
+        # NFs do mês pelo índice (cliente_id, data_emissao)
+        {"$lookup": {
+            "from": "notas_fiscais",
+            "localField": "cliente_id",
+            "foreignField": "cliente_id",
+            "pipeline": [{"$match": emitidas}, {"$project": {"peso_total": 1, "pedido_id": 1}}],
+            "as": "_notas",
+        }},
+        # NFs antigas sem cliente_id casam pelo nome, como fazia o frontend
+        {"$lookup": {
+            "from": "notas_fiscais",
+            "let": {"nome": {"$toLower": {"$ifNull": ["$nome", ""]}}},
+            "pipeline": [
+                {"$match": {"cliente_id": {"$in": ["", None]}, **emitidas}},
+                {"$match": {"$expr": {"$and": [
+                    {"$ne": ["$$nome", ""]},
+                    {"$eq": [{"$toLower": {"$ifNull": ["$cliente_nome", ""]}}, "$$nome"]},
+                ]}}},
+                {"$project": {"peso_total": 1, "pedido_id": 1}},
+            ],
+            "as": "_notas_nome",
+        }},
+        {"$set": {"_notas": {"$map": {
+            "input": {"$concatArrays": ["$_notas", "$_notas_nome"]},
+            "as": "n",
+            "in": {
+                "peso_total": "$$n.peso_total",
+                "pedido": {"$convert": {"input": "$$n.pedido_id", "to": "objectId", "onError": None, "onNull": None}},
+            },
+        }}}},
+        # NFs antigas não guardam o peso — vale o do pedido de origem
+        {"$lookup": {
+            "from": "pedidos",
+            "localField": "_notas.pedido",
+            "foreignField": "_id",
+            "pipeline": [{"$project": {"peso_total": 1}}],
+            "as": "_pedidos",
+        }},
+        {"$project": {
+            "_id": 0,
+            "cliente_id": 1,
+            "nome": 1,
+            "meta_id": {"$toString": {"$first": "$_metas._id"}},
+            "meta": {"$ifNull": [{"$first": "$_metas.valor_ton"}, 0]},
+            "realizado": {"$divide": [
+                {"$sum": {"$map": {
+                    "input": "$_notas",
+                    "as": "n",
+                    "in": {"$ifNull": ["$$n.peso_total", {"$ifNull": [peso_pedido, 0]}]},
+                }}},
+                1000,
+            ]},
+        }},
+        {"$set": {"pct": {"$cond": [
+            {"$gt": ["$meta", 0]}, {"$multiply": [{"$divide": ["$realizado", "$meta"]}, 100]}, 0,
+        ]}}},
+        {"$sort": {"nome": 1}},
+    ]
+
+    clientes = await db.clientes.aggregate(pipeline).to_list(length=None)
+    total_meta = sum(c["meta"] for c in clientes)
+    # Clientes sem meta que faturaram também contam no realizado global
+    total_realizado = sum(c["realizado"] for c in clientes)
+    return {
+        "ano": ano,
+        "mes": mes,
+        "total_meta": total_meta,
+        "total_realizado": total_realizado,
+        "pct": total_realizado / total_meta * 100 if total_meta else 0,
+        "clientes_com_meta": sum(1 for c in clientes if c["meta"] > 0),
+        "clientes": clientes,
+    }
 
 
 @app.post("/api/metas", status_code=201)
 async def criar_meta(meta: MetaSchema, usuario=Depends(apenas_admin)):
-    existente = await db.metas.find_one({"cliente_id": meta.cliente_id, "mes": meta.mes, "ano": meta.ano})
+    agora = datetime.now(timezone.utc)
+    existente = await atualizar_retornando_anterior(
+        "metas",
+        {"cliente_id": meta.cliente_id, "mes": meta.mes, "ano": meta.ano},
+        {
+            "$set": {"valor_ton": meta.valor_ton, "atualizado_em": agora},
+            "$setOnInsert": {"criado_em": agora, "criado_por": usuario["email"]},
+        },
+        upsert=True,
+    )
     if existente:
-        await db.metas.update_one(
-            {"_id": existente["_id"]},
-            {"$set": {"valor_ton": meta.valor_ton, "atualizado_em": datetime.now(timezone.utc).isoformat()}}
-        )
         return {"message": "Meta atualizada!"}
-    doc = meta.dict()
-    doc["criado_em"] = datetime.now(timezone.utc).isoformat()
-    doc["criado_por"] = usuario["email"]
-    await db.metas.insert_one(doc)
     return {"message": "Meta cadastrada!"}
 
 
@@ -851,8 +1595,9 @@ async def criar_meta(meta: MetaSchema, usuario=Depends(apenas_admin)):
 async def atualizar_meta(meta_id: str, meta: MetaSchema, usuario=Depends(apenas_admin)):
     result = await db.metas.update_one(
         {"_id": to_object_id(meta_id)},
-        {"$set": {**meta.dict(), "atualizado_em": datetime.now(timezone.utc).isoformat()}}
+        {"$set": {**meta.dict(), "atualizado_em": datetime.now(timezone.utc)}}
     )
+    await registrar_escrita("metas")
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Meta não encontrada")
     return {"message": "Meta atualizada!"}
@@ -863,6 +1608,8 @@ async def deletar_meta(meta_id: str, usuario=Depends(apenas_admin)):
     result = await db.metas.delete_one({"_id": to_object_id(meta_id)})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Meta não encontrada")
+    await registrar_escrita("metas")
+    await registrar_remocao_sync("metas", meta_id)
     return {"message": "Meta removida!"}
 
 
@@ -890,42 +1637,54 @@ async def api_health():
 
 class NotaFiscalSchema(BaseModel):
     numero_nf: str
-    data_emissao: Optional[str] = None
+    data_emissao: DataOpcional = None
     pedido_id: str
     valor_total: float
     numero_parcelas: int = 1
-    datas_manuais: List[str] = []
+    datas_manuais: List[DataOpcional] = []
     qtde_entregue: Optional[int] = None
     motivo_entrega: Optional[str] = None
 
 
 class VencimentoUpdateSchema(BaseModel):
     status: Optional[str] = None
-    data_pagamento: Optional[str] = None
+    data_pagamento: DataOpcional = None
 
 
 @app.get("/api/notas-fiscais")
-async def listar_notas(usuario=Depends(verificar_token)):
-    notas = await db.notas_fiscais.find().sort("criado_em", -1).to_list(length=1000)
-    return [serialize(n) for n in notas]
+async def listar_notas(
+    request: Request,
+    cursor: Optional[str] = None,
+    limite: Optional[int] = Query(None, ge=1, le=LIMITE_PAGINA_MAX),
+    fields: Optional[str] = None,
+    usuario=Depends(verificar_token),
+):
+    # _id decrescente equivale a criado_em decrescente e já tem índice
+    return await resposta_condicional(
+        request, ["notas_fiscais"],
+        lambda: listar_paginado("notas_fiscais", {}, cursor=cursor, limite=limite, fields=fields, direcao=-1),
+    )
 
 
-@app.post("/api/notas-fiscais", status_code=201)
-async def criar_nota(nota: NotaFiscalSchema, usuario=Depends(apenas_admin)):
-    try:
-        pedido = await db.pedidos.find_one({"_id": to_object_id(nota.pedido_id)})
-    except Exception:
-        raise HTTPException(status_code=404, detail="Pedido não encontrado")
-    if not pedido:
-        raise HTTPException(status_code=404, detail="Pedido não encontrado")
+LOTE_NF_MAX = 500
 
-    comissao_percent = 0.0
-    numero_fe = pedido.get("numero_fe", "")
-    if numero_fe:
-        material = await db.materiais.find_one({"numero_fe": numero_fe})
-        if material:
-            comissao_percent = float(material.get("comissao", 0) or 0)
 
+class NotaFiscalLoteSchema(BaseModel):
+    notas: List[NotaFiscalSchema] = Field(..., min_length=1, max_length=LOTE_NF_MAX)
+
+
+async def comissoes_por_fe(numeros_fe) -> dict:
+    """% de comissão cadastrado em cada material, numa única consulta."""
+    numeros_fe = [fe for fe in set(numeros_fe) if fe]
+    if not numeros_fe:
+        return {}
+    materiais = db.materiais.find({"numero_fe": {"$in": numeros_fe}}, {"numero_fe": 1, "comissao": 1})
+    return {m["numero_fe"]: float(m.get("comissao", 0) or 0) async for m in materiais}
+
+
+def montar_emissao_nf(nota: NotaFiscalSchema, pedido: dict, comissao_material: float, usuario: dict) -> tuple:
+    """Monta o documento da NF e as parcelas de vencimento, ainda sem gravar nada."""
+    comissao_percent = comissao_material
     if comissao_percent <= 0:
         itens = pedido.get("itens", [])
         if itens:
@@ -934,10 +1693,13 @@ async def criar_nota(nota: NotaFiscalSchema, usuario=Depends(apenas_admin)):
     comissao_total = nota.valor_total * comissao_percent / 100
     comissao_por_parcela = round(comissao_total / nota.numero_parcelas, 2)
 
-    now = datetime.now(timezone.utc).isoformat()
+    now = datetime.now(timezone.utc)
+    nota_oid = ObjectId()
+    nota_id = str(nota_oid)
     nota_doc = {
+        "_id": nota_oid,
         "numero_nf": nota.numero_nf,
-        "data_emissao": nota.data_emissao,
+        "data_emissao": para_data(nota.data_emissao),
         "pedido_id": nota.pedido_id,
         "cliente_nome": pedido.get("cliente_nome", ""),
         "cliente_id": pedido.get("cliente_id", ""),
@@ -945,6 +1707,7 @@ async def criar_nota(nota: NotaFiscalSchema, usuario=Depends(apenas_admin)):
         "numero_fe": pedido.get("numero_fe", ""),
         "numero_fabrica": pedido.get("numero_fabrica", ""),
         "valor_total": nota.valor_total,
+        "peso_total": pedido.get("peso_total", 0),
         "comissao_percent": comissao_percent,
         "comissao_total": comissao_total,
         "numero_parcelas": nota.numero_parcelas,
@@ -953,39 +1716,89 @@ async def criar_nota(nota: NotaFiscalSchema, usuario=Depends(apenas_admin)):
         "criado_em": now,
         "criado_por": usuario["email"],
     }
-    result = await db.notas_fiscais.insert_one(nota_doc)
-    nota_id = str(result.inserted_id)
 
+    vencimentos = []
     hoje = datetime.now(timezone.utc).date()
     for i in range(nota.numero_parcelas):
         if i < len(nota.datas_manuais) and nota.datas_manuais[i]:
-            data_venc_str = nota.datas_manuais[i]
-            data_venc = datetime.strptime(data_venc_str, "%Y-%m-%d").date()
+            data_venc = nota.datas_manuais[i]
         else:
             data_venc = hoje + timedelta(days=30 * (i + 1))
-            data_venc_str = data_venc.isoformat()
 
         status_venc = "Pago" if data_venc < hoje else "Pendente"
-        venc_doc = {
+        prazo_pagamento = calcular_prazo_pagamento(data_venc)
+        vencimentos.append({
             "nota_fiscal_id": nota_id,
             "pedido_id": nota.pedido_id,
             "cliente_nome": pedido.get("cliente_nome", ""),
             "numero_nf": nota.numero_nf,
             "parcela": i + 1,
             "total_parcelas": nota.numero_parcelas,
-            "data_vencimento": data_venc_str,
+            "data_vencimento": para_data(data_venc),
+            "prazo_pagamento": para_data(prazo_pagamento),
             "comissao_calculada": comissao_por_parcela,
             "valor_parcela": round(nota.valor_total / nota.numero_parcelas, 2),
             "status": status_venc,
             "data_pagamento": None,
             "criado_em": now,
-        }
-        await db.vencimentos.insert_one(venc_doc)
+        })
+    return nota_doc, vencimentos
 
-    await db.pedidos.update_one(
-        {"_id": to_object_id(nota.pedido_id)},
-        {"$set": {"status": "NF_EMITIDA", "nota_fiscal_id": nota_id}}
-    )
+
+async def gravar_emissoes(emissoes: List[tuple]):
+    """
+    Grava NFs, parcelas, status dos pedidos e rollup numa única transação:
+    um insert_many por coleção em vez de um insert por parcela.
+    """
+    notas = [nota_doc for nota_doc, _ in emissoes]
+    vencimentos = [v for _, parcelas in emissoes for v in parcelas]
+    agora = datetime.now(timezone.utc)
+    pedidos_ops = [
+        UpdateOne(
+            {"_id": ObjectId(nota_doc["pedido_id"])},
+            {"$set": {"status": "NF_EMITIDA", "nota_fiscal_id": str(nota_doc["_id"]), "atualizado_em": agora}},
+        )
+        for nota_doc in notas
+    ]
+
+    async def transacao(session):
+        await db.notas_fiscais.insert_many(notas, session=session)
+        if vencimentos:
+            await db.vencimentos.insert_many(vencimentos, session=session)
+        await db.pedidos.bulk_write(pedidos_ops, session=session)
+        await aplicar_rollup(adicionar=await contribuicoes_notas(notas), session=session)
+
+    async with await client.start_session() as session:
+        try:
+            await session.with_transaction(transacao)
+        except OperationFailure as e:
+            # mongod local sem replica set não aceita transações (IllegalOperation)
+            if e.code != 20:
+                raise
+            logger.warning("⚠️ MongoDB sem suporte a transações — gravando emissão sem atomicidade")
+            await transacao(None)
+
+    await registrar_escrita("notas_fiscais", "vencimentos", "pedidos")
+    for nota_doc in notas:
+        await publicar_evento("notas_fiscais", "insert", str(nota_doc["_id"]), nota_doc)
+        await publicar_evento("pedidos", "update", nota_doc["pedido_id"])
+    if vencimentos:
+        await publicar_evento("vencimentos", "insert")
+
+
+@app.post("/api/notas-fiscais", status_code=201)
+async def criar_nota(nota: NotaFiscalSchema, usuario=Depends(apenas_admin)):
+    try:
+        pedido = await db.pedidos.find_one({"_id": to_object_id(nota.pedido_id)})
+    except Exception:
+        raise HTTPException(status_code=404, detail="Pedido não encontrado")
+    if not pedido:
+        raise HTTPException(status_code=404, detail="Pedido não encontrado")
+
+    comissoes = await comissoes_por_fe([pedido.get("numero_fe", "")])
+    nota_doc, vencimentos = montar_emissao_nf(nota, pedido, comissoes.get(pedido.get("numero_fe", ""), 0.0), usuario)
+    await gravar_emissoes([(nota_doc, vencimentos)])
+    nota_id = str(nota_doc["_id"])
 
     await registrar_auditoria(
         acao="CREATE",
@@ -1000,40 +1813,80 @@ async def criar_nota(nota: NotaFiscalSchema, usuario=Depends(apenas_admin)):
     return {"message": "NF criada e vencimentos gerados!", "nota_id": nota_id, "vencimentos_gerados": nota.numero_parcelas}
 
 
+@app.post("/api/notas-fiscais/batch", status_code=201)
+async def criar_notas_lote(lote: NotaFiscalLoteSchema, usuario=Depends(apenas_admin)):
+    """Emite várias NFs de uma vez (faturamento de fim de mês). Tudo ou nada."""
+    oids = {n.pedido_id: ObjectId(n.pedido_id) for n in lote.notas if ObjectId.is_valid(n.pedido_id)}
+    pedidos = {
+        str(p["_id"]): p
+        async for p in db.pedidos.find({"_id": {"$in": list(oids.values())}})
+    }
+    faltando = sorted({n.pedido_id for n in lote.notas if n.pedido_id not in pedidos})
+    if faltando:
+        raise HTTPException(status_code=404, detail=f"Pedidos não encontrados: {', '.join(faltando)}")
+
+    comissoes = await comissoes_por_fe(p.get("numero_fe", "") for p in pedidos.values())
+    emissoes = []
+    for n in lote.notas:
+        pedido = pedidos[n.pedido_id]
+        emissoes.append(montar_emissao_nf(n, pedido, comissoes.get(pedido.get("numero_fe", ""), 0.0), usuario))
+    await gravar_emissoes(emissoes)
+
+    resultado = []
+    for nota_doc, vencimentos in emissoes:
+        nota_id = str(nota_doc["_id"])
+        await registrar_auditoria(
+            acao="CREATE",
+            colecao="notas_fiscais",
+            documento_id=nota_id,
+            usuario_email=usuario["email"],
+            usuario_role=usuario["role"],
+            dados_depois={"numero_nf": nota_doc["numero_nf"], "valor_total": nota_doc["valor_total"], "parcelas": len(vencimentos)},
+            detalhes=f"NF {nota_doc['numero_nf']} emitida em lote — {len(vencimentos)} parcela(s)",
+        )
+        resultado.append({"numero_nf": nota_doc["numero_nf"], "nota_id": nota_id, "vencimentos_gerados": len(vencimentos)})
+
+    return {"message": f"{len(resultado)} NFs emitidas!", "notas": resultado}
+
+
 class NotaFiscalUpdateSchema(BaseModel):
-    data_emissao: Optional[str] = None
+    data_emissao: DataOpcional = None
     numero_nf: Optional[str] = None
 
 
 @app.put("/api/notas-fiscais/{nota_id}")
 async def atualizar_nota(nota_id: str, data: NotaFiscalUpdateSchema, usuario=Depends(apenas_admin)):
-    campos = {k: v for k, v in data.dict().items() if v is not None}
+    campos = datas_para_bson({k: v for k, v in data.dict().items() if v is not None})
     if not campos:
         raise HTTPException(status_code=400, detail="Nenhum campo para atualizar")
-    result = await db.notas_fiscais.update_one(
-        {"_id": to_object_id(nota_id)},
-        {"$set": {**campos, "atualizado_em": datetime.now(timezone.utc).isoformat()}}
-    )
-    if result.matched_count == 0:
-        raise HTTPException(status_code=404, detail="NF não encontrada")
-    await registrar_auditoria(
-        acao="UPDATE",
+    antes = await atualizar_com_auditoria(
         colecao="notas_fiscais",
+        filtro={"_id": to_object_id(nota_id)},
+        update={"$set": {**campos, "atualizado_em": datetime.now(timezone.utc)}},
+        usuario=usuario,
         documento_id=nota_id,
-        usuario_email=usuario["email"],
-        usuario_role=usuario["role"],
+        campos_antes=list(campos),
         dados_depois=campos,
         detalhes="NF atualizada",
     )
+    if antes is None:
+        raise HTTPException(status_code=404, detail="NF não encontrada")
+    if "data_emissao" in campos:
+        remover, adicionar = await contribuicoes_notas([antes, {**antes, **campos}])
+        await aplicar_rollup(remover=[remover], adicionar=[adicionar])
     return {"message": "NF atualizada!"}
 
 
 @app.delete("/api/notas-fiscais/{nota_id}")
 async def deletar_nota(nota_id: str, usuario=Depends(apenas_admin)):
-    await db.vencimentos.delete_many({"nota_fiscal_id": nota_id})
-    result = await db.notas_fiscais.delete_one({"_id": to_object_id(nota_id)})
-    if result.deleted_count == 0:
+    nota = await db.notas_fiscais.find_one_and_delete({"_id": to_object_id(nota_id)})
+    if not nota:
         raise HTTPException(status_code=404, detail="NF não encontrada")
+    await db.vencimentos.delete_many({"nota_fiscal_id": nota_id})
+    await registrar_escrita("notas_fiscais", "vencimentos")
+    await aplicar_rollup(remover=await contribuicoes_notas([nota]))
+    await publicar_evento("notas_fiscais", "delete", nota_id)
+    await publicar_evento("vencimentos", "delete")
     await registrar_auditoria(
         acao="DELETE",
         colecao="notas_fiscais",
@@ -1045,36 +1898,74 @@ async def deletar_nota(nota_id: str, usuario=Depends(apenas_admin)):
     return {"message": "NF e vencimentos removidos!"}
 
 
-@app.get("/api/vencimentos")
-async def listar_vencimentos(usuario=Depends(verificar_token)):
-    import calendar
-    hoje = datetime.now(timezone.utc).date()
+def calcular_prazo_pagamento(data_venc: date) -> date:
+    """A comissão vence no último dia do mês seguinte ao vencimento da parcela."""
+    ano, mes = (data_venc.year + 1, 1) if data_venc.month == 12 else (data_venc.year, data_venc.month + 1)
+    return date(ano, mes, calendar.monthrange(ano, mes)[1])
 
-    vencimentos = await db.vencimentos.find({"status": {"$ne": "Pago"}}).to_list(length=1000)
-    for v in vencimentos:
-        data_venc_str = v.get("data_vencimento")
-        if not data_venc_str:
+
+async def atualizar_status_vencimentos() -> dict:
+    """
+    Marca Pendente → Atrasado (e o inverso, se o prazo foi corrigido) com dois update_many
+    sobre o índice (status, prazo_pagamento). Vencimentos antigos sem prazo são preenchidos antes.
+    """
+    legados = []
+    async for v in db.vencimentos.find(
+        {"prazo_pagamento": {"$exists": False}, "data_vencimento": {"$nin": [None, ""]}},
+        {"data_vencimento": 1},
+    ):
+        try:
+            data_venc = para_data(v["data_vencimento"])
+        except (AttributeError, ValueError):
             continue
+        legados.append(UpdateOne(
+            {"_id": v["_id"]},
+            {"$set": {"prazo_pagamento": para_data(calcular_prazo_pagamento(data_venc))}},
+        ))
+        if len(legados) >= 1000:
+            await db.vencimentos.bulk_write(legados, ordered=False)
+            legados = []
+    if legados:
+        await db.vencimentos.bulk_write(legados, ordered=False)
+        await registrar_escrita("vencimentos")
+
+    hoje = para_data(datetime.now(timezone.utc))
+    atrasados = await db.vencimentos.update_many(
+        {"status": "Pendente", "prazo_pagamento": {"$lt": hoje}},
+        {"$set": {"status": "Atrasado"}},
+    )
+    em_dia = await db.vencimentos.update_many(
+        {"status": "Atrasado", "prazo_pagamento": {"$gte": hoje}},
+        {"$set": {"status": "Pendente"}},
+    )
+    if atrasados.modified_count or em_dia.modified_count:
+        await registrar_escrita("vencimentos")
+        await publicar_evento("vencimentos", "update")
+        logger.info(f"⏰ Vencimentos: {atrasados.modified_count} atrasados, {em_dia.modified_count} voltaram a pendente")
+    return {"atrasados": atrasados.modified_count, "pendentes": em_dia.modified_count}
+
+
+async def agendador_vencimentos():
+    """Roda na inicialização e depois a cada INTERVALO_STATUS_VENCIMENTOS segundos."""
+    while True:
         try:
-            data_venc = datetime.strptime(data_venc_str, "%Y-%m-%d").date()
-            mes_pagamento = data_venc.month + 1
-            ano_pagamento = data_venc.year
-            if mes_pagamento > 12:
-                mes_pagamento = 1
-                ano_pagamento += 1
-            ultimo_dia = calendar.monthrange(ano_pagamento, mes_pagamento)[1]
-            prazo_pagamento = datetime(ano_pagamento, mes_pagamento, ultimo_dia).date()
-            novo_status = "Atrasado" if hoje > prazo_pagamento else "Pendente"
-            if v.get("status") != novo_status:
-                await db.vencimentos.update_one(
-                    {"_id": v["_id"]},
-                    {"$set": {"status": novo_status}}
-                )
+            await atualizar_status_vencimentos()
         except Exception:
-            continue
+            logger.exception("Falha ao atualizar status dos vencimentos")
+        await asyncio.sleep(INTERVALO_STATUS_VENCIMENTOS)
+
 
-    vencimentos = await db.vencimentos.find().sort("data_vencimento", 1).to_list(length=1000)
-    return [serialize(v) for v in vencimentos]
+@app.get("/api/vencimentos")
+async def listar_vencimentos(
+    request: Request,
+    cursor: Optional[str] = None,
+    limite: Optional[int] = Query(None, ge=1, le=LIMITE_PAGINA_MAX),
+    fields: Optional[str] = None,
+    usuario=Depends(verificar_token),
+):
+    return await resposta_condicional(request, ["vencimentos"], lambda: listar_paginado(
+        "vencimentos", {}, cursor=cursor, limite=limite, fields=fields, campo_ordem="data_vencimento"
+    ))
 
 
 @app.post("/api/admin/reset-vencimentos-pago")
@@ -1083,6 +1974,9 @@ async def reset_vencimentos_pago(admin=Depends(apenas_admin)):
         {"status": "Pago", "data_pagamento": None},
         {"$set": {"status": "Pendente"}}
     )
+    await registrar_escrita("vencimentos")
+    await atualizar_status_vencimentos()
+    await publicar_evento("vencimentos", "update")
     await registrar_auditoria(
         acao="UPDATE",
         colecao="vencimentos",
@@ -1095,13 +1989,14 @@ async def reset_vencimentos_pago(admin=Depends(apenas_admin)):
 
 
 async def atualizar_vencimento(venc_id: str, data: VencimentoUpdateSchema, usuario=Depends(apenas_admin)):
-    update = {k: v for k, v in data.dict().items() if v is not None}
+    update = datas_para_bson({k: v for k, v in data.dict().items() if v is not None})
     if not update:
         raise HTTPException(status_code=400, detail="Nenhum campo para atualizar")
     result = await db.vencimentos.update_one(
         {"_id": to_object_id(venc_id)},
         {"$set": update}
     )
+    await registrar_escrita("vencimentos")
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Vencimento não encontrado")
     return {"message": "Vencimento atualizado!"}
@@ -1111,99 +2006,133 @@ async def atualizar_vencimento(venc_id: str, data: VencimentoUpdateSchema, usuar
 # 18. Exportação Excel — Comissões
 # ============================================================
 
-@app.get("/api/export/comissoes")
-async def exportar_comissoes(usuario=Depends(apenas_admin)):
-    vencimentos = await db.vencimentos.find().sort("data_vencimento", 1).to_list(length=5000)
-    notas = await db.notas_fiscais.find().to_list(length=5000)
-    notas_map = {str(n["_id"]): n for n in notas}
-
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = "Comissões"
-
-    header_fill = PatternFill("solid", fgColor="0A3D73")
-    header_font = Font(bold=True, color="FFFFFF", size=9)
-    header_align = Alignment(horizontal="center", vertical="center")
-    pago_fill = PatternFill("solid", fgColor="D1FAE5")
-    atraso_fill = PatternFill("solid", fgColor="FEE2E2")
-    border = Border(
-        left=Side(style="thin", color="CCCCCC"),
-        right=Side(style="thin", color="CCCCCC"),
-        top=Side(style="thin", color="CCCCCC"),
-        bottom=Side(style="thin", color="CCCCCC"),
-    )
+def _moeda(doc: dict, campo: str) -> float:
+    return doc.get(campo) or 0
+
+
+def _data(doc: dict, campo: str) -> str:
+    valor = doc.get(campo)
+    return valor.strftime("%Y-%m-%d") if isinstance(valor, datetime) else valor or ""
 
-    headers = ["NF", "Cliente", "Parcela", "Total Parcelas", "Vencimento", "Valor Parcela (R$)", "Comissão (R$)", "Status", "Data Pagamento"]
-    ws.append(headers)
-    for col, _ in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col)
-        cell.fill = header_fill
-        cell.font = header_font
-        cell.alignment = header_align
-        cell.border = border
-
-    for v in vencimentos:
-        nota = notas_map.get(str(v.get("nota_fiscal_id", "")), {})
-        status_v = v.get("status", "Pendente")
-        row = [
-            v.get("numero_nf") or nota.get("numero_nf", ""),
-            v.get("cliente_nome") or nota.get("cliente_nome", ""),
-            v.get("parcela", ""),
-            v.get("total_parcelas", ""),
-            v.get("data_vencimento", ""),
-            v.get("valor_parcela", 0),
-            v.get("comissao_calculada", 0),
-            status_v,
-            v.get("data_pagamento") or "",
-        ]
-        ws.append(row)
-        row_idx = ws.max_row
-        fill = pago_fill if status_v == "Pago" else (atraso_fill if status_v == "Atrasado" else None)
-        for col in range(1, len(headers) + 1):
-            cell = ws.cell(row=row_idx, column=col)
-            cell.border = border
-            cell.font = Font(size=9)
-            cell.alignment = Alignment(vertical="center")
-            if fill:
-                cell.fill = fill
-            if col in [6, 7]:
-                cell.number_format = 'R$ #,##0.00'
-
-    col_widths = [12, 30, 9, 14, 14, 20, 16, 12, 16]
-    for i, w in enumerate(col_widths, 1):
-        ws.column_dimensions[openpyxl.utils.get_column_letter(i)].width = w
-    ws.row_dimensions[1].height = 20
-
-    ws.append([])
-    ws.append(["", "", "", "", "TOTAL PAGO", "", sum(v.get("comissao_calculada", 0) for v in vencimentos if v.get("status") == "Pago")])
-    ws.append(["", "", "", "", "TOTAL PENDENTE", "", sum(v.get("comissao_calculada", 0) for v in vencimentos if v.get("status") == "Pendente")])
-    ws.append(["", "", "", "", "TOTAL ATRASADO", "", sum(v.get("comissao_calculada", 0) for v in vencimentos if v.get("status") == "Atrasado")])
-
-    for r in [ws.max_row - 2, ws.max_row - 1, ws.max_row]:
-        ws.cell(row=r, column=5).font = Font(bold=True, size=9)
-        ws.cell(row=r, column=7).font = Font(bold=True, size=9)
-        ws.cell(row=r, column=7).number_format = 'R$ #,##0.00'
-
-    output = io.BytesIO()
-    wb.save(output)
-    output.seek(0)
 
+async def _auditar_exportacao(usuario: dict, colecao: str, rotulo: str):
     await registrar_auditoria(
         acao="EXPORT",
-        colecao="vencimentos",
+        colecao=colecao,
         documento_id="export",
         usuario_email=usuario["email"],
         usuario_role=usuario["role"],
-        detalhes=f"Exportação de comissões em {datetime.now().strftime('%d/%m/%Y %H:%M')}",
+        detalhes=f"Exportação de {rotulo} em {datetime.now().strftime('%d/%m/%Y %H:%M')}",
     )
 
-    nome_arquivo = f"comissoes_{datetime.now().strftime('%d-%m-%Y')}.xlsx"
-    return StreamingResponse(
-        output,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        headers={"Content-Disposition": f"attachment; filename={nome_arquivo}"}
+
+@app.get("/api/export/comissoes")
+async def exportar_comissoes(usuario=Depends(apenas_admin)):
+    # Número da NF e cliente vêm da própria parcela; a NF só é consultada se faltarem
+    pipeline = [
+        {"$sort": {"data_vencimento": 1}},
+        {"$addFields": {"_nf": {"$convert": {"input": "$nota_fiscal_id", "to": "objectId", "onError": None, "onNull": None}}}},
+        {"$lookup": {
+            "from": "notas_fiscais",
+            "let": {"nf": "$_nf"},
+            "pipeline": [{"$match": {"$expr": {"$eq": ["$_id", "$$nf"]}}}, {"$project": {"numero_nf": 1, "cliente_nome": 1}}],
+            "as": "_nota",
+        }},
+        {"$set": {"_nota": {"$ifNull": [{"$first": "$_nota"}, {}]}}},
+    ]
+    totais = {"Pago": 0.0, "Pendente": 0.0, "Atrasado": 0.0}
+
+    async def vencimentos():
+        async for v in db.vencimentos.aggregate(pipeline, batchSize=1000):
+            status_v = v.get("status", "Pendente")
+            if status_v in totais:
+                totais[status_v] += v.get("comissao_calculada", 0) or 0
+            yield v
+
+    colunas = [
+        Coluna("NF", 12, lambda v: v.get("numero_nf") or v["_nota"].get("numero_nf", "")),
+        Coluna("Cliente", 30, lambda v: v.get("cliente_nome") or v["_nota"].get("cliente_nome", "")),
+        Coluna("Parcela", 9, lambda v: v.get("parcela", "")),
+        Coluna("Total Parcelas", 14, lambda v: v.get("total_parcelas", "")),
+        Coluna("Vencimento", 14, lambda v: _data(v, "data_vencimento")),
+        Coluna("Valor Parcela (R$)", 20, lambda v: v.get("valor_parcela", 0), moeda=True),
+        Coluna("Comissão (R$)", 16, lambda v: v.get("comissao_calculada", 0), moeda=True),
+        Coluna("Status", 12, lambda v: v.get("status", "Pendente")),
+        Coluna("Data Pagamento", 16, lambda v: _data(v, "data_pagamento")),
+    ]
+    destaques = {"Pago": "pago", "Atrasado": "atraso"}
+    arquivo = await gerar_planilha(
+        "Comissões",
+        colunas,
+        vencimentos(),
+        destaque=lambda v: destaques.get(v.get("status", "Pendente"), ""),
+        rodape=lambda: [
+            ["", "", "", "", "TOTAL PAGO", "", totais["Pago"]],
+            ["", "", "", "", "TOTAL PENDENTE", "", totais["Pendente"]],
+            ["", "", "", "", "TOTAL ATRASADO", "", totais["Atrasado"]],
+        ],
     )
 
+    await _auditar_exportacao(usuario, "vencimentos", "comissões")
+    return resposta_excel(arquivo, f"comissoes_{datetime.now().strftime('%d-%m-%Y')}.xlsx")
+
+
+@app.get("/api/export/pedidos")
+async def exportar_pedidos(usuario=Depends(apenas_admin)):
+    colunas = [
+        Coluna("OC", 18, lambda p: p.get("numero_oc", "")),
+        Coluna("Nº Fábrica", 14, lambda p: p.get("numero_fabrica", "")),
+        Coluna("Cliente", 30, lambda p: p.get("cliente_nome", "")),
+        Coluna("FE", 14, lambda p: p.get("numero_fe", "")),
+        Coluna("Item", 30, lambda p: p.get("item_nome", "")),
+        Coluna("Entrega", 12, lambda p: _data(p, "data_entrega")),
+        Coluna("Status", 14, lambda p: p.get("status", "")),
+        Coluna("Quantidade", 12, lambda p: p.get("quantidade", 0)),
+        Coluna("Peso (kg)", 12, lambda p: p.get("peso_total", 0)),
+        Coluna("Valor (R$)", 16, lambda p: _moeda(p, "valor_total"), moeda=True),
+        Coluna("Comissão (R$)", 16, lambda p: _moeda(p, "comissao_valor"), moeda=True),
+    ]
+    docs = db.pedidos.find(FILTRO_ATIVO, {"itens": 0, "historico_entrega": 0}).sort("_id", 1).batch_size(1000)
+    arquivo = await gerar_planilha("Pedidos", colunas, docs)
+    await _auditar_exportacao(usuario, "pedidos", "pedidos")
+    return resposta_excel(arquivo, f"pedidos_{datetime.now().strftime('%d-%m-%Y')}.xlsx")
+
+
+@app.get("/api/export/clientes")
+async def exportar_clientes(usuario=Depends(apenas_admin)):
+    colunas = [
+        Coluna("Referência", 12, lambda c: c.get("referencia", "")),
+        Coluna("Nome", 34, lambda c: c.get("nome", "")),
+        Coluna("CNPJ", 20, lambda c: c.get("cnpj", "")),
+        Coluna("Cidade", 20, lambda c: c.get("cidade", "")),
+        Coluna("UF", 6, lambda c: c.get("estado", "")),
+        Coluna("Comprador", 20, lambda c: c.get("comprador", "")),
+        Coluna("Telefone", 16, lambda c: c.get("telefone", "")),
+        Coluna("E-mail", 28, lambda c: c.get("email", "")),
+    ]
+    docs = db.clientes.find(FILTRO_ATIVO).sort("_id", 1).batch_size(1000)
+    arquivo = await gerar_planilha("Clientes", colunas, docs)
+    await _auditar_exportacao(usuario, "clientes", "clientes")
+    return resposta_excel(arquivo, f"clientes_{datetime.now().strftime('%d-%m-%Y')}.xlsx")
+
+
+@app.get("/api/export/notas-fiscais")
+async def exportar_notas(usuario=Depends(apenas_admin)):
+    colunas = [
+        Coluna("NF", 12, lambda n: n.get("numero_nf", "")),
+        Coluna("Emissão", 12, lambda n: _data(n, "data_emissao")),
+        Coluna("Cliente", 30, lambda n: n.get("cliente_nome", "")),
+        Coluna("FE", 14, lambda n: n.get("numero_fe", "")),
+        Coluna("Valor (R$)", 16, lambda n: _moeda(n, "valor_total"), moeda=True),
+        Coluna("Comissão %", 12, lambda n: n.get("comissao_percent", 0)),
+        Coluna("Comissão (R$)", 16, lambda n: _moeda(n, "comissao_total"), moeda=True),
+        Coluna("Parcelas", 10, lambda n: n.get("numero_parcelas", 1)),
+    ]
+    docs = db.notas_fiscais.find().sort("_id", -1).batch_size(1000)
+    arquivo = await gerar_planilha("Notas Fiscais", colunas, docs)
+    await _auditar_exportacao(usuario, "notas_fiscais", "notas fiscais")
+    return resposta_excel(arquivo, f"notas_fiscais_{datetime.now().strftime('%d-%m-%Y')}.xlsx")
+
 
 # ============================================================
 # 19. Admin — Utilitários
@@ -1211,52 +2140,69 @@ async def exportar_comissoes(usuario=Depends(apenas_admin)):
 
 @app.post("/api/admin/fix-cliente-ids")
 async def fix_cliente_ids(admin=Depends(apenas_admin)):
-    clientes = await db.clientes.find().to_list(length=500)
-    pedidos_sem_id = await db.pedidos.find({
-        "$or": [
-            {"cliente_id": {"$exists": False}},
-            {"cliente_id": ""},
-            {"cliente_id": None}
-        ]
-    }).to_list(length=1000)
-
-    vinculados = 0
-    nao_encontrados = []
-
-    for pedido in pedidos_sem_id:
-        nome_pedido = (pedido.get("cliente_nome") or "").upper().strip()
+    # Índice em memória: nome normalizado → cliente, e token → primeiro cliente que o contém
+    exatos = {}
+    por_token = {}
+    normalizar_ops = []
+    ordem = 0
+    agora = datetime.now(timezone.utc)
+    async for c in db.clientes.find({}, {"nome": 1, "nome_normalizado": 1}):
+        nome_norm = c.get("nome_normalizado") or normalizar_nome(c.get("nome"))
+        if nome_norm and not c.get("nome_normalizado"):
+            normalizar_ops.append(UpdateOne({"_id": c["_id"]}, {"$set": {"nome_normalizado": nome_norm, "atualizado_em": agora}}))
+        cliente_id = str(c["_id"])
+        exatos.setdefault(nome_norm, cliente_id)
+        for token in nome_norm.split():
+            por_token.setdefault(token, (ordem, cliente_id))
+        ordem += 1
+
+    pedidos_ops = []
+    notas_ops = []
+    # Totais do rollup saem da linha sem cliente e entram na do cliente vinculado
+    rollup_remover = []
+    rollup_adicionar = []
+    vinculos = {}
+    nao_encontrados = set()
+    total_processados = 0
+    sem_cliente = {"$or": [{"cliente_id": {"$exists": False}}, {"cliente_id": ""}, {"cliente_id": None}]}
+
+    async for pedido in db.pedidos.find(sem_cliente):
+        total_processados += 1
+        nome_pedido = normalizar_nome(pedido.get("cliente_nome"))
         if not nome_pedido:
             continue
 
-        cliente_match = None
-        for c in clientes:
-            nome_cli = (c.get("nome") or "").upper().strip()
-            if nome_cli == nome_pedido:
-                cliente_match = c
-                break
-
-        if not cliente_match:
-            for c in clientes:
-                nome_cli = (c.get("nome") or "").upper().strip()
-                partes_pedido = nome_pedido.split()
-                if partes_pedido and any(p in nome_cli for p in partes_pedido[:2]):
-                    cliente_match = c
-                    break
-
-        if cliente_match:
-            cliente_id = str(cliente_match["_id"])
-            await db.pedidos.update_one(
-                {"_id": pedido["_id"]},
-                {"$set": {"cliente_id": cliente_id}}
-            )
-            pedido_id_str = str(pedido["_id"])
-            await db.notas_fiscais.update_many(
-                {"pedido_id": pedido_id_str, "$or": [{"cliente_id": ""}, {"cliente_id": None}, {"cliente_id": {"$exists": False}}]},
-                {"$set": {"cliente_id": cliente_id}}
-            )
-            vinculados += 1
+        cliente_id = exatos.get(nome_pedido)
+        if not cliente_id:
+            candidatos = [por_token[t] for t in nome_pedido.split()[:2] if t in por_token]
+            if candidatos:
+                cliente_id = min(candidatos)[1]
+
+        if cliente_id:
+            pedidos_ops.append(UpdateOne({"_id": pedido["_id"]}, {"$set": {"cliente_id": cliente_id, "atualizado_em": agora}}))
+            rollup_remover.append(contribuicao_pedido(pedido))
+            rollup_adicionar.append(contribuicao_pedido({**pedido, "cliente_id": cliente_id}))
+            vinculos[str(pedido["_id"])] = cliente_id
         else:
-            nao_encontrados.append(nome_pedido)
+            nao_encontrados.add((pedido.get("cliente_nome") or "").upper().strip())
+
+    if vinculos:
+        notas = await db.notas_fiscais.find({"pedido_id": {"$in": list(vinculos)}, **sem_cliente}).to_list(length=None)
+        vinculadas = [{**nota, "cliente_id": vinculos[nota["pedido_id"]]} for nota in notas]
+        notas_ops = [UpdateOne({"_id": n["_id"]}, {"$set": {"cliente_id": n["cliente_id"]}}) for n in vinculadas]
+        rollup_remover += await contribuicoes_notas(notas)
+        rollup_adicionar += await contribuicoes_notas(vinculadas)
+
+    if normalizar_ops:
+        await db.clientes.bulk_write(normalizar_ops, ordered=False)
+        await registrar_escrita("clientes")
+    if pedidos_ops:
+        await db.pedidos.bulk_write(pedidos_ops, ordered=False)
+        if notas_ops:
+            await db.notas_fiscais.bulk_write(notas_ops, ordered=False)
+        await aplicar_rollup(adicionar=rollup_adicionar, remover=rollup_remover)
+        await registrar_escrita("pedidos", "notas_fiscais")
+    vinculados = len(pedidos_ops)
 
     await registrar_auditoria(
         acao="UPDATE",
@@ -1269,11 +2215,54 @@ async def fix_cliente_ids(admin=Depends(apenas_admin)):
 
     return {
         "message": f"{vinculados} pedidos vinculados com sucesso!",
-        "nao_encontrados": list(set(nao_encontrados)),
-        "total_processados": len(pedidos_sem_id)
+        "nao_encontrados": sorted(nao_encontrados),
+        "total_processados": total_processados,
     }
 
 
+@app.post("/api/admin/importar/{tipo}")
+async def importar_arquivo(tipo: str, arquivo: UploadFile = File(...), admin=Depends(apenas_admin)):
+    """Importa clientes ou materiais de uma planilha .xlsx (mesmo pipeline dos scripts)."""
+    if tipo not in IMPORTADORES:
+        raise HTTPException(status_code=400, detail=f"Tipo inválido. Use: {sorted(IMPORTADORES)}")
+    colecao = IMPORTADORES[tipo].colecao
+
+    async def auditar(resultado, situacao: str):
+        await registrar_auditoria(
+            acao="CREATE",
+            colecao=colecao,
+            documento_id="import",
+            usuario_email=admin["email"],
+            usuario_role=admin["role"],
+            detalhes=f"Importação de {arquivo.filename}{situacao}: "
+                     f"{resultado.importados} importados, {resultado.duplicados} duplicados",
+        )
+
+    try:
+        resultado = await importar_planilha(db, tipo, arquivo.file, criado_por=admin["email"])
+    except (BadZipFile, InvalidFileException):
+        raise HTTPException(status_code=400, detail="Arquivo não é uma planilha .xlsx válida")
+    except ErroImportacao as e:
+        # Lotes anteriores à linha inválida já foram gravados: ficam registrados na auditoria
+        await auditar(e.resultado, f" interrompida na {e}")
+        raise HTTPException(
+            status_code=400,
+            detail=f"Planilha com dados inválidos na {e} — importação interrompida, "
+                   f"{e.resultado.importados} {tipo} já importados",
+        )
+    finally:
+        await registrar_escrita(colecao)
+
+    await auditar(resultado, "")
+    return {"message": f"{resultado.importados} {tipo} importados!", **resultado.to_dict()}
+
+
+@app.get("/api/admin/cache")
+async def estatisticas_cache(admin=Depends(apenas_admin)):
+    """Acertos/falhas do cache de catálogos deste processo."""
+    return cache_catalogos.estatisticas()
+
+
 # ============================================================
 # 20. LGPD — Endpoints de conformidade
 # ============================================================
@@ -1296,10 +2285,7 @@ async def listar_auditoria(
         filtro["acao"] = acao.upper()
 
     registros = await db.auditoria.find(filtro).sort("criado_em", -1).to_list(length=limite)
-    return [
-        {k: str(v) if isinstance(v, ObjectId) else v for k, v in r.items()}
-        for r in registros
-    ]
+    return RespostaJSON(registros)
 
 
 @app.get("/api/lgpd/titular/{cnpj}")
@@ -1318,9 +2304,6 @@ async def relatorio_titular(cnpj: str, admin=Depends(apenas_admin)):
     orcamentos = await db.orcamentos.find({"cliente_id": cliente_id}).to_list(length=1000)
     notas = await db.notas_fiscais.find({"cliente_id": cliente_id}).to_list(length=1000)
 
-    def limpa(docs):
-        return [{k: str(v) if isinstance(v, ObjectId) else v for k, v in d.items()} for d in docs]
-
     await registrar_auditoria(
         acao="EXPORT",
         colecao="clientes",
@@ -1330,14 +2313,14 @@ async def relatorio_titular(cnpj: str, admin=Depends(apenas_admin)):
         detalhes=f"Relatório LGPD gerado para CNPJ {cnpj}",
     )
 
-    return {
-        "titular": {k: str(v) if isinstance(v, ObjectId) else v for k, v in cliente.items()},
-        "pedidos": limpa(pedidos),
-        "orcamentos": limpa(orcamentos),
-        "notas_fiscais": limpa(notas),
+    return RespostaJSON({
+        "titular": cliente,
+        "pedidos": pedidos,
+        "orcamentos": orcamentos,
+        "notas_fiscais": notas,
         "total_registros": len(pedidos) + len(orcamentos) + len(notas),
-        "gerado_em": datetime.now(timezone.utc).isoformat(),
-    }
+        "gerado_em": datetime.now(timezone.utc),
+    })
 
 
 @app.post("/api/lgpd/titular/{cnpj}/anonimizar")
@@ -1346,24 +2329,27 @@ async def anonimizar_titular(cnpj: str, admin=Depends(apenas_admin)):
     Anonimiza dados pessoais de um titular (LGPD Art. 18 — direito ao esquecimento).
     Mantém dados financeiros por obrigação fiscal.
     """
-    cliente = await db.clientes.find_one({"cnpj": cnpj})
-    if not cliente:
-        raise HTTPException(status_code=404, detail="Titular não encontrado")
-
     token = f"ANONIMIZADO-{cnpj[-4:]}"
-    await db.clientes.update_one(
+    agora = datetime.now(timezone.utc)
+    cliente = await atualizar_retornando_anterior(
+        "clientes",
         {"cnpj": cnpj},
         {"$set": {
             "nome": token,
+            "nome_normalizado": normalizar_nome(token),
             "email": f"{token}@removido.lgpd",
             "telefone": "REMOVIDO",
             "comprador": "REMOVIDO",
             "endereco": "REMOVIDO",
             "anonimizado": True,
-            "anonimizado_em": datetime.now(timezone.utc).isoformat(),
+            "anonimizado_em": agora,
+            "atualizado_em": agora,
             "anonimizado_por": admin["email"],
-        }}
+        }},
+        projection={"_id": 1},
     )
+    if not cliente:
+        raise HTTPException(status_code=404, detail="Titular não encontrado")
 
     await registrar_auditoria(
         acao="DELETE",
@@ -1397,7 +2383,7 @@ class ItemOrcamento(BaseModel):
 
 class OrcamentoSchema(BaseModel):
     numero_proposta: Optional[str] = ""
-    data_emissao: Optional[str] = ""
+    data_emissao: DataOpcional = None
     validade: Optional[str] = "20 DIAS"
     cliente_id: Optional[str] = ""
     cliente_nome: Optional[str] = ""
@@ -1418,14 +2404,22 @@ class OrcamentoSchema(BaseModel):
     observacoes: Optional[str] = ""
 
 
-def gerar_numero_proposta() -> str:
-    return f"PROP-{datetime.now().strftime('%d%m%Y-%H%M%S')}"
+async def gerar_numero_proposta() -> str:
+    return f"PROP-{datetime.now().strftime('%d%m%Y')}-{await sequencia_orcamentos.proximo():05d}"
 
 
 @app.get("/api/orcamentos")
-async def listar_orcamentos(usuario=Depends(verificar_token)):
-    orcamentos = await db.orcamentos.find(FILTRO_ATIVO).sort("criado_em", -1).to_list(length=500)
-    return [serialize(o) for o in orcamentos]
+async def listar_orcamentos(
+    request: Request,
+    cursor: Optional[str] = None,
+    limite: Optional[int] = Query(None, ge=1, le=LIMITE_PAGINA_MAX),
+    fields: Optional[str] = None,
+    usuario=Depends(verificar_token),
+):
+    return await resposta_condicional(
+        request, ["orcamentos"],
+        lambda: listar_paginado("orcamentos", FILTRO_ATIVO, cursor=cursor, limite=limite, fields=fields, direcao=-1),
+    )
 
 
 @app.get("/api/orcamentos/{orcamento_id}")
@@ -1438,12 +2432,14 @@ async def buscar_orcamento(orcamento_id: str, usuario=Depends(verificar_token)):
 
 @app.post("/api/orcamentos", status_code=201)
 async def criar_orcamento(orc: OrcamentoSchema, usuario=Depends(verificar_token)):
-    doc = orc.dict()
+    doc = datas_para_bson(orc.dict())
     if not doc.get("numero_proposta"):
-        doc["numero_proposta"] = gerar_numero_proposta()
-    doc["criado_em"] = datetime.now(timezone.utc).isoformat()
+        doc["numero_proposta"] = await gerar_numero_proposta()
+    doc["criado_em"] = doc["atualizado_em"] = datetime.now(timezone.utc)
     doc["criado_por"] = usuario["email"]
+    doc["deletado"] = False
     result = await db.orcamentos.insert_one(doc)
+    await registrar_escrita("orcamentos")
     await registrar_auditoria(
         acao="CREATE",
         colecao="orcamentos",
@@ -1458,24 +2454,21 @@ async def criar_orcamento(orc: OrcamentoSchema, usuario=Depends(verificar_token)
 
 @app.put("/api/orcamentos/{orcamento_id}")
 async def atualizar_orcamento(orcamento_id: str, orc: OrcamentoSchema, usuario=Depends(verificar_token)):
-    doc = orc.dict()
-    doc["atualizado_em"] = datetime.now(timezone.utc).isoformat()
+    doc = datas_para_bson(orc.dict())
+    doc["atualizado_em"] = datetime.now(timezone.utc)
     doc["atualizado_por"] = usuario["email"]
-    result = await db.orcamentos.update_one(
-        {"_id": to_object_id(orcamento_id)},
-        {"$set": doc}
-    )
-    if result.matched_count == 0:
-        raise HTTPException(status_code=404, detail="Orçamento não encontrado")
-    await registrar_auditoria(
-        acao="UPDATE",
+    antes = await atualizar_com_auditoria(
         colecao="orcamentos",
+        filtro={"_id": to_object_id(orcamento_id)},
+        update={"$set": doc},
+        usuario=usuario,
         documento_id=orcamento_id,
-        usuario_email=usuario["email"],
-        usuario_role=usuario["role"],
+        campos_antes=["status", "valor_total"],
         dados_depois={"status": doc.get("status"), "valor_total": doc.get("valor_total")},
         detalhes="Orçamento atualizado",
     )
+    if antes is None:
+        raise HTTPException(status_code=404, detail="Orçamento não encontrado")
     return {"message": "Orçamento atualizado!"}
 
 
@@ -1485,19 +2478,18 @@ async def atualizar_status_orcamento(orcamento_id: str, data: dict, usuario=Depe
     novo_status = data.get("status", "").upper()
     if novo_status not in status_validos:
         raise HTTPException(status_code=400, detail=f"Status inválido. Use: {status_validos}")
-    await db.orcamentos.update_one(
-        {"_id": to_object_id(orcamento_id)},
-        {"$set": {"status": novo_status, "atualizado_em": datetime.now(timezone.utc).isoformat()}}
-    )
-    await registrar_auditoria(
-        acao="UPDATE",
+    antes = await atualizar_com_auditoria(
         colecao="orcamentos",
+        filtro={"_id": to_object_id(orcamento_id)},
+        update={"$set": {"status": novo_status, "atualizado_em": datetime.now(timezone.utc)}},
+        usuario=usuario,
         documento_id=orcamento_id,
-        usuario_email=usuario["email"],
-        usuario_role=usuario["role"],
+        campos_antes=["status"],
         dados_depois={"status": novo_status},
         detalhes=f"Status do orçamento alterado para {novo_status}",
     )
+    if antes is None:
+        raise HTTPException(status_code=404, detail="Orçamento não encontrado")
     return {"message": f"Status atualizado para {novo_status}"}
 
 
@@ -1513,11 +2505,960 @@ async def deletar_orcamento(orcamento_id: str, motivo: str = "", usuario=Depends
 
 
 # ============================================================
-# 22. Shutdown
+# 22. Rollup mensal — consolidado por (ano, mês, cliente, FE)
+# ============================================================
+
+def _ano_mes(*datas) -> Optional[tuple]:
+    """Primeiro (ano, mês) válido entre as datas informadas (datetime ou texto ISO legado)."""
+    for d in datas:
+        if isinstance(d, datetime):
+            return d.year, d.month
+        if isinstance(d, str) and len(d) >= 7:
+            try:
+                return int(d[:4]), int(d[5:7])
+            except ValueError:
+                continue
+    return None
+
+
+def _chave_rollup(ano_mes: tuple, doc: dict) -> dict:
+    return {
+        "ano": ano_mes[0],
+        "mes": ano_mes[1],
+        "cliente_id": doc.get("cliente_id") or "",
+        "numero_fe": doc.get("numero_fe") or "",
+    }
+
+
+def contribuicao_pedido(pedido: Optional[dict]) -> Optional[dict]:
+    """Quanto um pedido soma no rollup (mês de entrega, ou de criação se não houver)."""
+    if not pedido or pedido.get("deletado") or pedido.get("status") == "CANCELADO":
+        return None
+    ano_mes = _ano_mes(pedido.get("data_entrega"), pedido.get("criado_em"))
+    if not ano_mes:
+        return None
+    return {
+        "chave": _chave_rollup(ano_mes, pedido),
+        "cliente_nome": pedido.get("cliente_nome", ""),
+        "valores": {
+            "pedidos_qtd": 1,
+            "pedidos_valor": pedido.get("valor_total", 0) or 0,
+            "pedidos_peso": pedido.get("peso_total", 0) or 0,
+            "comissao_prevista": sum(i.get("comissao_valor", 0) or 0 for i in pedido.get("itens") or []),
+        },
+    }
+
+
+def contribuicao_nota(nota: Optional[dict], peso_pedido: float = 0) -> Optional[dict]:
+    """Quanto uma NF soma no rollup (mês de emissão). Sem peso_total, vale o peso do pedido de origem."""
+    if not nota:
+        return None
+    ano_mes = _ano_mes(nota.get("data_emissao"), nota.get("criado_em"))
+    if not ano_mes:
+        return None
+    peso = nota.get("peso_total")
+    return {
+        "chave": _chave_rollup(ano_mes, nota),
+        "cliente_nome": nota.get("cliente_nome", ""),
+        "valores": {
+            "nf_qtd": 1,
+            "faturado_valor": nota.get("valor_total", 0) or 0,
+            "faturado_peso": (peso if peso is not None else peso_pedido) or 0,
+            "comissao_realizada": nota.get("comissao_total", 0) or 0,
+        },
+    }
+
+
+async def contribuicoes_notas(notas: List[Optional[dict]]) -> List[Optional[dict]]:
+    """
+    contribuicao_nota() de cada NF, com o mesmo fallback de peso do reconstruir_rollup():
+    NFs antigas não guardam o peso, então ele vem do pedido de origem (uma consulta para todas).
+    """
+    sem_peso = {
+        str(n["pedido_id"]) for n in notas
+        if n and n.get("peso_total") is None and ObjectId.is_valid(n.get("pedido_id") or "")
+    }
+    pesos = {}
+    if sem_peso:
+        async for p in db.pedidos.find({"_id": {"$in": [ObjectId(i) for i in sem_peso]}}, {"peso_total": 1}):
+            pesos[str(p["_id"])] = p.get("peso_total") or 0
+    return [contribuicao_nota(n, pesos.get(str(n.get("pedido_id")), 0)) if n else None for n in notas]
+
+
+async def aplicar_rollup(*, adicionar: Optional[list] = None, remover: Optional[list] = None, session=None):
+    """
+    Atualiza o rollup_mensal de forma incremental ($inc com upsert).
+    Contribuições da mesma chave são somadas antes, então cada linha recebe um único update.
+    """
+    agregado = {}
+    for sinal, contribuicoes in ((1, adicionar or []), (-1, remover or [])):
+        for c in contribuicoes:
+            if not c:
+                continue
+            k = tuple(c["chave"].values())
+            item = agregado.setdefault(k, {"chave": c["chave"], "cliente_nome": "", "inc": {}})
+            if c["cliente_nome"]:
+                item["cliente_nome"] = c["cliente_nome"]
+            for campo, valor in c["valores"].items():
+                item["inc"][campo] = item["inc"].get(campo, 0) + sinal * valor
+
+    agora = datetime.now(timezone.utc)
+    ops = []
+    for item in agregado.values():
+        if not any(item["inc"].values()):
+            continue
+        campos = {"atualizado_em": agora}
+        if item["cliente_nome"]:
+            campos["cliente_nome"] = item["cliente_nome"]
+        ops.append(UpdateOne(item["chave"], {"$inc": item["inc"], "$set": campos}, upsert=True))
+    if ops:
+        await db.rollup_mensal.bulk_write(ops, ordered=False, session=session)
+
+
+def _pipeline_ano_mes(*campos: str) -> list:
+    """Estágios que extraem ano/mês da primeira data preenchida entre os campos (string ISO ou date)."""
+    ref = ""
+    for campo in reversed(campos):
+        texto = {"$ifNull": [{"$toString": f"${campo}"}, ""]}
+        ref = {"$cond": [{"$gte": [{"$strLenCP": texto}, 7]}, texto, ref]}
+    return [
+        {"$addFields": {"_ref": ref}},
+        {"$match": {"$expr": {"$gte": [{"$strLenCP": "$_ref"}, 7]}}},
+        {"$addFields": {
+            "_ano": {"$toInt": {"$substrCP": ["$_ref", 0, 4]}},
+            "_mes": {"$toInt": {"$substrCP": ["$_ref", 5, 2]}},
+        }},
+    ]
+
+
+def _pipeline_rollup(valores: dict, destino: str) -> list:
+    return [
+        {"$group": {
+            "_id": {
+                "ano": "$_ano",
+                "mes": "$_mes",
+                "cliente_id": {"$ifNull": ["$cliente_id", ""]},
+                "numero_fe": {"$ifNull": ["$numero_fe", ""]},
+            },
+            "cliente_nome": {"$last": "$cliente_nome"},
+            **{campo: {"$sum": expr} for campo, expr in valores.items()},
+        }},
+        {"$project": {
+            "_id": 0,
+            "ano": "$_id.ano",
+            "mes": "$_id.mes",
+            "cliente_id": "$_id.cliente_id",
+            "numero_fe": "$_id.numero_fe",
+            "cliente_nome": 1,
+            **{campo: 1 for campo in valores},
+        }},
+        {"$merge": {
+            "into": destino,
+            "on": ["ano", "mes", "cliente_id", "numero_fe"],
+            "whenMatched": "merge",
+            "whenNotMatched": "insert",
+        }},
+    ]
+
+
+async def reconstruir_rollup() -> int:
+    """
+    Recalcula o rollup_mensal inteiro a partir de pedidos e notas_fiscais.
+    Monta numa coleção temporária e troca de uma vez (renameCollection):
+    quem lê nunca vê a tabela vazia ou pela metade.
+    """
+    destino = f"rollup_mensal_reconstrucao_{uuid.uuid4().hex[:8]}"
+    # O $merge por (ano, mes, cliente_id, numero_fe) exige o índice único no destino
+    await db[destino].create_index([("ano", 1), ("mes", 1), ("cliente_id", 1), ("numero_fe", 1)], unique=True)
+
+    pedidos_pipeline = [
+        {"$match": {**FILTRO_ATIVO, "status": {"$ne": "CANCELADO"}}},
+        *_pipeline_ano_mes("data_entrega", "criado_em"),
+        *_pipeline_rollup({
+            "pedidos_qtd": 1,
+            "pedidos_valor": {"$ifNull": ["$valor_total", 0]},
+            "pedidos_peso": {"$ifNull": ["$peso_total", 0]},
+            "comissao_prevista": {"$sum": "$itens.comissao_valor"},
+        }, destino),
+    ]
+
+    notas_pipeline = [
+        *_pipeline_ano_mes("data_emissao", "criado_em"),
+        # NFs antigas não guardam o peso — busca no pedido de origem
+        {"$addFields": {"_pid": {"$convert": {"input": "$pedido_id", "to": "objectId", "onError": None, "onNull": None}}}},
+        {"$lookup": {
+            "from": "pedidos",
+            "let": {"pid": "$_pid"},
+            "pipeline": [{"$match": {"$expr": {"$eq": ["$_id", "$$pid"]}}}, {"$project": {"peso_total": 1}}],
+            "as": "_pedido",
+        }},
+        *_pipeline_rollup({
+            "nf_qtd": 1,
+            "faturado_valor": {"$ifNull": ["$valor_total", 0]},
+            "faturado_peso": {"$ifNull": ["$peso_total", {"$ifNull": [{"$arrayElemAt": ["$_pedido.peso_total", 0]}, 0]}]},
+            "comissao_realizada": {"$ifNull": ["$comissao_total", 0]},
+        }, destino),
+    ]
+    try:
+        await db.pedidos.aggregate(pedidos_pipeline).to_list(length=None)
+        await db.notas_fiscais.aggregate(notas_pipeline).to_list(length=None)
+        await db[destino].rename("rollup_mensal", dropTarget=True)
+    except BaseException:
+        await db[destino].drop()
+        raise
+
+    return await db.rollup_mensal.count_documents({})
+
+
+@app.get("/api/rollup-mensal")
+async def listar_rollup_mensal(
+    ano: Optional[int] = None,
+    mes: Optional[int] = None,
+    cliente_id: Optional[str] = None,
+    usuario=Depends(verificar_token),
+):
+    filtro = {}
+    if ano:
+        filtro["ano"] = ano
+    if mes:
+        filtro["mes"] = mes
+    if cliente_id:
+        filtro["cliente_id"] = cliente_id
+    return await db.rollup_mensal.find(filtro, {"_id": 0}).sort([("ano", 1), ("mes", 1)]).to_list(length=None)
+
+
+@app.post("/api/admin/rollup-mensal/reconstruir")
+async def reconstruir_rollup_mensal(admin=Depends(apenas_admin)):
+    total = await reconstruir_rollup()
+    await registrar_escrita("rollup_mensal")
+    await registrar_auditoria(
+        acao="UPDATE",
+        colecao="rollup_mensal",
+        documento_id="rebuild",
+        usuario_email=admin["email"],
+        usuario_role=admin["role"],
+        detalhes=f"Rollup mensal reconstruído — {total} linhas",
+    )
+    return {"message": f"Rollup mensal reconstruído — {total} linhas."}
+
+
+# ============================================================
+# 23. Eventos em tempo real (SSE)
+# ============================================================
+
+@app.post("/api/stream/token")
+async def gerar_token_stream(usuario=Depends(verificar_token)):
+    """
+    Token para abrir o EventSource em ?token=. Só é conferido na conexão: quando o
+    navegador reconectar depois que ele expirar, o cliente pede outro.
+    """
+    token = criar_token(
+        {"sub": usuario["email"], "role": usuario["role"], "escopo": "stream"},
+        timedelta(seconds=STREAM_TOKEN_EXPIRE_SECONDS),
+    )
+    return {"token": token, "expira_em": STREAM_TOKEN_EXPIRE_SECONDS}
+
+
+@app.get("/api/stream/eventos")
+async def stream_eventos(
+    last_event_id: Optional[str] = Header(None),
+    usuario=Depends(verificar_token_stream),
+):
+    """
+    Mudanças em pedidos, notas_fiscais e vencimentos como Server-Sent Events.
+    Cada mensagem traz colecao, operacao (insert/update/delete), documento_id e,
+    quando disponível, o documento completo — documento_id nulo significa mudança
+    em lote. O evento `resync` pede que o cliente recarregue as listas.
+    """
+    return StreamingResponse(
+        canal_eventos.sse(last_event_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# ============================================================
+# 24. Sincronização offline (delta)
+# ============================================================
+# O token devolvido fica SYNC_MARGEM antes do início da leitura: gravações
+# concorrentes com relógio um pouco atrás não se perdem, ao custo de alguns
+# documentos repetidos — o service worker aplica tudo por id.
+SYNC_MARGEM = timedelta(seconds=int(os.getenv("SYNC_MARGEM_SEGUNDOS", "5")))
+SYNC_RETENCAO = timedelta(days=int(os.getenv("SYNC_RETENCAO_DIAS", "30")))
+
+
+def codificar_token_sync(momento: datetime) -> str:
+    return base64.urlsafe_b64encode(momento.isoformat().encode("utf-8")).decode("ascii")
+
+
+def decodificar_token_sync(token: str) -> datetime:
+    try:
+        momento = datetime.fromisoformat(base64.urlsafe_b64decode(token.encode("ascii")).decode("utf-8"))
+    except Exception:
+        raise HTTPException(status_code=400, detail="Token de sincronização inválido")
+    if momento.tzinfo is None:
+        raise HTTPException(status_code=400, detail="Token de sincronização inválido")
+    return momento
+
+
+async def registrar_remocao_sync(colecao: str, documento_id: str):
+    """Remoção definitiva numa coleção sincronizada: guarda o id para o próximo delta."""
+    agora = datetime.now(timezone.utc)
+    await db.sync_remocoes.insert_one({
+        "colecao": colecao,
+        "documento_id": documento_id,
+        "atualizado_em": agora,
+        "expira_em": agora + SYNC_RETENCAO,
+    })
+
+
+@app.get("/api/sync")
+async def sincronizar(since: Optional[str] = None, usuario=Depends(verificar_token)):
+    """
+    Delta de clientes, materiais, pedidos e metas desde o token `since`:
+    `alterados` traz os documentos criados/atualizados e `removidos` os ids
+    deletados (soft delete ou remoção definitiva). Sem `since` — ou com um
+    token mais antigo que SYNC_RETENCAO — devolve a carga completa dos ativos
+    com `completo: true`, e o cliente substitui o que tem em cache.
+    """
+    inicio = datetime.now(timezone.utc)
+    desde = decodificar_token_sync(since) if since else None
+    if desde and inicio - desde > SYNC_RETENCAO:
+        desde = None
+
+    async def delta(colecao: str):
+        alterados, removidos = [], []
+        if desde:
+            filtro = {"atualizado_em": {"$gte": desde}}
+        else:
+            filtro = FILTRO_ATIVO if colecao in COLECOES_SOFT_DELETE else {}
+        async for doc in db[colecao].aggregate([{"$match": filtro}, *ESTAGIOS_SAIDA]):
+            if doc.get("deletado"):
+                removidos.append(doc["id"])
+            else:
+                alterados.append(doc)
+        return colecao, {"alterados": alterados, "removidos": removidos}
+
+    colecoes = dict(await asyncio.gather(*(delta(c) for c in COLECOES_SYNC)))
+    if desde:
+        async for r in db.sync_remocoes.find({"atualizado_em": {"$gte": desde}}):
+            if r["colecao"] in colecoes:
+                colecoes[r["colecao"]]["removidos"].append(r["documento_id"])
+
+    return RespostaJSON({
+        "token": codificar_token_sync(inicio - SYNC_MARGEM),
+        "completo": desde is None,
+        "colecoes": colecoes,
+    })
+
+
+# ============================================================
+# 25. Lote de mutações — replay idempotente da fila offline
+# ============================================================
+# Cada operação traz uma `chave` gerada no aparelho. A coleção `idempotencia`
+# guarda (usuário:chave) como _id — único por definição — com o resultado da
+# operação; a chave expira após IDEMPOTENCIA_TTL.
+LOTE_MUTACAO_MAX = 500
+IDEMPOTENCIA_TTL = timedelta(days=int(os.getenv("IDEMPOTENCIA_TTL_DIAS", "7")))
+# Reserva sem resultado há mais que isso = requisição que caiu no meio; a chave é liberada
+IDEMPOTENCIA_RESERVA = timedelta(minutes=5)
+
+
+class OperacaoLoteSchema(BaseModel):
+    chave: str = Field(..., min_length=1, max_length=128)
+    operacao: Literal["criar", "atualizar"]
+    colecao: Literal["pedidos", "clientes"]
+    id: Optional[str] = None
+    dados: dict
+
+
+class LoteMutacaoSchema(BaseModel):
+    operacoes: List[OperacaoLoteSchema] = Field(..., min_length=1, max_length=LOTE_MUTACAO_MAX)
+
+
+SCHEMAS_LOTE = {"pedidos": PedidoSchema, "clientes": ClienteSchema}
+
+
+async def reservar_chaves(chaves: List[str], agora: datetime) -> set:
+    """Grava as chaves ainda livres; devolve as que outra requisição reservou antes."""
+    try:
+        await db.idempotencia.insert_many(
+            [{"_id": chave, "criado_em": agora, "expira_em": agora + IDEMPOTENCIA_TTL} for chave in chaves],
+            ordered=False,
+        )
+    except BulkWriteError as e:
+        erros = e.details.get("writeErrors", [])
+        if any(erro.get("code") != 11000 for erro in erros):
+            raise
+        return {chaves[erro["index"]] for erro in erros}
+    return set()
+
+
+@app.post("/api/batch")
+async def executar_lote(lote: LoteMutacaoSchema, usuario=Depends(verificar_token)):
+    """
+    Cria/atualiza pedidos e clientes da fila offline numa única requisição,
+    com um bulk_write por coleção. Uma chave já processada devolve o resultado
+    gravado (`repetido: true`) sem escrever de novo. A resposta traz um
+    resultado por operação, na ordem recebida, com o status HTTP equivalente.
+    """
+    agora = datetime.now(timezone.utc)
+    operacoes = lote.operacoes
+    chaves = [f"{usuario['email']}:{op.chave}" for op in operacoes]
+    if len(set(chaves)) != len(chaves):
+        raise HTTPException(status_code=400, detail="Chave de idempotência repetida no lote")
+    resultados: List[Optional[dict]] = [None] * len(operacoes)
+
+    # 1. Chaves já vistas: devolve o resultado gravado
+    gravados = {d["_id"]: d async for d in db.idempotencia.find({"_id": {"$in": chaves}})}
+    pendentes, reservadas = [], []
+    for i, chave in enumerate(chaves):
+        registro = gravados.get(chave)
+        if registro is None:
+            pendentes.append(i)
+        elif registro.get("resultado"):
+            resultados[i] = {**registro["resultado"], "repetido": True}
+        else:
+            reservadas.append(i)
+    if reservadas:
+        await db.idempotencia.delete_many({
+            "_id": {"$in": [chaves[i] for i in reservadas]},
+            "resultado": {"$exists": False},
+            "criado_em": {"$lt": agora - IDEMPOTENCIA_RESERVA},
+        })
+        pendentes = sorted(pendentes + reservadas)
+
+    # 2. Reserva as chaves novas — perde quem chegar depois com a mesma chave
+    ocupadas = await reservar_chaves([chaves[i] for i in pendentes], agora) if pendentes else set()
+    for i in pendentes:
+        if chaves[i] in ocupadas:
+            resultados[i] = {"chave": operacoes[i].chave, "status": 409, "erro": "Operação em processamento"}
+    pendentes = [i for i in pendentes if chaves[i] not in ocupadas]
+
+    # 3. Estado atual dos documentos a atualizar, numa consulta por coleção
+    alvos = {"pedidos": set(), "clientes": set()}
+    for i in pendentes:
+        op = operacoes[i]
+        if op.operacao == "atualizar" and op.id and ObjectId.is_valid(op.id):
+            alvos[op.colecao].add(ObjectId(op.id))
+    atuais = {}
+    for colecao, oids in alvos.items():
+        if oids:
+            async for d in db[colecao].find({"_id": {"$in": list(oids)}, **FILTRO_ATIVO}):
+                atuais[(colecao, str(d["_id"]))] = d
+
+    # 4. Monta as escritas
+    escritas = {"pedidos": [], "clientes": []}  # (índice da operação, WriteModel, doc, antes)
+    filtros = {}  # índice da operação → filtro do UpdateOne
+    for i in pendentes:
+        op = operacoes[i]
+        base = {"chave": op.chave}
+        try:
+            dados = SCHEMAS_LOTE[op.colecao](**op.dados)
+        except ValidationError as e:
+            erros = [{"campo": ".".join(str(p) for p in err["loc"]), "erro": err["msg"]} for err in e.errors()]
+            resultados[i] = {**base, "status": 422, "erro": "Dados inválidos", "detalhes": erros}
+            continue
+
+        if op.operacao == "criar":
+            doc = await (novo_pedido if op.colecao == "pedidos" else novo_cliente)(dados, usuario)
+            doc["_id"] = ObjectId()
+            escritas[op.colecao].append((i, InsertOne(doc), doc, None))
+            resultados[i] = {**base, "status": 201, "id": str(doc["_id"])}
+            if op.colecao == "pedidos":
+                resultados[i]["numero_oc"] = doc["numero_oc"]
+            else:
+                resultados[i]["referencia"] = doc["referencia"]
+            continue
+
+        antes = atuais.get((op.colecao, op.id or ""))
+        if antes is None:
+            resultados[i] = {**base, "status": 404, "erro": "Documento não encontrado"}
+            continue
+        filtro = {"_id": antes["_id"], **FILTRO_ATIVO}
+        if op.colecao == "pedidos" and usuario.get("role") != "admin":
+            if antes.get("status") == "NF_EMITIDA":
+                resultados[i] = {**base, "status": 403, "erro": "Pedido com NF emitida não pode ser editado"}
+                continue
+            filtro["status"] = {"$ne": "NF_EMITIDA"}
+        doc = (pedido_atualizado if op.colecao == "pedidos" else cliente_atualizado)(dados, usuario)
+        escritas[op.colecao].append((i, UpdateOne(filtro, {"$set": doc}), doc, antes))
+        filtros[i] = filtro
+        # Uma segunda atualização do mesmo documento no lote parte deste estado
+        atuais[(op.colecao, op.id)] = {**antes, **doc}
+        resultados[i] = {**base, "status": 200, "id": op.id}
+
+    # 5. Um bulk_write por coleção
+    falhas = set()  # erro de gravação: a chave é liberada para nova tentativa
+    sem_efeito = set()  # atualização que não casou com o filtro: resultado definitivo
+    for colecao, itens in escritas.items():
+        if not itens:
+            continue
+        try:
+            casados = (await db[colecao].bulk_write([modelo for _, modelo, _, _ in itens], ordered=False)).matched_count
+        except BulkWriteError as e:
+            casados = e.details.get("nMatched", 0)
+            for erro in e.details.get("writeErrors", []):
+                i = itens[erro["index"]][0]
+                falhas.add(i)
+                resultados[i] = {
+                    "chave": operacoes[i].chave,
+                    "status": 409 if erro.get("code") == 11000 else 500,
+                    "erro": erro.get("errmsg", "Falha na gravação"),
+                }
+        finally:
+            await registrar_escrita(colecao)
+
+        # Entre o passo 3 e a gravação o documento pode ter sido excluído ou faturado.
+        # bulk_write só informa o total casado: havendo diferença, refaz cada $set
+        # (idempotente) para saber qual operação não encontrou o documento.
+        atualizacoes = [(i, doc, antes) for i, _, doc, antes in itens if antes is not None and i not in falhas]
+        if casados >= len(atualizacoes):
+            continue
+        for i, doc, antes in atualizacoes:
+            if (await db[colecao].update_one(filtros[i], {"$set": doc})).matched_count:
+                continue
+            sem_efeito.add(i)
+            if await db[colecao].count_documents({"_id": antes["_id"], **FILTRO_ATIVO}, limit=1):
+                resultados[i] = {"chave": operacoes[i].chave, "status": 409, "erro": "Pedido com NF emitida não pode ser editado"}
+            else:
+                resultados[i] = {"chave": operacoes[i].chave, "status": 404, "erro": "Documento não encontrado"}
+
+    # 6. Rollup, auditoria e eventos das escritas aplicadas
+    adicionar, remover = [], []
+    for colecao, itens in escritas.items():
+        for i, _, doc, antes in itens:
+            if i in falhas or i in sem_efeito:
+                continue
+            if antes is None:
+                if colecao == "pedidos":
+                    adicionar.append(contribuicao_pedido(doc))
+                    await auditar_pedido_criado(doc, usuario)
+                else:
+                    await auditar_cliente_criado(doc, usuario)
+                await publicar_evento(colecao, "insert", str(doc["_id"]), doc)
+                continue
+            if colecao == "pedidos":
+                remover.append(contribuicao_pedido(antes))
+                adicionar.append(contribuicao_pedido({**antes, **doc}))
+            await registrar_auditoria(
+                acao="UPDATE",
+                colecao=colecao,
+                documento_id=str(antes["_id"]),
+                usuario_email=usuario["email"],
+                usuario_role=usuario["role"],
+                dados_antes=snapshot_auditoria(antes, ["status", "valor_total"] if colecao == "pedidos" else None),
+                dados_depois={"status": doc["status"], "valor_total": doc["valor_total"]} if colecao == "pedidos" else doc,
+                detalhes=f"{'Pedido' if colecao == 'pedidos' else 'Cliente'} atualizado via lote offline",
+            )
+            await publicar_evento(colecao, "update", str(antes["_id"]))
+    if adicionar or remover:
+        await aplicar_rollup(adicionar=adicionar, remover=remover)
+
+    # 7. Resultados definitivos ficam gravados na chave; falhas de gravação liberam a chave para nova tentativa
+    registros = [
+        UpdateOne({"_id": chaves[i]}, {"$set": {"resultado": resultados[i]}})
+        for i in pendentes if i not in falhas
+    ]
+    if registros:
+        await db.idempotencia.bulk_write(registros, ordered=False)
+    if falhas:
+        await db.idempotencia.delete_many({"_id": {"$in": [chaves[i] for i in falhas]}})
+
+    aplicadas = sum(1 for r in resultados if r["status"] in (200, 201) and not r.get("repetido"))
+    return {"message": f"{aplicadas} de {len(operacoes)} operações aplicadas", "resultados": resultados}
+
+
+# ============================================================
+# 26. Relatórios — agregações no servidor
+# ============================================================
+# A página de Relatórios recebe só as linhas finais de cada tabela:
+# curva ABC, ciclo de compra e séries mensais são calculados no MongoDB.
+
+STATUS_ABERTOS = ["PENDENTE", "IMPLANTADO"]
+UM_DIA_MS = 24 * 3600 * 1000
+
+
+def periodo_relatorio(
+    ano: Optional[int] = Query(None, ge=2000, le=2100),
+    mes_inicio: int = Query(1, ge=1, le=12),
+    mes_fim: int = Query(12, ge=1, le=12),
+) -> dict:
+    """Período [início, fim) do relatório, em datas UTC — faixa direto sobre os índices de data."""
+    if mes_inicio > mes_fim:
+        raise HTTPException(status_code=400, detail="mes_inicio não pode ser maior que mes_fim")
+    ano = ano or datetime.now(timezone.utc).year
+    return {
+        "ano": ano,
+        "mes_inicio": mes_inicio,
+        "mes_fim": mes_fim,
+        "inicio": mes_utc(ano, mes_inicio),
+        "fim": mes_utc(ano, mes_fim + 1),
+    }
+
+
+def _primeiro_preenchido(*campos: str, padrao: str = "S/N") -> dict:
+    """Primeiro campo não vazio entre `campos` (mesmo critério do `a || b || "S/N"` do frontend)."""
+    expr = padrao
+    for campo in reversed(campos):
+        expr = {"$cond": [{"$in": [{"$ifNull": [f"${campo}", ""]}, [""]]}, expr, f"${campo}"]}
+    return expr
+
+
+def _como_data(campo: str) -> dict:
+    """Lê o campo como date, esteja ele gravado como date ou como texto ISO."""
+    return {"$cond": [
+        {"$eq": [{"$type": f"${campo}"}, "date"]},
+        f"${campo}",
+        {"$dateFromString": {
+            "dateString": {"$substrCP": [{"$ifNull": [f"${campo}", ""]}, 0, 19]},
+            "onError": None,
+            "onNull": None,
+        }},
+    ]}
+
+
+# Pedidos antigos não têm cliente_id — nesses o nome identifica o cliente
+CHAVE_CLIENTE = _primeiro_preenchido("cliente_id", "cliente_nome")
+FILTRO_VENDAS = {**FILTRO_ATIVO, "status": {"$ne": "CANCELADO"}}
+
+
+def filtro_emissao(inicio: datetime, fim: datetime) -> dict:
+    """NFs emitidas no período (NFs sem data_emissao valem pela data de criação)."""
+    return {"$or": [
+        {"data_emissao": {"$gte": inicio, "$lt": fim}},
+        {"data_emissao": {"$in": ["", None]}, "criado_em": {"$gte": inicio, "$lt": fim}},
+    ]}
+
+
+async def relatorio_condicional(request: Request, colecoes: List[str], carregar):
+    # dias_sem_comprar e o ano padrão dependem da data de hoje
+    hoje = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    return await resposta_condicional(request, colecoes, carregar, extra=hoje)
+
+
+@app.get("/api/relatorios/curva-abc")
+async def relatorio_curva_abc(request: Request, periodo=Depends(periodo_relatorio), usuario=Depends(verificar_token)):
+    """Vendas por cliente no período (total e mês a mês), com participação acumulada e classe A/B/C."""
+    pipeline = [
+        {"$match": {**FILTRO_VENDAS, "criado_em": {"$gte": periodo["inicio"], "$lt": periodo["fim"]}}},
+        *_pipeline_ano_mes("criado_em"),
+        {"$group": {
+            "_id": {"cliente": CHAVE_CLIENTE, "mes": "$_mes"},
+            "nome": {"$last": "$cliente_nome"},
+            "valor": {"$sum": {"$ifNull": ["$valor_total", 0]}},
+        }},
+        {"$group": {
+            "_id": "$_id.cliente",
+            "nome": {"$last": "$nome"},
+            "total": {"$sum": "$valor"},
+            "meses": {"$push": {"mes": "$_id.mes", "valor": "$valor"}},
+        }},
+        {"$setWindowFields": {
+            "sortBy": {"total": -1},
+            "output": {
+                "acumulado": {"$sum": "$total", "window": {"documents": ["unbounded", "current"]}},
+                "total_geral": {"$sum": "$total", "window": {"documents": ["unbounded", "unbounded"]}},
+            },
+        }},
+        {"$set": {
+            "participacao": {"$cond": [{"$gt": ["$total_geral", 0]}, {"$multiply": [{"$divide": ["$total", "$total_geral"]}, 100]}, 0]},
+            "pct_acumulado": {"$cond": [{"$gt": ["$total_geral", 0]}, {"$multiply": [{"$divide": ["$acumulado", "$total_geral"]}, 100]}, 0]},
+        }},
+        {"$sort": {"total": -1, "_id": 1}},
+        {"$project": {
+            "_id": 0,
+            "cliente_id": "$_id",
+            "nome": {"$ifNull": ["$nome", "S/N"]},
+            "total": 1,
+            "participacao": 1,
+            "pct_acumulado": 1,
+            "classe": {"$switch": {
+                "branches": [
+                    {"case": {"$lte": ["$pct_acumulado", 80]}, "then": "A"},
+                    {"case": {"$lte": ["$pct_acumulado", 95]}, "then": "B"},
+                ],
+                "default": "C",
+            }},
+            # Colunas Jan..Dez, com zero nos meses sem venda
+            "meses": {"$map": {
+                "input": list(range(1, 13)),
+                "as": "m",
+                "in": {"$sum": {"$map": {
+                    "input": {"$filter": {"input": "$meses", "as": "x", "cond": {"$eq": ["$$x.mes", "$$m"]}}},
+                    "as": "x",
+                    "in": "$$x.valor",
+                }}},
+            }},
+        }},
+    ]
+
+    async def carregar():
+        clientes, total_clientes = await asyncio.gather(
+            db.pedidos.aggregate(pipeline).to_list(length=None),
+            db.clientes.count_documents(FILTRO_ATIVO),
+        )
+        classes = {c: {"clientes": 0, "participacao": 0.0} for c in "ABC"}
+        for linha in clientes:
+            classes[linha["classe"]]["clientes"] += 1
+            classes[linha["classe"]]["participacao"] += linha["participacao"]
+        return {
+            "ano": periodo["ano"],
+            "mes_inicio": periodo["mes_inicio"],
+            "mes_fim": periodo["mes_fim"],
+            "total": sum(c["total"] for c in clientes),
+            "classes": classes,
+            "clientes": clientes,
+            # cadastro inteiro, para o "x ativos de N clientes" da página
+            "total_clientes": total_clientes,
+        }
+
+    return await relatorio_condicional(request, ["pedidos", "clientes"], carregar)
+
+
+def _pipeline_ciclo(filtro: dict) -> list:
+    """Um documento por cliente: nº de pedidos, intervalo médio entre pedidos e dias desde o último."""
+    return [
+        {"$match": {**FILTRO_VENDAS, **filtro}},
+        {"$set": {"_cliente": CHAVE_CLIENTE, "_data": _como_data("criado_em")}},
+        {"$match": {"_data": {"$ne": None}}},
+        {"$setWindowFields": {
+            "partitionBy": "$_cliente",
+            "sortBy": {"_data": 1},
+            "output": {"_anterior": {"$shift": {"output": "$_data", "by": -1, "default": None}}},
+        }},
+        {"$group": {
+            "_id": "$_cliente",
+            "nome": {"$last": "$cliente_nome"},
+            "total_pedidos": {"$sum": 1},
+            # $avg ignora o null do primeiro pedido de cada cliente
+            "ciclo_medio": {"$avg": {"$cond": [
+                {"$eq": ["$_anterior", None]},
+                None,
+                {"$divide": [{"$subtract": ["$_data", "$_anterior"]}, UM_DIA_MS]},
+            ]}},
+            "ultima_compra": {"$max": "$_data"},
+        }},
+        {"$project": {
+            "_id": 0,
+            "cliente_id": "$_id",
+            "nome": {"$ifNull": ["$nome", "S/N"]},
+            "total_pedidos": 1,
+            "ciclo_medio": {"$round": [{"$ifNull": ["$ciclo_medio", 0]}, 0]},
+            "ultima_compra": {"$dateToString": {"date": "$ultima_compra", "format": "%Y-%m-%d"}},
+            "dias_sem_comprar": {"$floor": {"$divide": [{"$subtract": ["$$NOW", "$ultima_compra"]}, UM_DIA_MS]}},
+        }},
+    ]
+
+
+@app.get("/api/relatorios/ciclo-compra")
+async def relatorio_ciclo_compra(
+    request: Request,
+    ano: Optional[int] = Query(None, ge=2000, le=2100),
+    usuario=Depends(verificar_token),
+):
+    """Frequência de compra por cliente — todo o histórico, ou só o `ano` informado."""
+    filtro = {"criado_em": {"$gte": mes_utc(ano, 1), "$lt": mes_utc(ano + 1, 1)}} if ano else {}
+    pipeline = _pipeline_ciclo(filtro) + [{"$sort": {"total_pedidos": -1, "nome": 1}}]
+    return await relatorio_condicional(
+        request, ["pedidos"], lambda: db.pedidos.aggregate(pipeline).to_list(length=None)
+    )
+
+
+@app.get("/api/relatorios/clientes-inativos")
+async def relatorio_clientes_inativos(
+    request: Request,
+    dias: int = Query(60, ge=1, le=3650),
+    usuario=Depends(verificar_token),
+):
+    """Clientes cujo último pedido tem mais de `dias` dias, do mais parado para o menos parado."""
+    pipeline = _pipeline_ciclo({}) + [
+        {"$match": {"dias_sem_comprar": {"$gt": dias}}},
+        {"$sort": {"dias_sem_comprar": -1, "nome": 1}},
+    ]
+    return await relatorio_condicional(
+        request, ["pedidos"], lambda: db.pedidos.aggregate(pipeline).to_list(length=None)
+    )
+
+
+@app.get("/api/relatorios/faturamento-mensal")
+async def relatorio_faturamento_mensal(request: Request, periodo=Depends(periodo_relatorio), usuario=Depends(verificar_token)):
+    """Faturamento (NFs emitidas) mês a mês no período, com total e ticket médio por NF — lido do rollup_mensal."""
+    pipeline = [
+        {"$match": {"ano": periodo["ano"], "mes": {"$gte": periodo["mes_inicio"], "$lte": periodo["mes_fim"]}}},
+        {"$group": {
+            "_id": "$mes",
+            "valor": {"$sum": "$faturado_valor"},
+            "peso": {"$sum": "$faturado_peso"},
+            "notas": {"$sum": "$nf_qtd"},
+        }},
+    ]
+
+    async def carregar():
+        por_mes = {m["_id"]: m async for m in db.rollup_mensal.aggregate(pipeline)}
+        meses = [
+            {
+                "mes": mes,
+                "valor": por_mes.get(mes, {}).get("valor", 0),
+                "peso": por_mes.get(mes, {}).get("peso", 0),
+                "notas": por_mes.get(mes, {}).get("notas", 0),
+            }
+            for mes in range(periodo["mes_inicio"], periodo["mes_fim"] + 1)
+        ]
+        total = sum(m["valor"] for m in meses)
+        notas = sum(m["notas"] for m in meses)
+        return {
+            "ano": periodo["ano"],
+            "total": total,
+            "notas": notas,
+            "ticket_medio": total / notas if notas else 0,
+            "melhor_mes": max(meses, key=lambda m: m["valor"])["mes"] if total else None,
+            "meses": meses,
+        }
+
+    return await relatorio_condicional(request, ["notas_fiscais", "rollup_mensal"], carregar)
+
+
+@app.get("/api/relatorios/pedidos-abertos")
+async def relatorio_pedidos_abertos(request: Request, usuario=Depends(verificar_token)):
+    """Pedidos pendentes/implantados aguardando faturamento, mais recentes primeiro, com totais."""
+    pipeline = [
+        {"$match": {**FILTRO_ATIVO, "status": {"$in": STATUS_ABERTOS}}},
+        {"$facet": {
+            "pedidos": [
+                {"$sort": {"criado_em": -1}},
+                {"$project": {
+                    "numero_oc": 1, "cliente_id": 1, "cliente_nome": 1, "item_nome": 1,
+                    "numero_fe": 1, "criado_em": 1, "valor_total": 1, "status": 1,
+                }},
+                *ESTAGIOS_SAIDA,
+            ],
+            "totais": [{"$group": {"_id": None, "quantidade": {"$sum": 1}, "valor": {"$sum": "$valor_total"}}}],
+        }},
+    ]
+
+    async def carregar():
+        res = (await db.pedidos.aggregate(pipeline).to_list(length=1))[0]
+        totais = res["totais"][0] if res["totais"] else {}
+        return {
+            "quantidade": totais.get("quantidade", 0),
+            "valor": totais.get("valor", 0),
+            "pedidos": res["pedidos"],
+        }
+
+    return await relatorio_condicional(request, ["pedidos"], carregar)
+
+
+@app.get("/api/relatorios/produtos")
+async def relatorio_produtos(
+    request: Request,
+    periodo=Depends(periodo_relatorio),
+    limite: int = Query(15, ge=1, le=100),
+    usuario=Depends(verificar_token),
+):
+    """Produtos mais vendidos no período, por valor."""
+    pipeline = [
+        {"$match": {**FILTRO_VENDAS, "criado_em": {"$gte": periodo["inicio"], "$lt": periodo["fim"]}}},
+        {"$group": {
+            "_id": _primeiro_preenchido("item_nome", "numero_fe"),
+            "quantidade": {"$sum": {"$ifNull": ["$quantidade", 0]}},
+            "valor": {"$sum": {"$ifNull": ["$valor_total", 0]}},
+        }},
+        {"$sort": {"valor": -1, "_id": 1}},
+        {"$limit": limite},
+        {"$project": {"_id": 0, "nome": "$_id", "quantidade": 1, "valor": 1}},
+    ]
+    return await relatorio_condicional(
+        request, ["pedidos"], lambda: db.pedidos.aggregate(pipeline).to_list(length=None)
+    )
+
+
+# ============================================================
+# 27. Bootstrap por página — um único GET no carregamento
+# ============================================================
+# Cada página recebe num só payload o que antes buscava com 3–4 GETs em
+# paralelo: as consultas rodam juntas no servidor, só com os campos que a
+# página usa, e o token é validado uma vez. O ETag cobre todas as coleções
+# lidas, então uma recarga sem mudanças custa um 304.
+
+# As telas reenviam o pedido inteiro no PUT ({...pedido}) — todos os campos do schema
+CAMPOS_PEDIDO_PAGINA = ",".join([*PedidoSchema.model_fields, "criado_em"])
+
+
+def _catalogo(colecao: str, fields: str):
+    # Mesma chave do GET da coleção com ?fields= — compartilham o cache
+    return obter_catalogo(
+        colecao, (None, None, fields), lambda: listar_paginado(colecao, FILTRO_ATIVO, fields=fields)
+    )
+
+
+# Página → {chave do payload: (coleções lidas, carregar(ano, mês))}
+PAGINAS_BOOTSTRAP = {
+    "notas-fiscais": {
+        "notas": (["notas_fiscais"], lambda ano, mes: listar_paginado("notas_fiscais", {}, direcao=-1)),
+        "vencimentos": (["vencimentos"], lambda ano, mes: listar_paginado("vencimentos", {}, campo_ordem="data_vencimento")),
+        "pedidos": (["pedidos"], lambda ano, mes: listar_paginado("pedidos", FILTRO_ATIVO, fields=CAMPOS_PEDIDO_PAGINA)),
+        "materiais": (["materiais"], lambda ano, mes: _catalogo("materiais", "numero_fe,peso_unit")),
+    },
+    "pedidos": {
+        "pedidos": (["pedidos"], lambda ano, mes: listar_paginado("pedidos", FILTRO_ATIVO, fields=CAMPOS_PEDIDO_PAGINA)),
+        "materiais": (["materiais"], lambda ano, mes: _catalogo(
+            "materiais", "numero_fe,codigo,nome,descricao,peso_unit,preco_unit,comissao"
+        )),
+        "clientes": (["clientes"], lambda ano, mes: _catalogo("clientes", "nome")),
+    },
+    "metas": {
+        "progresso": (COLECOES_PROGRESSO_METAS, lambda ano, mes: calcular_progresso_metas(ano, mes)),
+        "metas": (["metas"], lambda ano, mes: listar_paginado("metas", {}, fields="cliente_id,mes,ano,valor_ton")),
+    },
+    "dashboard": {
+        "stats": (COLECOES_DASHBOARD, lambda ano, mes: calcular_dashboard()),
+        "metas": (["metas"], lambda ano, mes: listar_paginado("metas", {}, fields="cliente_id,mes,ano,valor_ton")),
+        "pedidos": (["pedidos"], lambda ano, mes: listar_paginado("pedidos", FILTRO_ATIVO, fields=CAMPOS_PEDIDO_PAGINA)),
+        "notas": (["notas_fiscais"], lambda ano, mes: listar_paginado(
+            "notas_fiscais", {}, direcao=-1, fields="data_emissao,valor_total"
+        )),
+    },
+}
+
+
+@app.get("/api/bootstrap/{pagina}")
+async def bootstrap_pagina(
+    pagina: str,
+    request: Request,
+    ano: Optional[int] = Query(None, ge=2000, le=2100),
+    mes: Optional[int] = Query(None, ge=1, le=12),
+    usuario=Depends(verificar_token),
+):
+    consultas = PAGINAS_BOOTSTRAP.get(pagina)
+    if consultas is None:
+        raise HTTPException(status_code=404, detail="Página não encontrada")
+    hoje = datetime.now(timezone.utc)
+    ano = ano or hoje.year
+    mes = mes or hoje.month
+    colecoes = sorted({c for lidas, _ in consultas.values() for c in lidas})
+
+    async def carregar():
+        resultados = await asyncio.gather(*(carregar_item(ano, mes) for _, carregar_item in consultas.values()))
+        return dict(zip(consultas, resultados))
+
+    # O dashboard depende do dia corrente; as demais páginas, do período pedido
+    return await resposta_condicional(
+        request, colecoes, carregar, extra=f"{pagina}:{ano}-{mes:02d}:{hoje.strftime('%Y-%m-%d')}"
+    )
+
+
+# ============================================================
+# 28. Shutdown
 # ============================================================
 
 @app.on_event("shutdown")
 async def shutdown():
+    for tarefa in tarefas_background:
+        tarefa.cancel()
+    await asyncio.gather(*tarefas_background, return_exceptions=True)
+    await escritor_auditoria.encerrar()
+    executor_senhas.shutdown(wait=False)
     client.close()
     logger.info("🔴 Conexão com MongoDB encerrada")
 
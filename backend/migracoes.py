@@ -0,0 +1,432 @@
+"""
+RepFlow — Migrações e verificações do banco
+===========================================
+Comandos idempotentes (podem ser repetidos / retomados sem efeito colateral):
+
+  deletado          preenche `deletado: false` onde o campo não existe
+                    e cria os índices parciais de registros ativos
+  verificar-ativos  roda explain() nas consultas com filtro de ativos e
+                    falha (código 1) se alguma cair em COLLSCAN
+  indices           aplica o registro de índices (INDICES) — o mesmo que o
+                    startup da API faz
+  index-audit       roda explain() em cada formato de consulta registrado
+                    (CONSULTAS_INDEXADAS) e falha (código 1) se algum cair
+                    em COLLSCAN
+  atualizado-em     preenche `atualizado_em` (usado pelo GET /api/sync)
+                    onde o campo não existe e cria o índice
+  datas             converte as datas gravadas como texto ISO para BSON date,
+                    em lotes (--lote); interrompida, continua de onde parou
+
+Uso: python migracoes.py deletado
+     python migracoes.py verificar-ativos
+     python migracoes.py indices
+     python migracoes.py index-audit
+     python migracoes.py atualizado-em
+     python migracoes.py datas [--lote 1000]
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+from datetime import date, datetime, timezone
+from typing import Optional
+
+from pymongo import UpdateOne
+from pymongo.errors import OperationFailure
+
+FILTRO_ATIVO = {"deletado": False}
+PARCIAL_ATIVO = {"partialFilterExpression": FILTRO_ATIVO}
+COLECOES_SOFT_DELETE = ["pedidos", "clientes", "materiais", "orcamentos"]
+
+# Chaves quentes consultadas junto com o filtro de ativos
+INDICES_ATIVOS = {
+    "pedidos": [
+        [("deletado", 1), ("_id", 1)],
+        [("cliente_id", 1)],
+        [("status", 1)],
+        [("data_entrega", 1)],
+        [("criado_em", 1)],
+    ],
+    "clientes": [
+        [("deletado", 1), ("_id", 1)],
+        [("cnpj", 1)],
+        [("nome_normalizado", 1)],
+    ],
+    "materiais": [
+        [("deletado", 1), ("_id", 1)],
+    ],
+    "orcamentos": [
+        [("deletado", 1), ("_id", 1)],
+        [("cliente_id", 1)],
+        [("status", 1)],
+        [("criado_em", -1)],
+    ],
+}
+
+
+async def avancar_versoes(db, colecoes) -> None:
+    """
+    Avança a versão das coleções em db.versoes — a base do ETag e da chave do
+    cache de catálogos da API. Quem grava fora da API (importação, migrações)
+    chama depois de gravar, senão os clientes seguem recebendo 304 com dados velhos.
+    """
+    colecoes = list(colecoes)
+    if colecoes:
+        await db.versoes.bulk_write(
+            [UpdateOne({"_id": c}, {"$inc": {"versao": 1}}, upsert=True) for c in colecoes],
+            ordered=False,
+        )
+
+
+async def backfill_deletado(db) -> dict:
+    """Garante `deletado: false` em todo documento ainda não marcado."""
+    alterados = {}
+    for colecao in COLECOES_SOFT_DELETE:
+        result = await db[colecao].update_many({"deletado": {"$exists": False}}, {"$set": {"deletado": False}})
+        alterados[colecao] = result.modified_count
+    return alterados
+
+
+# Coleções entregues pelo GET /api/sync — todo documento precisa de `atualizado_em`
+COLECOES_SYNC = ["clientes", "materiais", "pedidos", "metas"]
+ATUALIZADO_EM_INICIAL = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+async def backfill_atualizado_em(db) -> dict:
+    """Usa `criado_em` (ou a data zero) como `atualizado_em` dos documentos antigos."""
+    alterados = {}
+    for colecao in COLECOES_SYNC:
+        result = await db[colecao].update_many(
+            {"atualizado_em": {"$exists": False}},
+            [{"$set": {"atualizado_em": {"$ifNull": ["$criado_em", ATUALIZADO_EM_INICIAL]}}}],
+        )
+        alterados[colecao] = result.modified_count
+    return alterados
+
+
+# ------------------------------------------------------------
+# Registro de índices: (coleção, chaves, opções do create_index)
+# ------------------------------------------------------------
+# Cada índice existe por causa de um formato de consulta em CONSULTAS_INDEXADAS.
+# create_index com as mesmas chaves e opções é no-op, então aplicar_indices()
+# roda a cada startup; mudar as opções de um índice existente exige removê-lo antes.
+def _nome_ativos(chaves) -> str:
+    return "_".join(f"{campo}_{ordem}" for campo, ordem in chaves) + "_ativos"
+
+
+def _unico_preenchido(campo: str) -> dict:
+    """Unicidade só entre registros ativos com o campo preenchido (texto não vazio)."""
+    return {"partialFilterExpression": {campo: {"$gt": ""}, **FILTRO_ATIVO}}
+
+
+INDICES = [
+    ("usuarios", [("email", 1)], {"unique": True}),
+    ("clientes", [("cnpj", 1)], {}),
+    ("clientes", [("nome_normalizado", 1)], {}),
+    ("pedidos", [("numero_oc", 1)], {}),
+    ("pedidos", [("cliente_id", 1)], {}),
+    ("pedidos", [("status", 1)], {}),
+    # sem filtro de ativos: comissoes_por_fe (emissão de NF) e o importador
+    ("materiais", [("numero_fe", 1)], {}),
+    # chave de cada cadastro ativo é única — a importação conta a colisão como duplicado (11000)
+    ("clientes", [("cnpj", 1)], {"name": "cnpj_1_unico", "unique": True, **_unico_preenchido("cnpj")}),
+    ("materiais", [("numero_fe", 1)], {"name": "numero_fe_1_unico", "unique": True, **_unico_preenchido("numero_fe")}),
+    ("orcamentos", [("numero_proposta", 1)], {}),
+    ("orcamentos", [("cliente_id", 1)], {}),
+    ("orcamentos", [("status", 1)], {}),
+    # emissão: janelas do dashboard/relatórios (NFs sem data valem pelo criado_em)
+    ("notas_fiscais", [("data_emissao", 1), ("criado_em", 1)], {}),
+    ("notas_fiscais", [("cliente_id", 1), ("data_emissao", 1)], {}),
+    ("vencimentos", [("status", 1), ("data_vencimento", 1)], {}),
+    ("vencimentos", [("status", 1), ("prazo_pagamento", 1)], {}),
+    ("vencimentos", [("data_vencimento", 1), ("_id", 1)], {}),
+    ("vencimentos", [("nota_fiscal_id", 1)], {}),
+    ("metas", [("cliente_id", 1), ("ano", 1), ("mes", 1)], {}),
+    ("rollup_mensal", [("ano", 1), ("mes", 1), ("cliente_id", 1), ("numero_fe", 1)], {"unique": True}),
+    # delta sync + remoções definitivas (metas) com TTL
+    *[(colecao, [("atualizado_em", 1)], {}) for colecao in COLECOES_SYNC],
+    ("sync_remocoes", [("atualizado_em", 1)], {}),
+    ("sync_remocoes", [("expira_em", 1)], {"expireAfterSeconds": 0}),
+    # chaves de idempotência do POST /api/batch expiram sozinhas
+    ("idempotencia", [("expira_em", 1)], {"expireAfterSeconds": 0}),
+    # LGPD — auditoria
+    ("auditoria", [("colecao", 1)], {}),
+    ("auditoria", [("usuario_email", 1)], {}),
+    ("auditoria", [("criado_em", 1)], {}),
+    ("auditoria", [("colecao", 1), ("documento_id", 1)], {}),
+    # parciais, só com registros ativos — atendem as consultas com FILTRO_ATIVO
+    *[
+        (colecao, chaves, {"name": _nome_ativos(chaves), **PARCIAL_ATIVO})
+        for colecao, indices in INDICES_ATIVOS.items()
+        for chaves in indices
+    ],
+]
+
+# Substituídos por outro índice do registro: (coleção, nome)
+INDICES_OBSOLETOS = [
+    ("materiais", "numero_fe_1_ativos"),  # → numero_fe_1, que também atende consultas sem filtro de ativos
+]
+
+
+async def aplicar_indices(db) -> list:
+    """
+    Remove os índices obsoletos e cria os do registro que faltam. Devolve os que
+    não puderam ser criados — índice único sobre dados que já têm duplicatas —
+    sem interromper os demais: as duplicatas precisam ser resolvidas à mão.
+    """
+    for colecao, nome in INDICES_OBSOLETOS:
+        if nome in await db[colecao].index_information():
+            await db[colecao].drop_index(nome)
+    pendentes = []
+    for colecao, chaves, opcoes in INDICES:
+        try:
+            await db[colecao].create_index(chaves, **opcoes)
+        except OperationFailure as e:
+            if e.code != 11000:
+                raise
+            pendentes.append(f"{colecao}.{opcoes.get('name') or chaves}: {e}")
+    return pendentes
+
+
+# Consultas reais da API que usam o filtro de ativos: (coleção, filtro, ordenação)
+CONSULTAS_ATIVOS = [
+    ("pedidos", FILTRO_ATIVO, [("_id", 1)]),
+    ("pedidos", {**FILTRO_ATIVO, "cliente_id": "x"}, None),
+    ("pedidos", {**FILTRO_ATIVO, "status": "PENDENTE"}, None),
+    ("clientes", FILTRO_ATIVO, [("_id", 1)]),
+    ("clientes", {**FILTRO_ATIVO, "cnpj": "x"}, None),
+    ("materiais", FILTRO_ATIVO, [("_id", 1)]),
+    ("materiais", {**FILTRO_ATIVO, "numero_fe": "x"}, None),
+    ("orcamentos", FILTRO_ATIVO, [("_id", -1)]),
+]
+
+# Demais formatos de consulta quentes da API (mesmos valores-exemplo: o que importa é o formato)
+_INICIO = datetime(2026, 1, 1, tzinfo=timezone.utc)
+_FIM = datetime(2026, 2, 1, tzinfo=timezone.utc)
+CONSULTAS_INDEXADAS = CONSULTAS_ATIVOS + [
+    # dashboard / relatórios / progresso de metas
+    ("pedidos", {**FILTRO_ATIVO, "criado_em": {"$gte": _INICIO, "$lt": _FIM}}, None),
+    ("pedidos", {**FILTRO_ATIVO, "data_entrega": {"$gte": _INICIO, "$lt": _FIM}}, None),
+    ("pedidos", {"numero_oc": "x"}, None),
+    ("notas_fiscais", {"data_emissao": {"$gte": _INICIO, "$lt": _FIM}}, None),
+    ("notas_fiscais", {"$or": [
+        {"data_emissao": {"$gte": _INICIO, "$lt": _FIM}},
+        {"data_emissao": {"$in": ["", None]}, "criado_em": {"$gte": _INICIO, "$lt": _FIM}},
+    ]}, None),
+    ("notas_fiscais", {"cliente_id": "x", "data_emissao": {"$gte": _INICIO, "$lt": _FIM}}, None),
+    # vencimentos: listagem, status por vencimento, agendador de atrasos, exclusão de NF
+    ("vencimentos", {}, [("data_vencimento", 1), ("_id", 1)]),
+    ("vencimentos", {"status": "Pendente"}, [("data_vencimento", 1)]),
+    ("vencimentos", {"status": "Pendente", "data_vencimento": {"$gte": _INICIO, "$lt": _FIM}}, None),
+    ("vencimentos", {"status": "Pendente", "prazo_pagamento": {"$lt": _INICIO}}, None),
+    ("vencimentos", {"status": "Pago", "data_pagamento": None}, None),
+    ("vencimentos", {"nota_fiscal_id": "x"}, None),
+    # materiais por FE: emissão de NF e importador
+    ("materiais", {"numero_fe": {"$in": ["x", "y"]}}, None),
+    ("materiais", {"numero_fe": {"$nin": ["", None]}}, None),
+    ("orcamentos", FILTRO_ATIVO, [("criado_em", -1)]),
+    ("metas", {"cliente_id": "x", "ano": 2026, "mes": "1"}, None),
+    ("rollup_mensal", {"ano": 2026, "mes": 1}, [("ano", 1), ("mes", 1)]),
+    *[(colecao, {"atualizado_em": {"$gte": _INICIO}}, None) for colecao in COLECOES_SYNC],
+    ("sync_remocoes", {"atualizado_em": {"$gte": _INICIO}}, None),
+    ("auditoria", {"colecao": "pedidos"}, [("criado_em", -1)]),
+    ("auditoria", {}, [("criado_em", -1)]),
+    ("usuarios", {"email": "x"}, None),
+]
+
+
+# Campos de data que já foram gravados como texto ISO, por coleção
+CARIMBOS = ["criado_em", "atualizado_em", "deletado_em", "anonimizado_em"]
+CAMPOS_DATA_TEXTO = {
+    "pedidos": [*CARIMBOS, "data_entrega"],
+    "clientes": CARIMBOS,
+    "materiais": CARIMBOS,
+    "orcamentos": [*CARIMBOS, "data_emissao"],
+    "notas_fiscais": [*CARIMBOS, "data_emissao"],
+    "vencimentos": [*CARIMBOS, "data_vencimento", "prazo_pagamento", "data_pagamento"],
+    "metas": CARIMBOS,
+    "usuarios": CARIMBOS,
+    "auditoria": ["criado_em"],
+    "rollup_mensal": ["atualizado_em"],
+    "sync_remocoes": ["atualizado_em"],
+}
+# Datas de negócio (sem hora): gravadas à meia-noite UTC, como faz o main.para_data
+SO_DATA = {"data_entrega", "data_emissao", "data_vencimento", "prazo_pagamento", "data_pagamento"}
+
+
+def converter_data(texto: str, so_data: bool) -> Optional[datetime]:
+    """Texto ISO → datetime UTC ("" → None). ValueError se o texto não for uma data."""
+    texto = texto.strip()
+    if not texto:
+        return None
+    if so_data:
+        dia = date.fromisoformat(texto[:10])
+        return datetime(dia.year, dia.month, dia.day, tzinfo=timezone.utc)
+    momento = datetime.fromisoformat(texto)
+    if momento.tzinfo is None:
+        momento = momento.replace(tzinfo=timezone.utc)
+    return momento.astimezone(timezone.utc)
+
+
+async def migrar_datas(db, lote: int = 1000, progresso=None) -> dict:
+    """
+    Converte para BSON date os campos de CAMPOS_DATA_TEXTO ainda gravados como texto.
+    Lê só documentos com algum desses campos em texto, em ordem de _id, e grava cada
+    lote com um bulk_write — interrompida, a próxima execução retoma de onde parou.
+    O update só se aplica se o texto não mudou desde a leitura (não sobrescreve uma
+    gravação concorrente). Textos que não são data ficam como estão e são contados.
+    """
+    resumo = {}
+    for colecao, campos in CAMPOS_DATA_TEXTO.items():
+        em_texto = {"$or": [{campo: {"$type": "string"}} for campo in campos]}
+        convertidos, invalidos, ultimo = 0, [], None
+        while True:
+            filtro = em_texto if ultimo is None else {**em_texto, "_id": {"$gt": ultimo}}
+            docs = await db[colecao].find(filtro, {c: 1 for c in campos}).sort("_id", 1).to_list(length=lote)
+            if not docs:
+                break
+            ops = []
+            for doc in docs:
+                novos = {}
+                for campo in campos:
+                    texto = doc.get(campo)
+                    if not isinstance(texto, str):
+                        continue
+                    try:
+                        novos[campo] = converter_data(texto, campo in SO_DATA)
+                    except ValueError:
+                        invalidos.append(f"{doc['_id']}.{campo}={texto!r}")
+                if novos:
+                    filtro_doc = {"_id": doc["_id"], **{campo: doc[campo] for campo in novos}}
+                    ops.append(UpdateOne(filtro_doc, {"$set": novos}))
+            if ops:
+                result = await db[colecao].bulk_write(ops, ordered=False)
+                convertidos += result.modified_count
+            ultimo = docs[-1]["_id"]
+            if progresso:
+                progresso(colecao, convertidos)
+        resumo[colecao] = {"convertidos": convertidos, "invalidos": invalidos}
+    return resumo
+
+
+def estagios(plano: dict):
+    """Percorre recursivamente todos os estágios de um plano do explain()."""
+    if not isinstance(plano, dict):
+        return
+    if "stage" in plano:
+        yield plano["stage"]
+    for chave in ("inputStage", "queryPlan"):
+        if chave in plano:
+            yield from estagios(plano[chave])
+    for filho in plano.get("inputStages", []):
+        yield from estagios(filho)
+
+
+async def plano_vencedor(db, colecao: str, filtro: dict, ordem=None) -> dict:
+    cursor = db[colecao].find(filtro)
+    if ordem:
+        cursor = cursor.sort(ordem)
+    explain = await cursor.explain()
+    return explain["queryPlanner"]["winningPlan"]
+
+
+async def verificar_consultas(db, consultas) -> list:
+    """Devolve as consultas (coleção, filtro, ordenação) cujo plano vencedor tem COLLSCAN."""
+    falhas = []
+    for colecao, filtro, ordem in consultas:
+        plano = await plano_vencedor(db, colecao, filtro, ordem)
+        if "COLLSCAN" in estagios(plano):
+            falhas.append(f"{colecao}.find({filtro})" + (f".sort({ordem})" if ordem else ""))
+    return falhas
+
+
+async def verificar_ativos(db, consultas=CONSULTAS_ATIVOS) -> list:
+    """Devolve as consultas (e contagens) de ativos que ainda caem em COLLSCAN."""
+    falhas = await verificar_consultas(db, consultas)
+    for colecao in COLECOES_SOFT_DELETE:
+        explain = await db.command("explain", {"count": colecao, "query": FILTRO_ATIVO}, verbosity="queryPlanner")
+        if "COLLSCAN" in estagios(explain["queryPlanner"]["winningPlan"]):
+            falhas.append(f"{colecao}.count_documents({FILTRO_ATIVO})")
+    return falhas
+
+
+def conectar():
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv()
+    client = AsyncIOMotorClient(
+        os.getenv("MONGODB_URL", os.getenv("MONGO_URL", "mongodb://localhost:27017")),
+        tz_aware=True,
+        tzinfo=timezone.utc,
+    )
+    return client, client[os.getenv("DB_NAME", "erp_database")]
+
+
+async def _executar(comando: str, lote: int = 1000) -> int:
+    client, db = conectar()
+    try:
+        if comando == "deletado":
+            alterados = await backfill_deletado(db)
+            await aplicar_indices(db)
+            await avancar_versoes(db, [c for c, n in alterados.items() if n])
+            for colecao, n in alterados.items():
+                print(f"  ✅ {colecao}: {n} documentos marcados com deletado=false")
+            return 0
+
+        if comando == "atualizado-em":
+            alterados = await backfill_atualizado_em(db)
+            await aplicar_indices(db)
+            await avancar_versoes(db, [c for c, n in alterados.items() if n])
+            for colecao, n in alterados.items():
+                print(f"  ✅ {colecao}: {n} documentos com atualizado_em preenchido")
+            return 0
+
+        if comando == "datas":
+            resumo = await migrar_datas(
+                db, lote, progresso=lambda colecao, n: print(f"  … {colecao}: {n} documentos convertidos", end="\r")
+            )
+            await avancar_versoes(db, [c for c, r in resumo.items() if r["convertidos"]])
+            for colecao, r in resumo.items():
+                print(f"  ✅ {colecao}: {r['convertidos']} documentos convertidos" + " " * 10)
+                for invalido in r["invalidos"]:
+                    print(f"     ⚠️ não é data, mantido como texto: {invalido}")
+            return 0
+
+        if comando == "indices":
+            pendentes = await aplicar_indices(db)
+            for pendente in pendentes:
+                print(f"  ❌ não criado (duplicatas): {pendente}")
+            print(f"  ✅ {len(INDICES) - len(pendentes)} de {len(INDICES)} índices do registro aplicados")
+            return 1 if pendentes else 0
+
+        if comando in ("verificar-ativos", "index-audit"):
+            consultas = CONSULTAS_ATIVOS if comando == "verificar-ativos" else CONSULTAS_INDEXADAS
+            try:
+                falhas = await verificar_ativos(db, consultas)
+            except OperationFailure as e:
+                print(f"❌ explain falhou: {e}")
+                return 1
+            for falha in falhas:
+                print(f"  ❌ COLLSCAN: {falha}")
+            if not falhas:
+                print(f"  ✅ Nenhuma das {len(consultas)} consultas em COLLSCAN")
+            return 1 if falhas else 0
+    finally:
+        client.close()
+    return 2
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        "comando", choices=["deletado", "verificar-ativos", "atualizado-em", "datas", "indices", "index-audit"]
+    )
+    parser.add_argument("--lote", type=int, default=1000, help="documentos por bulk_write (comando datas)")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(_executar(args.comando, args.lote)))
+
+
+if __name__ == "__main__":
+    main()
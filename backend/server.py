@@ -235,6 +235,8 @@ async def criar_cliente(cliente_data: ClienteCreate, current_user: dict = Depend
     cliente = Cliente(referencia=f"CLI-{new_num:04d}", **cliente_data.model_dump())
     doc = cliente.model_dump()
     doc['created_at'] = doc['created_at'].isoformat()
+    doc['deletado'] = False
+    doc['atualizado_em'] = datetime.now(timezone.utc)
     await db.clientes.insert_one(doc)
     return cliente
 
@@ -249,6 +251,8 @@ async def criar_material(mat_data: MaterialCreate, admin: dict = Depends(get_adm
     material = Material(**mat_data.model_dump())
     doc = material.model_dump()
     doc['created_at'] = doc['created_at'].isoformat()
+    doc['deletado'] = False
+    doc['atualizado_em'] = datetime.now(timezone.utc)
     await db.materiais.insert_one(doc)
     return material
 
@@ -274,6 +278,8 @@ async def criar_pedido(pedido_data: PedidoCreate, current_user: dict = Depends(g
     )
     doc = pedido.model_dump()
     doc['data_criacao'] = doc['data_criacao'].isoformat()
+    doc['deletado'] = False
+    doc['atualizado_em'] = datetime.now(timezone.utc)
     await db.pedidos.insert_one(doc)
     return pedido
 
@@ -2,9 +2,10 @@
 // sw.js — Service Worker RepFlow
 // Estratégia: Cache First para assets, Network First para API
 // Offline: salva pedidos/clientes localmente e sincroniza depois
+// Catálogos e pedidos: cópia local no IndexedDB mantida por delta (/api/sync)
 // ============================================================
 
-const CACHE_VERSION = 'repflow-v1';
+const CACHE_VERSION = 'repflow-v2';
 const CACHE_STATIC = `${CACHE_VERSION}-static`;
 const CACHE_API = `${CACHE_VERSION}-api`;
 
@@ -20,13 +21,14 @@ const STATIC_ASSETS = [
 
 // Rotas da API que podem ser cacheadas para leitura offline
 const API_CACHE_ROUTES = [
-  '/api/clientes',
-  '/api/materiais',
-  '/api/pedidos',
   '/api/dashboard/stats',
-  '/api/metas',
+  '/api/bootstrap',
 ];
 
+// Coleções do GET /api/sync — offline, as listagens saem da cópia local
+const SYNC_ROUTE = /^\/api\/(clientes|materiais|pedidos|metas)(?:\/([0-9a-f]{24}))?$/;
+const SYNC_INTERVALO_MS = 60 * 1000;
+
 // ─────────────────────────────────────────────
 // INSTALL — pré-carrega assets essenciais
 // ─────────────────────────────────────────────
@@ -78,6 +80,11 @@ self.addEventListener('fetch', (event) => {
 
   // Requests para a API — Network First com fallback para cache
   if (url.pathname.startsWith('/api/')) {
+    guardarAutorizacao(request);
+    if (SYNC_ROUTE.test(url.pathname)) {
+      event.respondWith(networkFirstSync(request));
+      return;
+    }
     event.respondWith(networkFirstAPI(request));
     return;
   }
@@ -150,6 +157,43 @@ async function networkFirstAPI(request) {
   }
 }
 
+// ─────────────────────────────────────────────
+// ESTRATÉGIA 2b: Network First (coleções sincronizadas)
+// Online: a resposta não é cacheada inteira — o delta de /api/sync
+// atualiza a cópia local. Offline: a listagem é montada da cópia local.
+// ─────────────────────────────────────────────
+async function networkFirstSync(request) {
+  try {
+    const response = await fetch(request);
+    if (response.ok) syncDeltaSeNecessario();
+    return response;
+  } catch {
+    const [, colecao, id] = new URL(request.url).pathname.match(SYNC_ROUTE);
+    const docs = await getRegistros(colecao);
+    if (docs.length || id) {
+      console.log('[RepFlow SW] Offline — retornando cópia local de:', colecao);
+      if (id) {
+        const doc = docs.find((d) => d.id === id);
+        return jsonResponse(doc || { detail: 'Não disponível offline' }, doc ? 200 : 404);
+      }
+      const url = new URL(request.url);
+      const paginado = url.searchParams.has('cursor') || url.searchParams.has('limite');
+      return jsonResponse(paginado ? { items: docs, next_cursor: null } : docs);
+    }
+    return jsonResponse(
+      { error: 'offline', message: 'Sem conexão. Dados podem estar desatualizados.', offline: true },
+      503
+    );
+  }
+}
+
+function jsonResponse(body, status = 200) {
+  return new Response(JSON.stringify(body), {
+    status,
+    headers: { 'Content-Type': 'application/json' },
+  });
+}
+
 // ─────────────────────────────────────────────
 // ESTRATÉGIA 3: Mutations offline (POST/PUT/DELETE)
 // Se offline, salva no IndexedDB e sincroniza depois
@@ -170,6 +214,8 @@ async function handleMutation(request) {
       headers: Object.fromEntries(request.headers.entries()),
       timestamp: Date.now(),
       pathname: url.pathname,
+      // chave de idempotência: o replay via /api/batch nunca duplica o registro
+      chave: crypto.randomUUID(),
     });
 
     console.log('[RepFlow SW] Offline — request salvo para sync:', url.pathname);
@@ -193,12 +239,20 @@ async function handleMutation(request) {
 // ─────────────────────────────────────────────
 function openDB() {
   return new Promise((resolve, reject) => {
-    const req = indexedDB.open('repflow-offline', 1);
+    const req = indexedDB.open('repflow-offline', 2);
     req.onupgradeneeded = (e) => {
       const db = e.target.result;
       if (!db.objectStoreNames.contains('pending')) {
         db.createObjectStore('pending', { keyPath: 'id', autoIncrement: true });
       }
+      // Cópia local das coleções sincronizadas: chave = "colecao:id"
+      if (!db.objectStoreNames.contains('registros')) {
+        db.createObjectStore('registros', { keyPath: 'chave' }).createIndex('colecao', 'colecao');
+      }
+      // Token do último delta e cabeçalho de autorização para o sync em segundo plano
+      if (!db.objectStoreNames.contains('sync_meta')) {
+        db.createObjectStore('sync_meta', { keyPath: 'nome' });
+      }
     };
     req.onsuccess = (e) => resolve(e.target.result);
     req.onerror = (e) => reject(e.target.error);
@@ -235,21 +289,188 @@ async function deletePendingRequest(id) {
   });
 }
 
+async function getRegistros(colecao) {
+  const db = await openDB();
+  return new Promise((resolve, reject) => {
+    const tx = db.transaction('registros', 'readonly');
+    const req = tx.objectStore('registros').index('colecao').getAll(colecao);
+    req.onsuccess = (e) => resolve(e.target.result.map((r) => r.doc).sort((a, b) => (a.id < b.id ? -1 : 1)));
+    req.onerror = (e) => reject(e.target.error);
+  });
+}
+
+async function getMeta(nome) {
+  const db = await openDB();
+  return new Promise((resolve, reject) => {
+    const tx = db.transaction('sync_meta', 'readonly');
+    const req = tx.objectStore('sync_meta').get(nome);
+    req.onsuccess = (e) => resolve(e.target.result?.valor);
+    req.onerror = (e) => reject(e.target.error);
+  });
+}
+
+async function setMeta(nome, valor) {
+  const db = await openDB();
+  return new Promise((resolve, reject) => {
+    const tx = db.transaction('sync_meta', 'readwrite');
+    tx.objectStore('sync_meta').put({ nome, valor });
+    tx.oncomplete = resolve;
+    tx.onerror = (e) => reject(e.target.error);
+  });
+}
+
+// Aplica um delta do /api/sync numa única transação: upserts e remoções por id;
+// carga completa substitui a coleção inteira. O token só é gravado junto.
+async function aplicarDelta({ token, completo, colecoes }) {
+  const db = await openDB();
+  return new Promise((resolve, reject) => {
+    const tx = db.transaction(['registros', 'sync_meta'], 'readwrite');
+    const registros = tx.objectStore('registros');
+    for (const [colecao, { alterados, removidos }] of Object.entries(colecoes)) {
+      if (completo) {
+        registros.index('colecao').openKeyCursor(IDBKeyRange.only(colecao)).onsuccess = (e) => {
+          const cursor = e.target.result;
+          if (!cursor) {
+            alterados.forEach((doc) => registros.put({ chave: `${colecao}:${doc.id}`, colecao, doc }));
+            return;
+          }
+          registros.delete(cursor.primaryKey);
+          cursor.continue();
+        };
+        continue;
+      }
+      removidos.forEach((id) => registros.delete(`${colecao}:${id}`));
+      alterados.forEach((doc) => registros.put({ chave: `${colecao}:${doc.id}`, colecao, doc }));
+    }
+    tx.objectStore('sync_meta').put({ nome: 'token', valor: token });
+    tx.oncomplete = resolve;
+    tx.onerror = (e) => reject(e.target.error);
+  });
+}
+
+// O app autentica com Authorization: Bearer — o sync em segundo plano reaproveita o último visto
+let autorizacao = null;
+
+function guardarAutorizacao(request) {
+  const valor = request.headers.get('authorization');
+  if (valor && valor !== autorizacao) {
+    autorizacao = valor;
+    setMeta('autorizacao', valor).catch(() => {});
+  }
+}
+
+let ultimoSync = 0;
+let syncEmAndamento = null;
+
+function syncDeltaSeNecessario() {
+  if (Date.now() - ultimoSync < SYNC_INTERVALO_MS) return;
+  syncDelta().catch((err) => console.warn('[RepFlow SW] Falha no delta sync:', err));
+}
+
+async function syncDelta() {
+  if (syncEmAndamento) return syncEmAndamento;
+  syncEmAndamento = (async () => {
+    const auth = autorizacao || (await getMeta('autorizacao'));
+    if (!auth) return;
+    const token = await getMeta('token');
+    const url = token ? `/api/sync?since=${encodeURIComponent(token)}` : '/api/sync';
+    const response = await fetch(url, { headers: { authorization: auth } });
+    if (response.status === 400) {
+      // token inválido (ex.: formato antigo) — a próxima chamada baixa a carga completa
+      await setMeta('token', null);
+      return;
+    }
+    if (!response.ok) return;
+    const delta = await response.json();
+    await aplicarDelta(delta);
+    ultimoSync = Date.now();
+    console.log(`[RepFlow SW] Delta sync aplicado${delta.completo ? ' (carga completa)' : ''}`);
+  })();
+  try {
+    return await syncEmAndamento;
+  } finally {
+    syncEmAndamento = null;
+  }
+}
+
 // ─────────────────────────────────────────────
 // BACKGROUND SYNC — sincroniza quando volta internet
 // ─────────────────────────────────────────────
 self.addEventListener('sync', (event) => {
   if (event.tag === 'repflow-sync') {
     console.log('[RepFlow SW] Sincronizando requests pendentes...');
-    event.waitUntil(syncPendingRequests());
+    // Primeiro envia a fila offline, depois traz o delta (que já inclui essas gravações)
+    event.waitUntil(syncPendingRequests().then(() => syncDelta()));
   }
 });
 
+// Criações/edições de pedidos e clientes vão juntas em POST /api/batch
+const BATCH_ROUTE = /^\/api\/(pedidos|clientes)(?:\/([0-9a-f]{24}))?$/;
+const BATCH_MAX = 500;
+
+function toBatchOperation(req) {
+  const match = req.pathname.match(BATCH_ROUTE);
+  if (!match || !req.chave || !req.body) return null;
+  const [, colecao, id] = match;
+  let dados;
+  try {
+    dados = JSON.parse(req.body);
+  } catch {
+    return null;
+  }
+  if (req.method === 'POST' && !id) {
+    return { chave: req.chave, operacao: 'criar', colecao, dados };
+  }
+  if (req.method === 'PUT' && id) {
+    return { chave: req.chave, operacao: 'atualizar', colecao, id, dados };
+  }
+  return null;
+}
+
+function notifySynced(req) {
+  self.clients.matchAll().then((clients) => {
+    clients.forEach((client) =>
+      client.postMessage({
+        type: 'SYNC_SUCCESS',
+        pathname: req.pathname,
+        timestamp: req.timestamp,
+      })
+    );
+  });
+}
+
+async function syncBatch(reqs) {
+  for (let i = 0; i < reqs.length; i += BATCH_MAX) {
+    const chunk = reqs.slice(i, i + BATCH_MAX);
+    try {
+      const response = await fetch('/api/batch', {
+        method: 'POST',
+        headers: { ...chunk[0].headers, 'content-type': 'application/json' },
+        body: JSON.stringify({ operacoes: chunk.map(toBatchOperation) }),
+      });
+      if (!response.ok) continue;
+      const { resultados } = await response.json();
+      for (const [idx, resultado] of resultados.entries()) {
+        if (resultado.status >= 200 && resultado.status < 300) {
+          await deletePendingRequest(chunk[idx].id);
+          notifySynced(chunk[idx]);
+        }
+      }
+      console.log(`[RepFlow SW] Lote sincronizado: ${chunk.length} operações`);
+    } catch (err) {
+      console.warn('[RepFlow SW] Falha ao sincronizar lote:', err);
+    }
+  }
+}
+
 async function syncPendingRequests() {
   const pending = await getPendingRequests();
   console.log(`[RepFlow SW] ${pending.length} requests para sincronizar`);
 
-  for (const req of pending) {
+  const batchable = pending.filter((req) => toBatchOperation(req));
+  if (batchable.length) await syncBatch(batchable);
+
+  for (const req of pending.filter((r) => !batchable.includes(r))) {
     try {
       const response = await fetch(req.url, {
         method: req.method,
@@ -262,15 +483,7 @@ async function syncPendingRequests() {
         console.log('[RepFlow SW] Sincronizado:', req.pathname);
 
         // Notifica o frontend sobre a sincronização
-        self.clients.matchAll().then((clients) => {
-          clients.forEach((client) =>
-            client.postMessage({
-              type: 'SYNC_SUCCESS',
-              pathname: req.pathname,
-              timestamp: req.timestamp,
-            })
-          );
-        });
+        notifySynced(req);
       }
     } catch (err) {
       console.warn('[RepFlow SW] Falha ao sincronizar:', req.pathname, err);
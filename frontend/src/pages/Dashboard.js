@@ -75,20 +75,15 @@ const Dashboard = () => {
   const loadAll = async (isRefresh = false) => {
     if (isRefresh) setRefreshing(true); else setLoading(true);
     try {
-      const [statsRes, metasRes, pedidosRes, notasRes] = await Promise.all([
-        api.get('/dashboard/stats'),
-        api.get('/metas'),
-        api.get('/pedidos'),
-        api.get('/notas-fiscais'),
-      ]);
-      setStats(statsRes.data);
-      setTodasNotas(notasRes.data || []);
+      const { data } = await api.get('/bootstrap/dashboard');
+      setStats(data.stats);
+      setTodasNotas(data.notas || []);
 
       const mesAtual = (new Date().getMonth() + 1).toString();
-      const totalMeta = (metasRes.data || []).filter(m => m.mes === mesAtual).reduce((a, m) => a + parseFloat(m.valor_ton || 0), 0);
+      const totalMeta = (data.metas || []).filter(m => m.mes === mesAtual).reduce((a, m) => a + parseFloat(m.valor_ton || 0), 0);
       setMetaGlobal(totalMeta);
 
-      const todos = (pedidosRes.data || []).map(p => ({ ...p, statusReal: getStatusReal(p) }));
+      const todos = (data.pedidos || []).map(p => ({ ...p, statusReal: getStatusReal(p) }));
       setTodosPedidos(todos);
 
       const semanaFiltrados = todos.filter(p => {
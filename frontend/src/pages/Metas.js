@@ -12,14 +12,14 @@ const fmt = (v, c = 1) => new Intl.NumberFormat('pt-BR', { minimumFractionDigits
 const inp = "w-full border border-slate-200 rounded-lg bg-white px-3 py-2 text-sm font-semibold text-slate-800 outline-none focus:border-[#0A3D73] focus:ring-2 focus:ring-[#0A3D73]/10 transition-all";
 const inpSm = "w-full border border-slate-200 rounded-lg bg-white px-3 h-9 text-xs font-semibold text-slate-800 outline-none focus:border-[#0A3D73] transition-all";
 const lbl = "text-xs font-bold uppercase tracking-wide text-slate-400 mb-1 block";
-const FORM_INITIAL = { cliente_id: '', mes: (new Date().getMonth() + 1).toString(), valor_ton: '', ano: 2026 };
+const ANO_ATUAL = new Date().getFullYear();
+const FORM_INITIAL = { cliente_id: '', mes: (new Date().getMonth() + 1).toString(), valor_ton: '', ano: ANO_ATUAL };
 
 const Metas = () => {
   const { isAdmin } = useAuth();
-  const [clientes, setClientes] = useState([]);
+  // Meta × realizado de cada cliente já vem calculado do servidor (/metas/progresso)
+  const [progresso, setProgresso] = useState({ clientes: [] });
   const [metas, setMetas] = useState([]);
-  const [pedidos, setPedidos] = useState([]);
-  const [notas, setNotas] = useState([]);
   const [loading, setLoading] = useState(true);
   const [searchTerm, setSearchTerm] = useState('');
   const [selectedMonth, setSelectedMonth] = useState((new Date().getMonth() + 1).toString());
@@ -27,14 +27,13 @@ const Metas = () => {
   const [editingMeta, setEditingMeta] = useState(null);
   const [formData, setFormData] = useState(FORM_INITIAL);
 
-  useEffect(() => { fetchData(); }, []);
+  useEffect(() => { fetchData(); }, [selectedMonth]); // eslint-disable-line react-hooks/exhaustive-deps
 
   const fetchData = async () => {
     setLoading(true);
     try {
-      const [cliRes, metaRes, pedRes, nfRes] = await Promise.all([api.get('/clientes'), api.get('/metas'), api.get('/pedidos'), api.get('/notas-fiscais')]);
-      setClientes(Array.isArray(cliRes.data)?cliRes.data:[]); setMetas(Array.isArray(metaRes.data)?metaRes.data:[]);
-      setPedidos(Array.isArray(pedRes.data)?pedRes.data:[]); setNotas(Array.isArray(nfRes.data)?nfRes.data:[]);
+      const { data } = await api.get('/bootstrap/metas', { params: { ano: ANO_ATUAL, mes: selectedMonth } });
+      setProgresso(data.progresso?.clientes ? data.progresso : { clientes: [] }); setMetas(Array.isArray(data.metas)?data.metas:[]);
     } catch { toast.error('Erro ao sincronizar dados'); }
     finally { setLoading(false); }
   };
@@ -44,8 +43,8 @@ const Metas = () => {
     if (!isAdmin) return toast.error('Apenas administradores podem definir metas');
     if (!formData.cliente_id || !formData.valor_ton) return toast.error('Selecione o cliente e a tonelagem');
     try {
-      if (editingMeta) { await api.put(`/metas/${editingMeta.id}`, {...formData, ano:2026}); toast.success('Meta atualizada!'); }
-      else { await api.post('/metas', {...formData, ano:2026}); toast.success('Meta cadastrada!'); }
+      if (editingMeta) { await api.put(`/metas/${editingMeta.id}`, {...formData, ano:ANO_ATUAL}); toast.success('Meta atualizada!'); }
+      else { await api.post('/metas', {...formData, ano:ANO_ATUAL}); toast.success('Meta cadastrada!'); }
       setDialogOpen(false); resetForm(); fetchData();
     } catch { toast.error('Erro ao salvar meta'); }
   };
@@ -58,26 +57,15 @@ const Metas = () => {
     }
   };
 
-  const handleEdit = (meta) => { setEditingMeta(meta); setFormData({ cliente_id: meta.cliente_id||'', mes: meta.mes||selectedMonth, valor_ton: String(meta.valor_ton||''), ano: meta.ano||2026 }); setDialogOpen(true); };
+  const handleEdit = (meta) => { setEditingMeta(meta); setFormData({ cliente_id: meta.cliente_id||'', mes: meta.mes||selectedMonth, valor_ton: String(meta.valor_ton||''), ano: meta.ano||ANO_ATUAL }); setDialogOpen(true); };
   const resetForm = () => { setFormData({...FORM_INITIAL, mes: selectedMonth}); setEditingMeta(null); };
 
-  const getNotasDoMes = (mes) => {
-    const mesNum = parseInt(mes);
-    return notas.filter(n => { const dataRef = n.data_emissao || n.criado_em?.substring(0,10); if (!dataRef) return false; const d = new Date(dataRef + 'T00:00:00'); return d.getMonth()+1 === mesNum && d.getFullYear() === 2026; });
-  };
+  const clientes = progresso.clientes.map(c => ({ id: c.cliente_id, nome: c.nome }));
+  const porCliente = Object.fromEntries(progresso.clientes.map(c => [c.cliente_id, c]));
 
   const getProgresso = (clienteId) => {
-    const meta = metas.find(m => m.cliente_id === clienteId && m.mes === selectedMonth);
-    const metaTon = meta ? parseFloat(meta.valor_ton||0) : 0;
-    const cliente = clientes.find(c => c.id === clienteId);
-    const clienteNome = cliente?.nome?.toLowerCase() || '';
-    const notasMes = getNotasDoMes(selectedMonth);
-    const notasCliente = notasMes.filter(n => n.cliente_id === clienteId || (!n.cliente_id && clienteNome && n.cliente_nome?.toLowerCase() === clienteNome));
-    let realizadoKg = 0;
-    for (const nota of notasCliente) { const pedido = pedidos.find(p => p.id === nota.pedido_id); if (pedido) realizadoKg += pedido.peso_total||0; }
-    const realizado = realizadoKg / 1000;
-    const pct = metaTon > 0 ? (realizado/metaTon)*100 : 0;
-    return { meta: metaTon, realizado, pct, metaId: meta?.id };
+    const p = porCliente[clienteId];
+    return { meta: p?.meta || 0, realizado: p?.realizado || 0, pct: p?.pct || 0, metaId: p?.meta_id };
   };
 
   const clientesFiltrados = clientes.filter(c => !searchTerm || c.nome?.toLowerCase().includes(searchTerm.toLowerCase()));
@@ -85,10 +73,10 @@ const Metas = () => {
 
   // Realizado global = soma de TODOS os clientes (com ou sem meta)
   // Clientes sem meta que faturaram também contribuem para o atingimento geral
-  const totalRealizado = clientes.reduce((a,c) => a+getProgresso(c.id).realizado, 0);
+  const totalRealizado = progresso.total_realizado || 0;
 
   const pctGeral = totalMeta > 0 ? (totalRealizado/totalMeta)*100 : 0;
-  const clientesComMeta = clientes.filter(c => getProgresso(c.id).meta > 0).length;
+  const clientesComMeta = progresso.clientes_com_meta || 0;
 
   if (loading) return (
     <div className="flex flex-col items-center justify-center h-[80vh] gap-4">
@@ -103,7 +91,7 @@ const Metas = () => {
       <div className="flex flex-col md:flex-row justify-between items-start md:items-center mb-6 gap-3">
         <div>
           <h1 className="text-2xl font-black text-slate-900 flex items-center gap-2">Performance por Cliente {!isAdmin && <Lock size={14} className="text-slate-400"/>}</h1>
-          <p className="text-xs text-slate-500 font-semibold mt-0.5">Metas de Tonelagem · {MESES[parseInt(selectedMonth)-1]} 2026</p>
+          <p className="text-xs text-slate-500 font-semibold mt-0.5">Metas de Tonelagem · {MESES[parseInt(selectedMonth)-1]} {ANO_ATUAL}</p>
         </div>
         <div className="flex flex-wrap gap-2 items-center">
           <div className="flex items-center bg-white border border-slate-200 rounded-lg h-9 px-3 gap-2 shadow-sm">
@@ -122,7 +110,7 @@ const Metas = () => {
       <div className="flex gap-1 overflow-x-auto pb-2 mb-5">
         {MESES_CURTOS.map((mes, idx) => {
           const m = (idx+1).toString();
-          const temMeta = metas.some(mt => mt.mes === m);
+          const temMeta = metas.some(mt => mt.mes === m && (mt.ano||ANO_ATUAL) === ANO_ATUAL);
           return (
             <button key={mes} onClick={() => setSelectedMonth(m)}
               className={`min-w-[56px] py-2 text-xs font-black uppercase tracking-wide transition-all rounded-lg relative ${selectedMonth===m?'bg-[#0A3D73] text-white shadow-sm':'bg-white text-slate-400 hover:bg-white/80 hover:text-slate-600 border border-slate-200'}`}>
@@ -217,7 +205,7 @@ const Metas = () => {
                     </div>
                   )}
                   {!temMeta && isAdmin && (
-                    <button onClick={() => { setFormData({cliente_id:cliente.id,mes:selectedMonth,valor_ton:'',ano:2026}); setDialogOpen(true); }} className="text-xs font-black text-[#0A3D73] hover:underline flex items-center gap-1">
+                    <button onClick={() => { setFormData({cliente_id:cliente.id,mes:selectedMonth,valor_ton:'',ano:ANO_ATUAL}); setDialogOpen(true); }} className="text-xs font-black text-[#0A3D73] hover:underline flex items-center gap-1">
                       <PlusCircle size={11}/> Definir meta
                     </button>
                   )}
@@ -170,8 +170,8 @@ const NotasFiscais = () => {
 
   const fetchData = async () => {
     try {
-      const [notasRes, vencRes, pedidosRes, matsRes] = await Promise.all([api.get('/notas-fiscais'), api.get('/vencimentos'), api.get('/pedidos'), api.get('/materiais')]);
-      setNotas(notasRes.data || []); setVencimentos(vencRes.data || []); setPedidos(pedidosRes.data || []); setMateriais(matsRes.data || []);
+      const { data } = await api.get('/bootstrap/notas-fiscais');
+      setNotas(data.notas || []); setVencimentos(data.vencimentos || []); setPedidos(data.pedidos || []); setMateriais(data.materiais || []);
     } catch { toast.error('Erro ao carregar dados financeiros'); }
     finally { setLoading(false); }
   };
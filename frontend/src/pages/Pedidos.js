@@ -205,10 +205,10 @@ const Pedidos = () => {
   useEffect(() => {
     const fetchData = async () => {
       try {
-        const [r1, r2, r3] = await Promise.all([api.get('/pedidos'), api.get('/materiais'), api.get('/clientes')]);
-        setPedidos(Array.isArray(r1.data) ? r1.data : []);
-        setMateriais(Array.isArray(r2.data) ? r2.data : []);
-        setClientesBase(Array.isArray(r3.data) ? r3.data : []);
+        const { data } = await api.get('/bootstrap/pedidos');
+        setPedidos(Array.isArray(data.pedidos) ? data.pedidos : []);
+        setMateriais(Array.isArray(data.materiais) ? data.materiais : []);
+        setClientesBase(Array.isArray(data.clientes) ? data.clientes : []);
       } catch { toast.error('Erro ao sincronizar dados'); }
       finally { setLoading(false); }
     };
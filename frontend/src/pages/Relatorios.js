@@ -30,9 +30,14 @@ export default function Relatorios() {
   const token = localStorage.getItem("token");
   const headers = { "Content-Type": "application/json", Authorization: `Bearer ${token}` };
 
-  const [pedidos, setPedidos]   = useState([]);
-  const [clientes, setClientes] = useState([]);
-  const [notas, setNotas]       = useState([]);
+  // Cada relatório já vem calculado do servidor — aqui só chegam as linhas das tabelas
+  const [abc, setAbc]               = useState({ clientes: [], total: 0 });
+  const [faturamento, setFaturamento] = useState({ meses: [], total: 0, ticket_medio: 0 });
+  const [produtos, setProdutos]     = useState([]);
+  const [ciclo, setCiclo]           = useState([]);
+  const [inativos, setInativos]     = useState([]);
+  const [abertos, setAbertos]       = useState({ pedidos: [], quantidade: 0, valor: 0 });
+  const [totalClientes, setTotalClientes] = useState(0);
   const [loading, setLoading]   = useState(true);
   const [anoFiltro, setAnoFiltro] = useState(ANO_ATUAL);
   const [telaAtiva, setTelaAtiva] = useState(null); // null = cards
@@ -43,136 +48,76 @@ export default function Relatorios() {
     const fetch_ = async () => {
       setLoading(true);
       try {
-        const [rP, rC, rN] = await Promise.all([
-          fetch(`${API}/pedidos`, { headers }),
-          fetch(`${API}/clientes`, { headers }),
-          fetch(`${API}/notas-fiscais`, { headers }),
+        const get = (rota) => fetch(`${API}${rota}`, { headers }).then(r => r.ok ? r.json() : null);
+        const [rAbc, rFat, rProd, rCiclo, rInat, rAbertos] = await Promise.all([
+          get(`/relatorios/curva-abc?ano=${anoFiltro}`),
+          get(`/relatorios/faturamento-mensal?ano=${anoFiltro}`),
+          get(`/relatorios/produtos?ano=${anoFiltro}`),
+          get(`/relatorios/ciclo-compra`),
+          get(`/relatorios/clientes-inativos?dias=60`),
+          get(`/relatorios/pedidos-abertos`),
         ]);
-        const pData = await rP.json();
-        const cData = await rC.json();
-        const nData = await rN.json();
-        setPedidos(Array.isArray(pData) ? pData : []);
-        setClientes(Array.isArray(cData) ? cData : []);
-        setNotas(Array.isArray(nData) ? nData : []);
+        if (rAbc) {
+          setAbc(rAbc);
+          setTotalClientes(rAbc.total_clientes || 0);
+        }
+        if (rFat) setFaturamento(rFat);
+        setProdutos(Array.isArray(rProd) ? rProd : []);
+        setCiclo(Array.isArray(rCiclo) ? rCiclo : []);
+        setInativos(Array.isArray(rInat) ? rInat : []);
+        if (rAbertos) setAbertos(rAbertos);
       } catch(e) { console.error(e); }
       setLoading(false);
     };
     fetch_(); // eslint-disable-line react-hooks/exhaustive-deps
-  }, []); // eslint-disable-line react-hooks/exhaustive-deps
+  }, [anoFiltro]); // eslint-disable-line react-hooks/exhaustive-deps
 
   // ── dados processados ──────────────────────────────────
-  const pedidosAno = pedidos.filter(p => {
-    const ano = p.criado_em?.substring(0,4);
-    return ano === String(anoFiltro);
-  });
-
-  const notasAno = notas.filter(n => {
-    const ano = (n.data_emissao || n.criado_em || "").substring(0,4);
-    return ano === String(anoFiltro);
-  });
+  const dataBR = (iso) => iso ? new Date(`${iso}T00:00:00`).toLocaleDateString("pt-BR") : "-";
 
   // faturamento total
-  const faturamentoTotal = notasAno.reduce((a,n) => a + (n.valor_total||0), 0);
+  const faturamentoTotal = faturamento.total || 0;
 
   // pedidos em aberto
-  const pedidosAberto = pedidos.filter(p => ["PENDENTE","IMPLANTADO"].includes(p.status));
+  const pedidosAberto = abertos.pedidos;
 
   // clientes ativos no ano
-  const clientesAtivosSet = new Set(pedidosAno.map(p => p.cliente_nome));
-  const clientesAtivos = clientesAtivosSet.size;
+  const clientesAtivos = abc.clientes.length;
 
   // ticket médio
-  const ticketMedio = notasAno.length ? faturamentoTotal / notasAno.length : 0;
+  const ticketMedio = faturamento.ticket_medio || 0;
 
   // ── 1. Vendas por cliente (comparativo mensal) ─────────
-  const vendasPorCliente = () => {
-    const mapa = {};
-    pedidosAno.forEach(p => {
-      const c = p.cliente_nome || "S/N";
-      const mes = parseInt((p.criado_em||"").substring(5,7)) - 1;
-      if (!mapa[c]) mapa[c] = { total: 0, meses: Array(12).fill(0) };
-      mapa[c].total += p.valor_total||0;
-      if (mes >= 0 && mes < 12) mapa[c].meses[mes] += p.valor_total||0;
-    });
-    const total = Object.values(mapa).reduce((a,v) => a + v.total, 0);
-    return Object.entries(mapa)
-      .map(([nome, d]) => ({ nome, ...d, participacao: total ? d.total/total*100 : 0 }))
-      .sort((a,b) => b.total - a.total);
-  };
+  const vendasPorCliente = () => abc.clientes;
 
   // ── 2. Faturamento por mês ────────────────────────────
   const faturamentoPorMes = () => {
     const arr = Array(12).fill(0);
-    notasAno.forEach(n => {
-      const mes = parseInt((n.data_emissao || n.criado_em || "").substring(5,7)) - 1;
-      if (mes >= 0 && mes < 12) arr[mes] += n.valor_total||0;
-    });
+    faturamento.meses.forEach(m => { arr[m.mes - 1] = m.valor; });
     return MESES.map((m,i) => ({ mes: m, valor: arr[i] }));
   };
 
   // ── 3. Produtos mais vendidos ─────────────────────────
-  const produtosMaisVendidos = () => {
-    const mapa = {};
-    pedidosAno.forEach(p => {
-      const nome = p.item_nome || p.numero_fe || "S/N";
-      if (!mapa[nome]) mapa[nome] = { quantidade: 0, valor: 0 };
-      mapa[nome].quantidade += p.quantidade||0;
-      mapa[nome].valor += p.valor_total||0;
-    });
-    return Object.entries(mapa)
-      .map(([nome, d]) => ({ nome, ...d }))
-      .sort((a,b) => b.valor - a.valor)
-      .slice(0, 15);
-  };
+  const produtosMaisVendidos = () => produtos;
 
   // ── 4. Frequência de compra ───────────────────────────
-  const frequenciaCompra = () => {
-    const mapa = {};
-    pedidos.forEach(p => {
-      const c = p.cliente_nome || "S/N";
-      if (!mapa[c]) mapa[c] = { pedidos: [], datas: [] };
-      mapa[c].pedidos.push(p);
-      if (p.criado_em) mapa[c].datas.push(new Date(p.criado_em));
-    });
-    return Object.entries(mapa).map(([nome, d]) => {
-      const datas = d.datas.sort((a,b) => a-b);
-      let cicloMedio = 0;
-      if (datas.length > 1) {
-        const diffs = [];
-        for (let i=1; i<datas.length; i++) diffs.push((datas[i]-datas[i-1])/(1000*60*60*24));
-        cicloMedio = diffs.reduce((a,v) => a+v, 0) / diffs.length;
-      }
-      const ultimaCompra = datas[datas.length-1];
-      const diasSemComprar = ultimaCompra ? Math.floor((new Date()-ultimaCompra)/(1000*60*60*24)) : 999;
-      return { nome, totalPedidos: d.pedidos.length, cicloMedio: Math.round(cicloMedio), diasSemComprar, ultimaCompra: ultimaCompra?.toLocaleDateString("pt-BR") || "-" };
-    }).sort((a,b) => b.totalPedidos - a.totalPedidos);
-  };
+  const linhaFrequencia = (c) => ({
+    nome: c.nome,
+    totalPedidos: c.total_pedidos,
+    cicloMedio: c.ciclo_medio,
+    diasSemComprar: c.dias_sem_comprar,
+    ultimaCompra: dataBR(c.ultima_compra),
+  });
+  const frequenciaCompra = () => ciclo.map(linhaFrequencia);
 
   // ── 5. Curva ABC ──────────────────────────────────────
-  const curvaABC = () => {
-    const dados = vendasPorCliente();
-    const total = dados.reduce((a,d) => a + d.total, 0);
-    let acumulado = 0;
-    return dados.map(d => {
-      acumulado += d.total;
-      const pctAcum = total ? acumulado/total*100 : 0;
-      const classe = pctAcum <= 80 ? "A" : pctAcum <= 95 ? "B" : "C";
-      return { ...d, pctAcumulado: pctAcum, classe };
-    });
-  };
+  const curvaABC = () => abc.clientes.map(d => ({ ...d, pctAcumulado: d.pct_acumulado }));
 
   // ── 6. Clientes inativos ──────────────────────────────
-  const clientesInativos = () => {
-    const freq = frequenciaCompra();
-    return freq
-      .filter(c => c.diasSemComprar > 60)
-      .sort((a,b) => b.diasSemComprar - a.diasSemComprar);
-  };
+  const clientesInativos = () => inativos.map(linhaFrequencia);
 
   // ── 7. Pedidos em aberto ──────────────────────────────
-  const pedidosEmAberto = () => {
-    return pedidosAberto.sort((a,b) => new Date(b.criado_em) - new Date(a.criado_em));
-  };
+  const pedidosEmAberto = () => abertos.pedidos;
 
   // ── imprimir ──────────────────────────────────────────
   const imprimir = () => window.print();
@@ -530,7 +475,7 @@ export default function Relatorios() {
       id: "frequencia", icon: RefreshCw, cor: "#0891B2", corL: "#ECFEFF",
       titulo: "Frequência de Compra",
       desc: "Ciclo médio e dias desde a última compra",
-      valor: `${clientesAtivos} ativos`, label: `de ${clientes.length} clientes`,
+      valor: `${clientesAtivos} ativos`, label: `de ${totalClientes} clientes`,
     },
     {
       id: "abc", icon: TrendingUp, cor: "#D97706", corL: C.amareloL,
@@ -548,7 +493,7 @@ export default function Relatorios() {
       id: "aberto", icon: FileText, cor: "#0A3D73", corL: "#EFF6FF",
       titulo: "Pedidos em Aberto",
       desc: "Pendentes e implantados aguardando faturamento",
-      valor: `${pedidosAberto.length} pedidos`, label: `${brl(pedidosAberto.reduce((a,p)=>a+(p.valor_total||0),0))} em aberto`,
+      valor: `${pedidosAberto.length} pedidos`, label: `${brl(abertos.valor)} em aberto`,
     },
   ];
 
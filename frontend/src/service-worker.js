@@ -39,7 +39,8 @@ registerRoute(
     url.pathname.startsWith('/api/materiais') ||
     url.pathname.startsWith('/api/pedidos') ||
     url.pathname.startsWith('/api/dashboard') ||
-    url.pathname.startsWith('/api/metas'),
+    url.pathname.startsWith('/api/metas') ||
+    url.pathname.startsWith('/api/bootstrap'),
   new NetworkFirst({
     cacheName: 'repflow-api-v1',
     plugins: [],
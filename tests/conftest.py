@@ -0,0 +1,56 @@
+import os
+import shutil
+import socket
+import subprocess
+import sys
+
+import pytest
+
+# O backend não é um pacote: os módulos se importam pelo nome (from cache import ...)
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+os.environ.setdefault("ENVIRONMENT", "test")
+
+
+@pytest.fixture
+def db():
+    """Banco em memória (mongomock) no lugar do MongoDB da API."""
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    import main
+
+    cliente = mongomock_motor.AsyncMongoMockClient()
+    main.client = cliente
+    main.db = cliente["erp_test"]
+    return main.db
+
+
+@pytest.fixture(scope="session")
+def mongodb_url(tmp_path_factory):
+    """
+    MongoDB de verdade (explain() não existe no mongomock): MONGODB_TEST_URL,
+    ou um mongod do PATH iniciado num diretório temporário.
+    """
+    url = os.getenv("MONGODB_TEST_URL")
+    if url:
+        yield url
+        return
+    mongod = shutil.which("mongod")
+    if mongod is None:
+        pytest.skip("mongod não encontrado no PATH e MONGODB_TEST_URL não definido")
+
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        porta = s.getsockname()[1]
+    processo = subprocess.Popen(
+        [mongod, "--dbpath", str(tmp_path_factory.mktemp("mongod")), "--port", str(porta), "--bind_ip", "127.0.0.1"],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    url = f"mongodb://127.0.0.1:{porta}"
+    try:
+        from pymongo import MongoClient
+
+        MongoClient(url, serverSelectionTimeoutMS=15000).admin.command("ping")
+        yield url
+    finally:
+        processo.terminate()
+        processo.wait(timeout=30)
@@ -0,0 +1,31 @@
+import asyncio
+
+import main
+
+
+def test_lote_recusado_vai_para_o_arquivo_e_volta_ao_banco(db, tmp_path, monkeypatch):
+    async def sem_espera(_):
+        pass
+
+    monkeypatch.setattr(main.asyncio, "sleep", sem_espera)
+    escritor = main.EscritorAuditoria(10, 0.01, 100, str(tmp_path / "pendentes.jsonl"))
+    # mongomock_motor cria um objeto de coleção a cada acesso: o patch vai na classe
+    colecao = type(db.auditoria)
+    inserir = colecao.insert_many
+
+    async def fora_do_ar(*args, **kwargs):
+        raise ConnectionError("banco indisponível")
+
+    monkeypatch.setattr(colecao, "insert_many", fora_do_ar)
+    lote = [{"acao": "DELETE", "timestamp": main.datetime.now(main.timezone.utc)} for _ in range(3)]
+    asyncio.run(escritor._gravar(lote))
+
+    assert (tmp_path / "pendentes.jsonl").read_text().count("\n") == 3
+    assert asyncio.run(db.auditoria.count_documents({})) == 0
+
+    monkeypatch.setattr(colecao, "insert_many", inserir)
+    asyncio.run(escritor._gravar([{"acao": "CREATE"}]))
+
+    assert asyncio.run(db.auditoria.count_documents({"acao": "DELETE"})) == 3
+    assert asyncio.run(db.auditoria.count_documents({})) == 4
+    assert list(tmp_path.iterdir()) == []
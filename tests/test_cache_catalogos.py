@@ -0,0 +1,28 @@
+import asyncio
+
+import main
+
+
+def test_catalogo_recarrega_quando_outro_worker_grava(db):
+    async def cenario():
+        main.cache_catalogos.invalidar("materiais")
+        await db.materiais.insert_one({"numero_fe": "FE-1", "deletado": False})
+
+        async def carregar():
+            return sorted([m["numero_fe"] async for m in db.materiais.find(main.FILTRO_ATIVO)])
+
+        def listar():
+            return main.obter_catalogo("materiais", (None, None, "numero_fe"), carregar)
+
+        antes = await listar()
+        # Outro processo grava e avança a versão, sem passar pelo cache deste
+        await db.materiais.insert_one({"numero_fe": "FE-2", "deletado": False})
+        em_cache = await listar()
+        await db.versoes.update_one({"_id": "materiais"}, {"$inc": {"versao": 1}}, upsert=True)
+        depois = await listar()
+        return antes, em_cache, depois
+
+    antes, em_cache, depois = asyncio.run(cenario())
+
+    assert antes == em_cache == ["FE-1"]
+    assert depois == ["FE-1", "FE-2"]
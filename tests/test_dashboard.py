@@ -0,0 +1,22 @@
+import asyncio
+from datetime import datetime, timezone
+
+import main
+
+
+def test_comissao_prevista_soma_itens_do_pedido(db):
+    agora = datetime.now(timezone.utc)
+    asyncio.run(db.pedidos.insert_one({
+        "deletado": False,
+        "status": "PENDENTE",
+        "criado_em": agora,
+        "data_entrega": main.para_data(agora.date()),
+        "peso_total": 1000,
+        "valor_total": 500,
+        "itens": [{"comissao_valor": 10.0}, {"comissao_valor": 2.5}],
+    }))
+
+    dashboard = asyncio.run(main.calcular_dashboard())
+
+    assert dashboard["comissao_prevista"] == 12.5
+    assert dashboard["comissoes_a_receber"] == 12.5
@@ -0,0 +1,50 @@
+import asyncio
+from datetime import datetime, timezone
+
+import main
+
+ADMIN = {"email": "admin@teste.com", "role": "admin"}
+
+
+def test_fix_cliente_ids_move_totais_do_rollup_para_o_cliente(db):
+    async def cenario():
+        cliente = await db.clientes.insert_one({"nome": "Embalagens Silva", "nome_normalizado": "EMBALAGENS SILVA"})
+        cliente_id = str(cliente.inserted_id)
+        pedido = {
+            "cliente_id": "",
+            "cliente_nome": "Embalagens Silva",
+            "numero_fe": "FE-1",
+            "status": "NF_EMITIDA",
+            "deletado": False,
+            "data_entrega": datetime(2026, 3, 10, tzinfo=timezone.utc),
+            "valor_total": 1000.0,
+            "peso_total": 500.0,
+            "itens": [{"comissao_valor": 30.0}],
+        }
+        pedido_id = str((await db.pedidos.insert_one(pedido)).inserted_id)
+        nota = {
+            "pedido_id": pedido_id,
+            "cliente_id": None,
+            "cliente_nome": "Embalagens Silva",
+            "numero_fe": "FE-1",
+            "data_emissao": datetime(2026, 3, 12, tzinfo=timezone.utc),
+            "valor_total": 1000.0,
+            "peso_total": 500.0,
+            "comissao_total": 30.0,
+        }
+        await db.notas_fiscais.insert_one(nota)
+        await main.aplicar_rollup(adicionar=[main.contribuicao_pedido(pedido), main.contribuicao_nota(nota)])
+
+        await main.fix_cliente_ids(admin=ADMIN)
+
+        linhas = await db.rollup_mensal.find({"ano": 2026, "mes": 3}, {"_id": 0}).to_list(length=None)
+        return cliente_id, {linha["cliente_id"]: linha for linha in linhas}
+
+    cliente_id, rollup = asyncio.run(cenario())
+
+    assert rollup[cliente_id]["pedidos_qtd"] == 1
+    assert rollup[cliente_id]["pedidos_valor"] == 1000.0
+    assert rollup[cliente_id]["nf_qtd"] == 1
+    assert rollup[cliente_id]["comissao_realizada"] == 30.0
+    assert rollup[""]["pedidos_qtd"] == 0
+    assert rollup[""]["nf_qtd"] == 0
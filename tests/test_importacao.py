@@ -0,0 +1,93 @@
+import asyncio
+import io
+from types import SimpleNamespace
+
+import openpyxl
+import pytest
+from fastapi import HTTPException
+from pymongo.errors import BulkWriteError
+
+import importacao
+import main
+
+ADMIN = {"email": "admin@teste.com", "role": "admin"}
+
+
+def _planilha(*linhas) -> SimpleNamespace:
+    wb = openpyxl.Workbook()
+    wb.active.append(["", "", "", "Produto (FE)", "Referência", "PESO", "Vl. (milheiro)"])
+    for linha in linhas:
+        wb.active.append(linha)
+    arquivo = io.BytesIO()
+    wb.save(arquivo)
+    arquivo.seek(0)
+    return SimpleNamespace(file=arquivo, filename="materiais.xlsx")
+
+
+def test_importa_materiais(db):
+    resposta = asyncio.run(main.importar_arquivo(
+        "materiais", arquivo=_planilha(["", "", "", "FE-1-CX", "Caixa 1", 0.5, 1200]), admin=ADMIN
+    ))
+
+    assert resposta["importados"] == 1
+    assert asyncio.run(db.materiais.count_documents({"numero_fe": "FE-1-CX"})) == 1
+
+
+def test_planilha_com_dado_invalido_responde_400_e_audita_o_parcial(db, monkeypatch):
+    # um documento por insert_many: a 1ª linha já está gravada quando a 2ª falha
+    monkeypatch.setitem(importacao.importar_planilha.__kwdefaults__, "lote", 1)
+    auditorias = []
+
+    async def registrar_auditoria(**kwargs):
+        auditorias.append(kwargs)
+
+    monkeypatch.setattr(main, "registrar_auditoria", registrar_auditoria)
+    planilha = _planilha(
+        ["", "", "", "FE-1-CX", "Caixa 1", 0.5, 1200],
+        ["", "", "", "FE-2-CX", "Caixa 2", "meio quilo", 1200],
+    )
+
+    with pytest.raises(HTTPException) as erro:
+        asyncio.run(main.importar_arquivo("materiais", arquivo=planilha, admin=ADMIN))
+
+    assert erro.value.status_code == 400
+    assert "linha 3" in erro.value.detail
+    assert "1 materiais já importados" in erro.value.detail
+    assert "1 importados" in auditorias[0]["detalhes"]
+
+
+class _ColecaoComErro:
+    """insert_many que falha como o MongoDB: o 1º documento entra, o 2º é recusado com `codigo`."""
+
+    def __init__(self, codigo: int):
+        self.codigo = codigo
+
+    def find(self, *args, **kwargs):
+        return _CursorVazio()
+
+    async def insert_many(self, docs, ordered=False):
+        raise BulkWriteError({"nInserted": 1, "writeErrors": [{"index": 1, "code": self.codigo, "errmsg": "erro"}]})
+
+
+class _CursorVazio:
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        raise StopAsyncIteration
+
+
+def _duas_linhas():
+    return _planilha(["", "", "", "FE-1-CX", "Caixa 1", 0.5, 1200], ["", "", "", "FE-2-CX", "Caixa 2", 0.5, 1200]).file
+
+
+def test_chave_gravada_por_outro_processo_conta_como_duplicado():
+    db = {"materiais": _ColecaoComErro(11000)}
+    resultado = asyncio.run(importacao.importar_planilha(db, "materiais", _duas_linhas()))
+    assert (resultado.importados, resultado.duplicados) == (1, 1)
+
+
+def test_outros_erros_de_gravacao_nao_sao_engolidos():
+    db = {"materiais": _ColecaoComErro(121)}
+    with pytest.raises(BulkWriteError):
+        asyncio.run(importacao.importar_planilha(db, "materiais", _duas_linhas()))
@@ -0,0 +1,39 @@
+"""
+Consultas quentes x índices: com o registro migracoes.INDICES aplicado, o
+explain() de nenhum formato em CONSULTAS_INDEXADAS pode ter COLLSCAN no plano
+vencedor. Roda num MongoDB real (fixture mongodb_url), num banco descartável.
+"""
+
+import asyncio
+import uuid
+
+import migracoes
+
+
+def _explain(mongodb_url: str, consultas) -> list:
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    async def cenario():
+        client = AsyncIOMotorClient(mongodb_url, tz_aware=True)
+        nome = f"teste_indices_{uuid.uuid4().hex[:8]}"
+        db = client[nome]
+        try:
+            await migracoes.aplicar_indices(db)
+            # Coleção vazia/inexistente dá plano EOF — com um documento o planner escolhe de verdade
+            for colecao in {c for c, _, _ in consultas}:
+                await db[colecao].insert_one({"deletado": False})
+            return await migracoes.verificar_ativos(db, consultas)
+        finally:
+            await client.drop_database(nome)
+            client.close()
+
+    return asyncio.run(cenario())
+
+
+def test_consultas_registradas_sem_collscan(mongodb_url):
+    assert _explain(mongodb_url, migracoes.CONSULTAS_INDEXADAS) == []
+
+
+def test_consulta_sem_indice_e_reportada(mongodb_url):
+    falhas = _explain(mongodb_url, [("pedidos", {"observacoes": "x"}, None)])
+    assert "pedidos.find({'observacoes': 'x'})" in falhas
@@ -0,0 +1,30 @@
+import asyncio
+
+import main
+
+USUARIO = {"email": "vendedor@teste.com", "role": "vendedor"}
+DADOS = {"nome": "Cliente Novo", "cnpj": "11.111.111/0001-11", "cidade": "Curitiba"}
+
+
+def test_atualizacao_que_nao_casa_no_bulk_write_responde_404(db, monkeypatch):
+    ids = asyncio.run(db.clientes.insert_many([
+        {"nome": f"Cliente {n}", "cnpj": f"cnpj-{n}", "cidade": "X", "deletado": False} for n in range(2)
+    ])).inserted_ids
+    colecao = type(db.clientes)
+    bulk_write = colecao.bulk_write
+
+    async def excluido_antes_de_gravar(self, *args, **kwargs):
+        # outra requisição exclui o 1º cliente entre a leitura e a gravação do lote
+        await db.clientes.update_one({"_id": ids[0]}, {"$set": {"deletado": True}})
+        return await bulk_write(self, *args, **kwargs)
+
+    monkeypatch.setattr(colecao, "bulk_write", excluido_antes_de_gravar)
+    lote = main.LoteMutacaoSchema(operacoes=[
+        {"chave": f"k{n}", "operacao": "atualizar", "colecao": "clientes", "id": str(oid), "dados": DADOS}
+        for n, oid in enumerate(ids)
+    ])
+    resposta = asyncio.run(main.executar_lote(lote, usuario=USUARIO))
+
+    assert [r["status"] for r in resposta["resultados"]] == [404, 200]
+    assert asyncio.run(db.clientes.find_one({"_id": ids[0]}))["nome"] == "Cliente 0"
+    assert asyncio.run(db.auditoria.count_documents({"documento_id": str(ids[0])})) == 0
@@ -0,0 +1,17 @@
+import pytest
+from fastapi import HTTPException
+
+import main
+
+
+def test_projecao_inclui_campo_de_ordenacao():
+    assert main.projecao_campos("nome, cnpj", "criado_em") == {"nome": 1, "cnpj": 1, "criado_em": 1}
+    assert main.projecao_campos("itens.descricao") == {"itens.descricao": 1, "_id": 1}
+    assert main.projecao_campos(None) is None
+
+
+@pytest.mark.parametrize("fields", ["$where", "nome,,cnpj", "nome,", "itens.$", "itens..x", "a b", "itens,itens.descricao"])
+def test_projecao_invalida_responde_400(fields):
+    with pytest.raises(HTTPException) as erro:
+        main.projecao_campos(fields)
+    assert erro.value.status_code == 400
@@ -0,0 +1,47 @@
+import asyncio
+from datetime import datetime, timezone
+
+import main
+
+
+def test_nota_sem_peso_usa_o_peso_do_pedido(db):
+    async def cenario():
+        pedido_id = str((await db.pedidos.insert_one({"peso_total": 750.0, "deletado": False})).inserted_id)
+        nota = {
+            "pedido_id": pedido_id,
+            "cliente_id": "c1",
+            "numero_fe": "FE-1",
+            "data_emissao": datetime(2026, 4, 2, tzinfo=timezone.utc),
+            "valor_total": 100.0,
+        }
+        await main.aplicar_rollup(adicionar=await main.contribuicoes_notas([nota]))
+        adicionada = await db.rollup_mensal.find_one({"ano": 2026, "mes": 4})
+        await main.aplicar_rollup(remover=await main.contribuicoes_notas([nota]))
+        removida = await db.rollup_mensal.find_one({"ano": 2026, "mes": 4})
+        return adicionada, removida
+
+    adicionada, removida = asyncio.run(cenario())
+
+    assert adicionada["faturado_peso"] == 750.0
+    assert removida["faturado_peso"] == 0
+    assert removida["nf_qtd"] == 0
+
+
+def test_dashboard_le_o_faturado_do_rollup(db):
+    agora = datetime.now(timezone.utc)
+    nota = {
+        "pedido_id": "",
+        "cliente_id": "c1",
+        "numero_fe": "FE-1",
+        "data_emissao": agora,
+        "valor_total": 2000.0,
+        "peso_total": 1500.0,
+        "comissao_total": 60.0,
+    }
+    asyncio.run(main.aplicar_rollup(adicionar=[main.contribuicao_nota(nota)]))
+
+    dashboard = asyncio.run(main.calcular_dashboard())
+
+    assert dashboard["tonelagem_faturada"] == 1.5
+    assert dashboard["faturado_mes_valor"] == 2000.0
+    assert dashboard["comissao_realizada"] == 60.0
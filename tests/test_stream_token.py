@@ -0,0 +1,21 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+import main
+
+USUARIO = {"email": "vendedor@teste.com", "role": "vendedor"}
+
+
+def test_stream_aceita_so_o_token_de_escopo_na_url():
+    token = asyncio.run(main.gerar_token_stream(usuario=USUARIO))["token"]
+
+    assert main.verificar_token_stream(token=token, credentials=None) == USUARIO
+    # o token do stream não abre o resto da API
+    with pytest.raises(HTTPException):
+        main.decodificar_token(token)
+
+    sessao = main.criar_token({"sub": USUARIO["email"], "role": USUARIO["role"]})
+    with pytest.raises(HTTPException):
+        main.verificar_token_stream(token=sessao, credentials=None)